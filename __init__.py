@@ -1,6 +1,5 @@
 import ui
 import database
-import os
 
 # connects to setup database
 setup = database.Setup()
@@ -9,10 +8,8 @@ setup = database.Setup()
 if not setup.active_provider():
     ui.NewProviderWindow(setup)
 
-# select active provider for opening screen
-db = setup.active_provider()[0][1]
-# connects provider database
-base = database.Db(os.getcwd() + db)
+# connects provider databases, starting with the active provider
+providers = database.ProviderConnections(setup)
 
 # starts app
-app = ui.MainWindow(base, setup)
+app = ui.MainWindow(providers, setup)
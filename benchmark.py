@@ -0,0 +1,846 @@
+"""Benchmarks for the database and pdf layer
+
+Usage: python benchmark.py <benchmark> [options]
+Every benchmark works on temporary provider databases and never touches databases/.
+"""
+import argparse
+import filecmp
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import database
+
+
+def populate(db, n_services, services_per_sc=100, billed_share=0.5, vocabulary=None):
+    """Fills a provider database with generated customers, service complexes, services and bills
+
+    Service descriptions are "Leistung <id>" or, with a vocabulary, three random words of it.
+    """
+    n_sc = max(1, n_services // services_per_sc)
+    n_customers = max(1, n_sc // 10)
+    rng = random.Random(0)
+    db.cursor.execute("INSERT INTO provider(taxId, firstName, lastName, gender, street, number, postalCode, place, telephone, email, iban, bic, website, active) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                      ("12/345/67890", "Max", "Mustermann", 1, "Hauptstraße", "1", "12345", "Musterstadt", "0123 456789", "max@example.org", "DE00 0000 0000 0000 0000 00", "GENODEF1XXX", "example.org", True))
+    db.cursor.executemany("INSERT INTO customer VALUES (?,?,?,?,?,?,?,?,?)",
+                          ((i, f"Vorname{i}", f"Nachname{i}", i % 3, f"Institution{i}" if i % 2 else "", "Straße", str(i), "12345", "Ort") for i in range(n_customers)))
+    db.cursor.executemany("INSERT INTO serviceComplex VALUES (?,?)", ((i, i % n_customers) for i in range(n_sc)))
+    db.cursor.executemany("INSERT INTO service VALUES (?,?,?,?,?,?,?,?)",
+                          ((i, i % n_sc, " ".join(rng.choices(vocabulary, k=3)) if vocabulary else f"Leistung {i}", rng.randint(10, 500), rng.choice((0, 0, 5.5)), rng.randint(1, 28), rng.randint(1, 12), rng.randint(2015, 2022)) for i in range(n_services)))
+    db.cursor.executemany("INSERT INTO bill VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                          ((i, i, 1, rng.randint(1, 28), rng.randint(1, 12), 2015 + i % 8, f"Rechnung {i}", "", True, True, i % 3 == 0) for i in range(int(n_sc * billed_share))))
+    db.cursor.execute("INSERT OR REPLACE INTO billNumber SELECT year, MAX(id) FROM bill GROUP BY year")
+    db.conn.commit()
+
+
+def temporary_db(n_services, profile=database.DEFAULT_PROFILE, **kwargs):
+    """Creates and populates a provider database in a temporary directory"""
+    directory = tempfile.mkdtemp()
+    db = database.Db(os.path.join(directory, "benchmark.rmdb"), profile)
+    populate(db, n_services, **kwargs)
+    return db
+
+
+class QueryCounter:
+    """Counts the statements a connection executes"""
+    def __init__(self, conn):
+        self.conn = conn
+        self.count = 0
+
+    def __enter__(self):
+        self.count = 0
+        self.conn.set_trace_callback(self.trace)
+        return self
+
+    def __exit__(self, *args):
+        self.conn.set_trace_callback(None)
+
+    def trace(self, statement):
+        self.count += 1
+
+
+def legacy_table_query(db, base_query, sum_query):
+    """Reproduces the former one-query-per-row table queries"""
+    db.cursor.execute(base_query)
+    res = db.cursor.fetchall()
+    res_add = []
+    for i in res:
+        db.cursor.execute(sum_query.format(i[0]))
+        res_add.append(db.cursor.fetchall()[0])
+    return [[*res[i], *res_add[i]] for i in range(len(res))]
+
+
+_LEGACY_TABLE_QUERIES = {
+    "sc_table_query": (
+        "SELECT serviceComplex.id, customer.lastName, customer.institution from customer, serviceComplex WHERE (serviceComplex.id NOT IN (SELECT serviceComplexId FROM bill) AND customer.id = serviceComplex.CustomerId)",
+        "SELECT COUNT(*), SUM(price) + SUM(additionalPrice) FROM service WHERE serviceComplexId = {}"
+    ),
+    "bill_table_query": (
+        "SELECT bill.id, bill.year, customer.lastName, customer.institution, bill.keyword from customer, bill, serviceComplex WHERE (bill.serviceComplexId = serviceComplex.id AND customer.id = serviceComplex.customerId AND bill.paid = FALSE)",
+        "SELECT SUM(price) + SUM(additionalPrice) FROM service WHERE serviceComplexId = (SELECT serviceComplexId FROM bill WHERE id = {})"
+    ),
+    "all_bills_table_query": (
+        "SELECT bill.id, bill.year, customer.lastName, customer.institution, bill.keyword from customer, bill, serviceComplex WHERE (bill.serviceComplexId = serviceComplex.id AND customer.id = serviceComplex.customerId)",
+        "SELECT SUM(price) + SUM(additionalPrice) FROM service WHERE serviceComplexId = (SELECT serviceComplexId FROM bill WHERE id = {})"
+    ),
+}
+
+
+def measure(db, function):
+    with QueryCounter(db.conn) as counter:
+        start = time.perf_counter()
+        rows = function()
+        duration = time.perf_counter() - start
+    return len(rows), counter.count, duration
+
+
+def bench_table_queries(args):
+    print(f"{'services':>9} {'query':<22} {'variant':<8} {'rows':>7} {'queries':>8} {'seconds':>9}")
+    for n_services in args.sizes:
+        db = temporary_db(n_services)
+        for name, (base_query, sum_query) in _LEGACY_TABLE_QUERIES.items():
+            rows, count, duration = measure(db, getattr(db, name))
+            print(f"{n_services:>9} {name:<22} {'joined':<8} {rows:>7} {count:>8} {duration:>9.4f}")
+            if n_services <= args.legacy_limit:
+                rows, count, duration = measure(db, lambda: legacy_table_query(db, base_query, sum_query))
+                print(f"{n_services:>9} {name:<22} {'legacy':<8} {rows:>7} {count:>8} {duration:>9.4f}")
+            # First keyset page, what a virtual table loads to show the table
+            table = name[:-len("_query")]
+            start_key = (-1,) if table == "sc_table" else (-1, -1)
+            rows, count, duration = measure(db, lambda: db.table_page(table, start_key, 100))
+            print(f"{n_services:>9} {name:<22} {'page':<8} {rows:>7} {count:>8} {duration:>9.4f}")
+
+
+def rows_per_second(n_rows, function):
+    start = time.perf_counter()
+    function()
+    return n_rows / (time.perf_counter() - start)
+
+
+def bench_writes(args):
+    """Rows per second of the per-call mutators against the transaction block and the bulk variants"""
+    db = temporary_db(args.size)
+    services = [(1, f"Leistung {i}", 50.0, 0.0, 1, 1, 2022) for i in range(args.rows)]
+    db.cursor.execute("SELECT id, year FROM bill")
+    bills = [(bill_id, year, True, True) for bill_id, year in db.cursor.fetchall()][:args.rows]
+
+    def per_call_services():
+        for service in services:
+            db.new_service(*service)
+
+    def transaction_services():
+        with db.transaction():
+            per_call_services()
+
+    def per_call_bills():
+        for bill in bills:
+            db.update_bill(*bill)
+
+    def transaction_bills():
+        with db.transaction():
+            per_call_bills()
+
+    print(f"{'operation':<12} {'variant':<12} {'rows':>6} {'rows/s':>10}")
+    for operation, n_rows, variants in (
+            ("new_service", len(services), (("per call", per_call_services), ("transaction", transaction_services), ("bulk", lambda: db.new_services(services)))),
+            ("update_bill", len(bills), (("per call", per_call_bills), ("transaction", transaction_bills), ("bulk", lambda: db.update_bills(bills))))):
+        for variant, function in variants:
+            print(f"{operation:<12} {variant:<12} {n_rows:>6} {rows_per_second(n_rows, function):>10.0f}")
+
+
+def bench_profiles(args):
+    """Mixed workload: one writer adding services while readers refresh the open bill table"""
+    print(f"{'profile':<10} {'writes/s':>9} {'reads/s':>9}")
+    for profile in database.PROFILES:
+        db = temporary_db(args.size, profile)
+        path = db.conn.execute("PRAGMA database_list").fetchall()[0][2]
+        db.close()
+        stop = threading.Event()
+        counts = {"write": 0, "read": 0}
+
+        def writer():
+            db = database.Db(path, profile)
+            while not stop.is_set():
+                db.new_service(1, "Leistung", 50.0, 0.0, 1, 1, 2022)
+                counts["write"] += 1
+            db.close()
+
+        def reader():
+            db = database.Db(path, profile)
+            while not stop.is_set():
+                db.bill_table_query()
+                db.services_of_sc(1)
+                counts["read"] += 1
+            db.close()
+
+        threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(args.readers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        print(f"{profile:<10} {counts['write'] / args.seconds:>9.0f} {counts['read'] / args.seconds:>9.0f}")
+
+
+def bench_statements(args):
+    """Repeated service_info calls with SQL text per id against the named, parameterized statement
+
+    Every service id gives the f-string variant a distinct SQL text. There are more of them than the
+    statement cache holds, so each of its calls parses its statement, while the named one is parsed once.
+    """
+    db = temporary_db(args.size)
+    service_ids = [i % args.size for i in range(args.calls)]
+
+    start = time.perf_counter()
+    for service_id in service_ids:
+        db.cursor.execute(f"SELECT description, price, additionalPrice, day, month, year FROM service WHERE id = {service_id}")
+        db.cursor.fetchall()
+        db.commit()
+    formatted = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for service_id in service_ids:
+        db.service_info(service_id)
+    named = time.perf_counter() - start
+
+    print(f"{args.calls} service_info calls over {min(args.size, args.calls)} distinct ids")
+    print(f"{'f-string SQL':<14} {formatted:>8.4f} s {formatted / args.calls * 1e6:>8.1f} us/call")
+    print(f"{'named':<14} {named:>8.4f} s {named / args.calls * 1e6:>8.1f} us/call")
+    print("statement cache:", db.statements.stats())
+
+
+def reportlab_fonts():
+    """Vera fonts shipped with reportlab in place of the fonts the PDFs use, so benchmarks run anywhere"""
+    import reportlab
+    directory = os.path.join(os.path.dirname(reportlab.__file__), "fonts")
+    return {
+        "Arial": os.path.join(directory, "Vera.ttf"),
+        "ArialBd": os.path.join(directory, "VeraBd.ttf"),
+        "Vera": os.path.join(directory, "Vera.ttf"),
+    }
+
+
+def bench_fonts(args):
+    """Per PDF cost of registering the fonts for every PDF against once per process"""
+    import pdfcreator
+    pdfcreator.configure_fonts(reportlab_fonts())
+    db = temporary_db(args.invoices * 20, services_per_sc=10, billed_share=1.0)
+    data = list(db.bills_render_data(db.bill_keys()).values())[:args.invoices]
+    directory = tempfile.mkdtemp()
+
+    def render(register_every_pdf):
+        start = time.perf_counter()
+        for i, rows in enumerate(data):
+            if register_every_pdf:
+                pdfcreator._registered_fonts.clear()
+            pdfcreator.Bill.from_data(*rows, os.path.join(directory, f"{i}.pdf")).save()
+        return (time.perf_counter() - start) / len(data)
+
+    print(f"{len(data)} invoices")
+    print(f"{'fonts registered':<22} {'ms/pdf':>8}")
+    print(f"{'for every pdf':<22} {render(True) * 1000:>8.2f}")
+    print(f"{'once per process':<22} {render(False) * 1000:>8.2f}")
+
+
+def bench_layout(args):
+    """Invoices with many service lines: time per line stays the same as the invoice grows"""
+    import pdfcreator
+    pdfcreator.configure_fonts(reportlab_fonts())
+    db = temporary_db(100, services_per_sc=10, billed_share=1.0)
+    provider, bill, customer, _ = next(iter(db.bills_render_data(db.bill_keys()).values()))
+    directory = tempfile.mkdtemp()
+    random.seed(3)
+
+    print(f"{'lines':>7} {'pages':>6} {'seconds':>8} {'us/line':>8}")
+    for lines in args.lines:
+        # Every tenth description is long enough to wrap
+        services = tuple(
+            (i, bill[1], f"Leistung {i}" + " mit ausführlicher Beschreibung" * (4 if i % 10 == 0 else 0),
+             random.randint(1, 500), random.choice([0, 0, 5]), 1, 1, 2022)
+            for i in range(lines)
+        )
+        pdf = pdfcreator.Bill.from_data(provider, bill, customer, services, os.path.join(directory, f"{lines}.pdf"))
+        start = time.perf_counter()
+        pdf.save()
+        duration = time.perf_counter() - start
+        print(f"{lines:>7} {pdf.canvas.getPageNumber() - 1:>6} {duration:>8.2f} {duration / lines * 1e6:>8.1f}")
+
+
+def bench_pdf_cache(args):
+    """Reprinting unchanged bills: rendering every time against the content-addressed PDF cache"""
+    import pdfcreator
+    from pdfcreator.cache import PdfCache
+    pdfcreator.configure_fonts(reportlab_fonts())
+    db = temporary_db(args.invoices * 20, services_per_sc=20, billed_share=1.0)
+    keys = db.bill_keys()[:args.invoices]
+    directory = tempfile.mkdtemp()
+    cache = PdfCache(os.path.join(directory, "cache"))
+
+    def reprint(use_cache):
+        start = time.perf_counter()
+        for key in keys:
+            data = db.bills_render_data([key])[key]
+            direction = os.path.join(directory, "bill.pdf")
+            if use_cache:
+                cache.save_bill(*data, direction)
+            else:
+                pdfcreator.Bill.from_data(*data, direction).save()
+        return (time.perf_counter() - start) / len(keys)
+
+    print(f"{len(keys)} invoices")
+    print(f"{'reprint':<22} {'ms/pdf':>8}")
+    print(f"{'render every time':<22} {reprint(False) * 1000:>8.2f}")
+    print(f"{'cache, first print':<22} {reprint(True) * 1000:>8.2f}")
+    print(f"{'cache, unchanged':<22} {reprint(True) * 1000:>8.2f}")
+    db.update_bill(*keys[0], False, True)
+    print(f"{'after changing a bill':<22} {cache.stats()}")
+    reprint(True)
+    print(f"{'':<22} {cache.stats()}")
+
+
+def bench_read_model(args):
+    """Dialog reads of customers and providers: read every time against the read model of Db"""
+    db = temporary_db(args.size)
+    sc_id = db.sc_table_query()[0][0]
+    bill_id, bill_year = db.bill_keys()[0]
+    reads = (
+        ("customers_long", ()),
+        ("customer_short", ()),
+        ("customers_with_bills", ()),
+        ("provider_info", ()),
+        ("create_bill_data", (sc_id,)),
+        ("bill_provider_info", (bill_id, bill_year)),
+    )
+
+    print(f"{args.size} services, {args.calls} calls per read")
+    print(f"{'read':<22} {'uncached ms':>12} {'cached ms':>10}")
+    for name, arguments in reads:
+        method = getattr(database.Db, name)
+        start = time.perf_counter()
+        for _ in range(args.calls):
+            method.__wrapped__(db, *arguments)
+        uncached = (time.perf_counter() - start) / args.calls
+        start = time.perf_counter()
+        for _ in range(args.calls):
+            method(db, *arguments)
+        cached = (time.perf_counter() - start) / args.calls
+        print(f"{name:<22} {uncached * 1000:>12.4f} {cached * 1000:>10.4f}")
+    print(db.read_model.stats())
+
+    # Own writes invalidate the tables they touch, writes of other connections everything
+    customers = len(db.customers_long())
+    db.new_customer("Erika", "Musterfrau", 0, "", "Weg", "2", "12345", "Ort")
+    assert len(db.customers_long()) == customers + 1
+    other = database.Db(db.direction, bootstrap=False)
+    other.new_customer("Erik", "Mustermann", 1, "", "Weg", "3", "12345", "Ort")
+    assert len(db.customers_long()) == customers + 2
+    other.close()
+    print("invalidation by own and other writes ok", db.read_model.stats())
+
+
+def words(n, seed=0):
+    """n distinct made up words"""
+    rng = random.Random(seed)
+    syllables = ["ar", "be", "bau", "dach", "ein", "fen", "ster", "gar", "ten", "hei", "zung", "kü", "che",
+                 "la", "mon", "tage", "rei", "ni", "gung", "schr", "wart", "ung", "tür", "rohr", "putz"]
+    result = set()
+    while len(result) < n:
+        result.add("".join(rng.choices(syllables, k=rng.randint(2, 4))).capitalize())
+    return sorted(result)
+
+
+def bench_search(args):
+    """Milliseconds per full-text search on services described by a realistic vocabulary"""
+    vocabulary = words(args.vocabulary)
+    start = time.perf_counter()
+    db = temporary_db(args.size, services_per_sc=20, vocabulary=vocabulary)
+    print(f"{args.size} services, {len(vocabulary)} words, built and indexed in {time.perf_counter() - start:.1f} s")
+    rng = random.Random(1)
+    queries = (
+        ("word", lambda: rng.choice(vocabulary)),
+        ("two words", lambda: " ".join(rng.sample(vocabulary, 2))),
+        ("prefix of 4", lambda: rng.choice(vocabulary)[:4]),
+        ("customer", lambda: f"Nachname{rng.randrange(100)}"),
+        ("bill keyword", lambda: f"Rechnung {rng.randrange(1000)}"),
+    )
+    print(f"{'query':<14} {'median ms':>10} {'max ms':>8} {'results':>8}")
+    for name, query in queries:
+        durations, results = [], 0
+        for _ in range(args.runs):
+            text = query()
+            start = time.perf_counter()
+            results += sum(len(rows) for _, rows in db.search(text))
+            durations.append((time.perf_counter() - start) * 1000)
+        durations.sort()
+        print(f"{name:<14} {durations[len(durations) // 2]:>10.2f} {durations[-1]:>8.2f} {results / args.runs:>8.1f}")
+
+
+# Table queries aggregating the services on every call, as before serviceComplexTotal
+_AGGREGATED_TABLE_QUERIES = {
+    "sc_table_query": "SELECT serviceComplex.id, customer.lastName, customer.institution, COUNT(service.id), SUM(service.price) + SUM(service.additionalPrice) FROM serviceComplex JOIN customer ON customer.id = serviceComplex.customerId LEFT JOIN service ON service.serviceComplexId = serviceComplex.id WHERE serviceComplex.id NOT IN (SELECT serviceComplexId FROM bill) GROUP BY serviceComplex.id",
+    "bill_table_query": "SELECT bill.id, bill.year, customer.lastName, customer.institution, bill.keyword, SUM(service.price) + SUM(service.additionalPrice) FROM bill JOIN serviceComplex ON serviceComplex.id = bill.serviceComplexId JOIN customer ON customer.id = serviceComplex.customerId LEFT JOIN service ON service.serviceComplexId = bill.serviceComplexId WHERE bill.paid = FALSE GROUP BY bill.id, bill.year",
+    "all_bills_table_query": "SELECT bill.id, bill.year, customer.lastName, customer.institution, bill.keyword, SUM(service.price) + SUM(service.additionalPrice) FROM bill JOIN serviceComplex ON serviceComplex.id = bill.serviceComplexId JOIN customer ON customer.id = serviceComplex.customerId LEFT JOIN service ON service.serviceComplexId = bill.serviceComplexId GROUP BY bill.id, bill.year",
+}
+
+
+def bench_totals(args):
+    """Table queries over the stored service complex totals against aggregating the services, the cost
+    of the triggers on writes and the consistency check"""
+    db = temporary_db(args.size, services_per_sc=args.services_per_sc)
+    print(f"{args.size} services, {args.services_per_sc} per service complex")
+    print(f"{'query':<22} {'aggregated s':>13} {'stored s':>9} {'rows':>7}")
+    for name, statement in _AGGREGATED_TABLE_QUERIES.items():
+        start = time.perf_counter()
+        db.cursor.execute(statement)
+        aggregated_rows = db.cursor.fetchall()
+        aggregated = time.perf_counter() - start
+        start = time.perf_counter()
+        rows = getattr(db, name)()
+        stored = time.perf_counter() - start
+        assert len(rows) == len(aggregated_rows)
+        print(f"{name:<22} {aggregated:>13.4f} {stored:>9.4f} {len(rows):>7}")
+
+    services = [(1, f"Leistung {i}", 50.0, 0.0, 1, 1, 2022) for i in range(args.rows)]
+    with_triggers = rows_per_second(args.rows, lambda: db.new_services(services))
+    db.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'service%Total%'")
+    triggers = [row[0] for row in db.cursor.fetchall()]
+    for trigger in triggers:
+        db.cursor.execute(f"DROP TRIGGER {trigger}")
+    without_triggers = rows_per_second(args.rows, lambda: db.new_services(services))
+    for statement in database.queries.SERVICE_COMPLEX_TOTAL_TRIGGERS:
+        db.cursor.execute(statement)
+    print(f"service inserts per second: {with_triggers:.0f} with totals, {without_triggers:.0f} without")
+
+    start = time.perf_counter()
+    drift = db.check_totals()
+    print(f"check without triggers for {args.rows} services: {len(drift)} drifted, rebuilt in {time.perf_counter() - start:.3f} s")
+    start = time.perf_counter()
+    assert not db.check_totals()
+    print(f"check of consistent totals: {time.perf_counter() - start:.3f} s")
+
+
+_LEGACY_BILL_OVERVIEW = "SELECT customer.firstName, customer.lastName, customer.institution, bill.id, bill.keyword, bill.day, bill.month, bill.year, service.price, service.additionalPrice, bill.valid, bill.paid FROM customer, bill, serviceComplex, service WHERE bill.serviceComplexId = serviceComplex.id AND serviceComplex.customerId = customer.id AND service.ServiceComplexId = serviceComplex.id ORDER BY customer.id, serviceComplex.id"
+
+
+def resident_kb(field):
+    """VmRSS or VmHWM (peak) of the process in kB, None where /proc is not available"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def traced(function):
+    """Seconds, peak of traced Python memory and peak growth of the resident set in MB of a call
+
+    Only the resident set includes the memory of sqlite, e.g. its sorter and page cache. Its peak is reset
+    through /proc/self/clear_refs and is None where that is not available.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        resident = resident_kb("VmRSS")
+    except OSError:
+        resident = None
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    duration = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    if resident is not None:
+        resident = (resident_kb("VmHWM") - resident) / 2 ** 10
+    return result, duration, peak, resident
+
+
+def bench_overview(args):
+    """Full history bill overview: the former materialized bill x service list against the streamed overview"""
+    import pdfcreator
+    pdfcreator.configure_fonts(reportlab_fonts())
+    db = temporary_db(args.size, services_per_sc=args.services_per_bill, billed_share=1.0)
+    provider = db.provider_info()
+
+    print(f"{args.size} services, {args.services_per_bill} per bill")
+    print(f"{'variant':<26} {'seconds':>8} {'peak MB':>8} {'RSS MB':>8}")
+    rows, duration, peak, resident = traced(lambda: db.cursor.execute(_LEGACY_BILL_OVERVIEW).fetchall())
+    print(f"{'materialize service rows':<26} {duration:>8.2f} {peak:>8.1f} {resident or 0:>8.1f}")
+    del rows
+
+    def render():
+        bills = db.bill_overview("*", 1, 1, 1900, 31, 12, 2100)
+        pdfcreator.BillOverview(bills, ["01", "01", "1900"], ["31", "12", "2100"], provider, os.path.join(tempfile.mkdtemp(), "overview.pdf")).save()
+
+    _, duration, peak, resident = traced(render)
+    print(f"{'stream and render per bill':<26} {duration:>8.2f} {peak:>8.1f} {resident or 0:>8.1f}")
+
+
+_IMPORT_UI = """
+import sys, time
+start = time.perf_counter()
+import ui
+print(time.perf_counter() - start)
+print(" ".join(module for module in ("reportlab", "tkcalendar", "pdfcreator") if module in sys.modules))
+"""
+
+# Starts the application in a prepared directory. mainloop is replaced by a loop that reports when the
+# window was painted the first time and when the first page of the open service complexes arrived.
+_FIRST_PAINT = """
+import sys, time
+start = time.perf_counter()
+import tkinter
+import ui
+
+def mainloop(self, n=0):
+    self.update()
+    painted = time.perf_counter() - start
+    tables = [widget for widget in self.winfo_children() if isinstance(widget, ui.VirtualTable)]
+    while not all(table.get_children() for table in tables) and time.perf_counter() - start < 30:
+        self.update()
+        time.sleep(0.001)
+    print(painted)
+    print(time.perf_counter() - start)
+    self.destroy()
+
+tkinter.Tk.mainloop = mainloop
+tkinter.Tk.state = lambda self, newstate=None: None  # "zoomed" only exists on Windows
+import database
+setup = database.Setup()
+ui.MainWindow(database.ProviderConnections(setup), setup)
+"""
+
+
+def bench_import(args):
+    """Duplicate check of an import: byte comparison with every provider file against stored content hashes
+
+    All provider files have the size of the imported file, the worst case for both variants.
+    """
+    directory = tempfile.mkdtemp()
+    os.makedirs(os.path.join(directory, "setup"))
+    os.makedirs(os.path.join(directory, "databases"))
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        candidate = os.path.join(directory, "import.rmdb")
+        db = database.Db(candidate)
+        populate(db, args.size)
+        db.checkpoint()
+        db.close()
+        with open(candidate, "rb") as file:
+            content = bytearray(file.read())
+        print(f"{len(content) / 2 ** 20:.1f} MB per database file")
+        print(f"{'providers':>9} {'filecmp s':>10} {'first hashed s':>15} {'hashed s':>9}")
+        setup = database.Setup()
+        for n_providers in args.providers:
+            while len(setup.all_providers()) < n_providers:
+                direction = os.getcwd() + setup.new_provider("Benchmark")
+                # Same size, different content
+                content[-1] = (content[-1] + 1) % 256
+                with open(direction, "wb") as file:
+                    file.write(content)
+            files = [os.getcwd() + row[1] for row in setup.all_providers()]
+
+            filecmp.clear_cache()
+            start = time.perf_counter()
+            assert not any(filecmp.cmp(candidate, file, shallow=False) for file in files)
+            legacy = time.perf_counter() - start
+
+            durations = []
+            for _ in range(2):
+                start = time.perf_counter()
+                result = database.inspect_file(candidate)
+                assert setup.identical_provider(result["size"], result["hash"]) is None
+                durations.append(time.perf_counter() - start)
+            print(f"{n_providers:>9} {legacy:>10.3f} {durations[0]:>15.3f} {durations[1]:>9.3f}")
+        setup.close()
+    finally:
+        os.chdir(cwd)
+
+
+def bench_backup(args):
+    """MB/s of exports: file copy, backup API with and without concurrent writes, VACUUM INTO"""
+    db = temporary_db(args.size)
+    db.checkpoint()
+    directory = os.path.dirname(db.direction)
+    size = os.path.getsize(db.direction) / 2 ** 20
+    print(f"{args.size} services, {size:.0f} MB, {args.pages} pages per backup step")
+
+    def report(name, duration, target, details=""):
+        print(f"{name:<26} {size / duration:>8.1f} MB/s {duration:>8.2f} s {details}")
+        os.remove(target)
+
+    target = os.path.join(directory, "copy.rmdb")
+    start = time.perf_counter()
+    shutil.copyfile(db.direction, target)
+    report("file copy", time.perf_counter() - start, target)
+
+    steps = []
+    start = time.perf_counter()
+    database.backup(db.conn, target, lambda copied, total: steps.append(copied), args.pages)
+    report("backup", time.perf_counter() - start, target, f"{len(steps)} steps")
+
+    # A second connection keeps adding services while the backup runs
+    db.cursor.execute("SELECT COUNT(*) FROM service")
+    services = db.cursor.fetchall()[0][0]
+    stop = threading.Event()
+    written = []
+
+    def write():
+        writer = database.Db(db.direction, bootstrap=False)
+        while not stop.is_set():
+            writer.new_service(1, "Leistung", 50.0, 0.0, 1, 1, 2022)
+            written.append(1)
+        writer.close()
+    thread = threading.Thread(target=write)
+    thread.start()
+    time.sleep(0.2)
+    before = len(written)
+    start = time.perf_counter()
+    database.backup(db.conn, target, None, args.pages)
+    duration = time.perf_counter() - start
+    during = len(written) - before
+    stop.set()
+    thread.join()
+    copy = database.connect_read_only(target)
+    copied_services = copy.execute("SELECT COUNT(*) FROM service").fetchone()[0]
+    check = copy.execute("PRAGMA integrity_check").fetchone()[0]
+    copy.close()
+    assert check == "ok" and services <= copied_services <= services + len(written)
+    report("backup while writing", duration, target, f"{during} services written meanwhile, copy {check}")
+
+    start = time.perf_counter()
+    database.compact_copy(db.conn, target)
+    duration = time.perf_counter() - start
+    compacted = os.path.getsize(target) / 2 ** 20
+    report("VACUUM INTO", duration, target, f"{compacted:.0f} MB")
+
+
+def bench_snapshots(args):
+    """Time and store growth of daily snapshots: a full first one, then one per day of changes"""
+    from database.snapshots import SnapshotStore
+    db = temporary_db(args.size)
+    directory = os.path.dirname(db.direction)
+    store = SnapshotStore(os.path.join(directory, "snapshots", "snapshots.db"))
+    rng = random.Random(2)
+    db.cursor.execute("SELECT MAX(id) FROM serviceComplex")
+    n_sc = db.cursor.fetchall()[0][0] + 1
+    bills = db.bill_keys()
+    size = os.path.getsize(db.direction) / 2 ** 20
+    print(f"{args.size} services, {args.changes} changed rows per day")
+    print(f"{'day':>4} {'database MB':>12} {'seconds':>8} {'store MB':>9} {'added MB':>9}")
+    stored = 0
+    for day in range(args.days + 1):
+        if day:
+            with db.transaction():
+                db.new_services([(rng.randrange(n_sc), f"Leistung Tag {day}", 50.0, 0.0, 1, 1, 2022) for _ in range(args.changes // 2)])
+                db.update_bills([(*rng.choice(bills), True, True) for _ in range(args.changes // 2)])
+        start = time.perf_counter()
+        snapshot_id = store.take(1, db.direction)
+        duration = time.perf_counter() - start
+        previous, stored = stored, store.stats()["stored_bytes"] / 2 ** 20
+        size = os.path.getsize(db.direction) / 2 ** 20
+        print(f"{day:>4} {size:>12.1f} {duration:>8.2f} {stored:>9.1f} {stored - previous:>9.2f}")
+        assert snapshot_id is not None
+
+    start = time.perf_counter()
+    assert store.take(1, db.direction) is None
+    print(f"unchanged database skipped in {(time.perf_counter() - start) * 1000:.2f} ms")
+
+    target = os.path.join(directory, "restored.rmdb")
+    start = time.perf_counter()
+    store.restore(store.snapshots(1)[0][0], target)
+    duration = time.perf_counter() - start
+    restored = database.connect_read_only(target)
+    check = restored.execute("PRAGMA quick_check").fetchone()[0]
+    services = restored.execute("SELECT COUNT(*) FROM service").fetchone()[0]
+    restored.close()
+    db.cursor.execute("SELECT COUNT(*) FROM service")
+    assert check == "ok" and services == db.cursor.fetchall()[0][0]
+    print(f"restore of the last snapshot: {duration:.2f} s, quick_check {check}")
+    print(store.stats())
+
+
+def bench_analytics(args):
+    """Streamed table export per format and revenue aggregated by sqlite against a Python loop over the services"""
+    from database.export import export_tables
+    db = temporary_db(args.size)
+    directory = os.path.join(os.path.dirname(db.direction), "export")
+    print(f"{args.size} services")
+    print(f"{'format':<8} {'seconds':>8} {'rows/s':>10} {'peak MB':>8} {'files MB':>9}")
+    for file_format in args.formats:
+        try:
+            start = time.perf_counter()
+            counts = export_tables(db, directory, file_format)
+            duration = time.perf_counter() - start
+        except ImportError as error:
+            print(f"{file_format:<8} skipped, {error}")
+            continue
+        # Memory is traced in a second run, tracing slows the export down
+        peak = traced(lambda: export_tables(db, directory, file_format))[2]
+        files = sum(os.path.getsize(os.path.join(directory, f"{table}.{file_format}")) for table in counts) / 2 ** 20
+        print(f"{file_format:<8} {duration:>8.2f} {sum(counts.values()) / duration:>10.0f} {peak:>8.1f} {files:>9.1f}")
+
+    def python_revenue():
+        db.cursor.execute("SELECT bill.year, bill.month, service.price, service.additionalPrice FROM bill JOIN service ON service.serviceComplexId = bill.serviceComplexId WHERE bill.valid = TRUE")
+        months = {}
+        for year, month, price, additional_price in db.cursor:
+            months[year, month] = months.get((year, month), 0) + price + additional_price
+        return months
+
+    start = time.perf_counter()
+    expected = python_revenue()
+    loop = time.perf_counter() - start
+    print(f"{'revenue by':<10} {'sqlite ms':>10} {'groups':>7}")
+    print(f"{'loop':<10} {loop * 1000:>10.1f} {len(expected):>7}  (Python loop over the services, by month)")
+    for by in ("month", "customer", "paid"):
+        start = time.perf_counter()
+        rows = db.revenue(by)
+        print(f"{by:<10} {(time.perf_counter() - start) * 1000:>10.1f} {len(rows):>7}")
+        if by == "month":
+            assert all(abs(expected[year, month] - price - additional) < 0.01 for year, month, _, price, additional in rows)
+
+
+def bench_startup(args):
+    """Import time of the UI and time to the first painted main window, fails above the thresholds"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    environment = dict(os.environ, PYTHONPATH=root)
+    failures = 0
+
+    runs = [subprocess.run([sys.executable, "-c", _IMPORT_UI], cwd=root, env=environment, capture_output=True, text=True, check=True).stdout.split("\n")
+            for _ in range(args.runs)]
+    import_ms = min(float(run[0]) for run in runs) * 1000
+    eager = runs[0][1].split()
+    print(f"{'import ui':<24} {import_ms:>8.1f} ms (limit {args.max_import_ms} ms)")
+    if eager:
+        print(f"FAIL imported at startup: {', '.join(eager)}")
+        failures += 1
+    if import_ms > args.max_import_ms:
+        failures += 1
+
+    if os.name != "nt" and not os.environ.get("DISPLAY"):
+        print("first paint skipped, no display")
+    else:
+        directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(directory, "setup"))
+        os.makedirs(os.path.join(directory, "databases"))
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            setup = database.Setup()
+            db = database.Db(os.getcwd() + setup.new_provider("Benchmark"))
+            populate(db, args.size)
+            db.close()
+            setup.close()
+        finally:
+            os.chdir(cwd)
+        painted, loaded = map(float, subprocess.run([sys.executable, "-c", _FIRST_PAINT], cwd=directory, env=environment, capture_output=True, text=True, check=True).stdout.split())
+        print(f"{'first paint':<24} {painted * 1000:>8.1f} ms (limit {args.max_paint_ms} ms, {args.size} services)")
+        print(f"{'first table page shown':<24} {loaded * 1000:>8.1f} ms")
+        if painted * 1000 > args.max_paint_ms:
+            failures += 1
+    sys.exit(1 if failures else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rechnungsmanager benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    table_parser = subparsers.add_parser("tables", help="table queries of the main window")
+    table_parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    table_parser.add_argument("--legacy-limit", type=int, default=100_000,
+                              help="largest size the one-query-per-row variant is run for")
+    table_parser.set_defaults(function=bench_table_queries)
+
+    write_parser = subparsers.add_parser("writes", help="per call mutators against batched writes")
+    write_parser.add_argument("--size", type=int, default=100_000, help="services in the database written to")
+    write_parser.add_argument("--rows", type=int, default=1_000, help="rows written per variant")
+    write_parser.set_defaults(function=bench_writes)
+
+    profile_parser = subparsers.add_parser("profiles", help="connection profiles under a mixed read/write workload")
+    profile_parser.add_argument("--size", type=int, default=100_000)
+    profile_parser.add_argument("--readers", type=int, default=2)
+    profile_parser.add_argument("--seconds", type=float, default=5.0)
+    profile_parser.set_defaults(function=bench_profiles)
+
+    statement_parser = subparsers.add_parser("statements", help="parse time saved by named, parameterized statements")
+    statement_parser.add_argument("--size", type=int, default=10_000, help="services, one SQL text per id for the f-string variant")
+    statement_parser.add_argument("--calls", type=int, default=20_000)
+    statement_parser.set_defaults(function=bench_statements)
+
+    font_parser = subparsers.add_parser("fonts", help="font registration per pdf against once per process")
+    font_parser.add_argument("--invoices", type=int, default=500)
+    font_parser.set_defaults(function=bench_fonts)
+
+    overview_parser = subparsers.add_parser("overview", help="memory and time of a full history bill overview")
+    overview_parser.add_argument("--size", type=int, default=1_000_000, help="services")
+    overview_parser.add_argument("--services-per-bill", type=int, default=20)
+    overview_parser.set_defaults(function=bench_overview)
+
+    layout_parser = subparsers.add_parser("layout", help="measured pagination of invoices with many service lines")
+    layout_parser.add_argument("--lines", type=int, nargs="+", default=[1000, 2000, 4000, 8000])
+    layout_parser.set_defaults(function=bench_layout)
+
+    cache_parser = subparsers.add_parser("pdfcache", help="reprinting unchanged bills through the pdf cache")
+    cache_parser.add_argument("--invoices", type=int, default=200)
+    cache_parser.set_defaults(function=bench_pdf_cache)
+
+    startup_parser = subparsers.add_parser("startup", help="import time and first paint of the main window against limits")
+    startup_parser.add_argument("--size", type=int, default=1_000_000, help="services in the database shown")
+    startup_parser.add_argument("--runs", type=int, default=5, help="imports measured, the fastest counts")
+    startup_parser.add_argument("--max-import-ms", type=float, default=150)
+    startup_parser.add_argument("--max-paint-ms", type=float, default=1000)
+    startup_parser.set_defaults(function=bench_startup)
+
+    read_model_parser = subparsers.add_parser("readmodel", help="cached reads of customers and providers")
+    read_model_parser.add_argument("--size", type=int, default=100_000)
+    read_model_parser.add_argument("--calls", type=int, default=1_000)
+    read_model_parser.set_defaults(function=bench_read_model)
+
+    search_parser = subparsers.add_parser("search", help="full-text search over customers, bills and services")
+    search_parser.add_argument("--size", type=int, default=1_000_000, help="services")
+    search_parser.add_argument("--vocabulary", type=int, default=5_000, help="distinct words of service descriptions")
+    search_parser.add_argument("--runs", type=int, default=50, help="searches per query kind")
+    search_parser.set_defaults(function=bench_search)
+
+    backup_parser = subparsers.add_parser("backup", help="export throughput of the backup API")
+    backup_parser.add_argument("--size", type=int, default=1_000_000, help="services, about 90 MB per million")
+    backup_parser.add_argument("--pages", type=int, default=database.BACKUP_PAGES, help="pages per backup step")
+    backup_parser.set_defaults(function=bench_backup)
+
+    analytics_parser = subparsers.add_parser("analytics", help="table export and revenue aggregation")
+    analytics_parser.add_argument("--size", type=int, default=1_000_000, help="services")
+    analytics_parser.add_argument("--formats", nargs="+", default=["csv", "parquet", "arrow"])
+    analytics_parser.set_defaults(function=bench_analytics)
+
+    snapshot_parser = subparsers.add_parser("snapshots", help="incremental snapshots of a provider database")
+    snapshot_parser.add_argument("--size", type=int, default=1_000_000, help="services")
+    snapshot_parser.add_argument("--days", type=int, default=5, help="snapshots after the first one")
+    snapshot_parser.add_argument("--changes", type=int, default=1_000, help="rows written before each snapshot")
+    snapshot_parser.set_defaults(function=bench_snapshots)
+
+    import_parser = subparsers.add_parser("import", help="duplicate check of imported databases")
+    import_parser.add_argument("--size", type=int, default=100_000, help="services per database file")
+    import_parser.add_argument("--providers", type=int, nargs="+", default=[1, 10, 50])
+    import_parser.set_defaults(function=bench_import)
+
+    totals_parser = subparsers.add_parser("totals", help="stored service complex totals against aggregated services")
+    totals_parser.add_argument("--size", type=int, default=1_000_000, help="services")
+    totals_parser.add_argument("--services-per-sc", type=int, default=10)
+    totals_parser.add_argument("--rows", type=int, default=10_000, help="services inserted per write variant")
+    totals_parser.set_defaults(function=bench_totals)
+
+    args = parser.parse_args()
+    args.function(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""Rechnungsmanager without the UI, e.g. on a server or from cron
+
+python -m cli bills
+python -m cli complexes
+python -m cli create 12 13 --keyword "Wartung März" --date 31.03.2022 --database databases/1.rmdb
+python -m cli render --open --out rechnungen
+python -m cli overview --begin 01.01.2022 --end 31.12.2022 --out uebersicht.pdf
+python -m cli totals --repair
+python -m cli export sicherung.rmdb --compact
+python -m cli import sicherung.rmdb
+python -m cli snapshot --all
+python -m cli snapshots
+python -m cli restore --at "31.03.2022 18:00" --out stand.rmdb
+python -m cli retention --interval 12 --keep-last 14 --keep-days 90
+python -m cli dump --format parquet --out auswertung
+python -m cli revenue --by month --begin 01.01.2022 --end 31.12.2022
+
+Neither tkinter nor reportlab is imported, only the PDF subcommands load reportlab and only dump to
+Parquet or Arrow loads pyarrow.
+"""
+import argparse
+import datetime
+import os
+import sqlite3
+import sys
+import time
+
+import database
+
+
+def date(text):
+    day, month, year = map(int, text.split("."))
+    return year, month, day
+
+
+def bill_key(text):
+    year, bill_id = map(int, text.split("-"))
+    return bill_id, year
+
+
+def font(text):
+    name, path = text.split("=", 1)
+    return name, path
+
+
+def price_text(price):
+    return "{:.2f} €".format(price or 0).replace(".", ",")
+
+
+def provider_direction(args):
+    """Database file of --database, --provider or the active provider"""
+    if args.database:
+        return args.database
+    setup = database.Setup()
+    if args.provider:
+        return os.getcwd() + setup.provider_direction(args.provider)
+    return os.getcwd() + setup.active_provider()[0][1]
+
+
+def open_db(args):
+    return database.Db(provider_direction(args))
+
+
+def list_bills(args):
+    db = open_db(args)
+    rows = db.all_bills_table_query() if args.all else db.bill_table_query()
+    for bill_id, year, last_name, institution, keyword, price in rows:
+        print(f"{year}-{bill_id:03d}  {institution or last_name or '':<30} {keyword or '':<30} {price_text(price):>12}")
+    print(f"{len(rows)} Rechnungen")
+
+
+def list_complexes(args):
+    db = open_db(args)
+    rows = db.sc_table_query()
+    for sc_id, last_name, institution, services, price in rows:
+        print(f"{sc_id:>6}  {institution or last_name or '':<30} {services:>4} Leistungen {price_text(price):>12}")
+    print(f"{len(rows)} offene Aufträge")
+
+
+def create_bills(args):
+    db = open_db(args)
+    open_complexes = {row[0] for row in db.sc_table_query()}
+    missing = [sc_id for sc_id in args.complexes if sc_id not in open_complexes]
+    if missing:
+        print("Keine offenen Aufträge: " + ", ".join(map(str, missing)))
+        sys.exit(1)
+    year, month, day = args.date
+    provider_id = db.provider_info()[0]
+    with db.transaction():
+        numbers = [db.new_bill(sc_id, provider_id, day, month, year, args.keyword, args.comment, args.small_business, True, False)
+                   for sc_id in args.complexes]
+    for sc_id, bill_id in zip(args.complexes, numbers):
+        print(f"Auftrag {sc_id}: Rechnung {year}-{bill_id:03d}")
+
+
+def render(args):
+    import pdfcreator
+    from pdfcreator.batch import render_bills
+    pdfcreator.configure_fonts(dict(args.font))
+
+    db = open_db(args)
+    keys = args.bill or db.bill_keys(False if args.open else None, args.begin, args.end)
+
+    start = time.perf_counter()
+    failures = 0
+    for (bill_id, bill_year), seconds, error in render_bills(db, keys, args.out, args.processes):
+        if error:
+            failures += 1
+            print(f"{bill_year}-{bill_id:03d}  Fehler: {error}")
+        else:
+            print(f"{bill_year}-{bill_id:03d}  {seconds:.3f} s")
+    print(f"{len(keys) - failures} von {len(keys)} Rechnungen in {time.perf_counter() - start:.1f} s erstellt")
+    sys.exit(1 if failures else 0)
+
+
+def render_overview(args):
+    import pdfcreator
+    pdfcreator.configure_fonts(dict(args.font))
+
+    db = open_db(args)
+    (byear, bmonth, bday), (eyear, emonth, eday) = args.begin, args.end
+    customer = (args.customer,) if args.customer else "*"
+    bills = db.bill_overview(customer, bday, bmonth, byear, eday, emonth, eyear)
+    begin_date = [f"{bday:02d}", f"{bmonth:02d}", str(byear)]
+    end_date = [f"{eday:02d}", f"{emonth:02d}", str(eyear)]
+    pdfcreator.BillOverview(bills, begin_date, end_date, db.provider_info(), args.out).save()
+    print(f"Rechnungsübersicht {args.out} erstellt")
+
+
+def check_totals(args):
+    db = open_db(args)
+    drift = db.check_totals(repair=args.repair)
+    for sc_id, services, price, additional_price, actual_services, actual_price, actual_additional_price in drift:
+        if actual_services is None:
+            print(f"{sc_id:>6}  Summen ohne Auftrag")
+        else:
+            print(f"{sc_id:>6}  gespeichert {services} Leistungen {price_text(price)} + {price_text(additional_price)}, "
+                  f"tatsächlich {actual_services} Leistungen {price_text(actual_price)} + {price_text(actual_additional_price)}")
+    if not drift:
+        print("Die Summen aller Aufträge stimmen.")
+    elif args.repair:
+        print(f"Summen von {len(drift)} Aufträgen neu berechnet")
+    sys.exit(1 if drift and not args.repair else 0)
+
+
+def print_progress(copied, total):
+    print(f"\r{100 * copied // total:>3} % ({copied} von {total} Seiten)", end="", flush=True)
+
+
+def export_db(args):
+    direction = provider_direction(args)
+    db = database.Db(direction, bootstrap=False)
+    if args.compact:
+        database.compact_copy(db.conn, args.file)
+    else:
+        database.backup(db.conn, args.file, print_progress)
+        print()
+    db.close()
+    print(f"{direction} nach {args.file} exportiert")
+
+
+def import_db(args):
+    try:
+        result = database.inspect_file(args.file)
+    except sqlite3.DatabaseError:
+        print("Bei der Datei handelt es sich nicht um eine kompatible Datenbank.")
+        sys.exit(1)
+    if result["problems"]:
+        print("Die Datenbank ist beschädigt: " + "; ".join(result["problems"][:10]))
+        sys.exit(1)
+    if result["missing"]:
+        print("Der Datei fehlen Datensätze: " + ", ".join(result["missing"]))
+        sys.exit(1)
+    if not result["schema_matches"] or not result["version"] or not result["setup_info"]:
+        print("Bei der Datei handelt es sich nicht um eine kompatible Datenbank.")
+        sys.exit(1)
+    setup = database.Setup()
+    if setup.identical_provider(result["size"], result["hash"]) is not None:
+        print("Dieser Datensatz ist bereits vorhanden.")
+        sys.exit(1)
+    keyword = result["setup_info"]
+    # The provider is only registered once the copy is complete, so nothing opens its database before
+    copy_direction = os.getcwd() + database.IMPORT_DIRECTION
+    conn = database.connect_read_only(args.file)
+    try:
+        database.backup(conn, copy_direction, print_progress)
+        print()
+    finally:
+        conn.close()
+    setup.add_imported_provider(keyword, copy_direction, result["hash"])
+    print(f"{args.file} als Dienstleister {keyword} importiert")
+
+
+def moment(text):
+    return datetime.datetime.strptime(text, "%d.%m.%Y %H:%M").timestamp()
+
+
+def snapshot_providers(args):
+    """(id, database file) of the providers the snapshot subcommands work on"""
+    setup = database.Setup()
+    if getattr(args, "all", False):
+        return [(provider_id, os.getcwd() + direction) for _, direction, _, provider_id in setup.all_providers()]
+    provider_id = args.provider or setup.active_provider_id()
+    return [(provider_id, os.getcwd() + setup.provider_direction(provider_id))]
+
+
+def take_snapshots(args):
+    from database.snapshots import SnapshotStore
+    setup = database.Setup()
+    store = SnapshotStore()
+    for provider_id, direction in snapshot_providers(args):
+        interval_hours, keep_last, keep_days = setup.snapshot_settings(provider_id)
+        if args.force:
+            snapshot_id = store.take(provider_id, direction, force=True)
+            store.prune(provider_id, keep_last, keep_days)
+        else:
+            snapshot_id = store.take_due(provider_id, direction, (interval_hours, keep_last, keep_days))
+        print(f"Dienstleister {provider_id}: " + (f"Sicherung {snapshot_id} erstellt" if snapshot_id else "keine Änderungen oder nicht fällig"))
+    stats = store.stats()
+    print(f"{stats['snapshots']} Sicherungen, {stats['stored_bytes'] / 2 ** 20:.1f} MB gespeichert")
+
+
+def list_snapshots(args):
+    from database.snapshots import SnapshotStore
+    store = SnapshotStore()
+    for provider_id, _ in snapshot_providers(args):
+        snapshots = store.snapshots(provider_id)
+        for snapshot_id, created, size in snapshots:
+            print(f"{snapshot_id:>6}  {datetime.datetime.fromtimestamp(created):%d.%m.%Y %H:%M}  {size / 2 ** 20:>8.1f} MB")
+        print(f"Dienstleister {provider_id}: {len(snapshots)} Sicherungen")
+
+
+def restore_snapshot(args):
+    from database.snapshots import SnapshotStore
+    store = SnapshotStore()
+    snapshot_id = args.snapshot
+    if snapshot_id is None:
+        provider_id = snapshot_providers(args)[0][0]
+        snapshot_id = store.snapshot_at(provider_id, args.at if args.at is not None else time.time())
+        if snapshot_id is None:
+            print("Keine Sicherung zu diesem Zeitpunkt")
+            sys.exit(1)
+    store.restore(snapshot_id, args.out)
+    print(f"Sicherung {snapshot_id} nach {args.out} wiederhergestellt")
+
+
+def retention(args):
+    setup = database.Setup()
+    provider_id = snapshot_providers(args)[0][0]
+    interval_hours, keep_last, keep_days = setup.snapshot_settings(provider_id)
+    if args.interval is not None or args.keep_last is not None or args.keep_days is not None:
+        interval_hours = args.interval if args.interval is not None else interval_hours
+        keep_last = args.keep_last if args.keep_last is not None else keep_last
+        keep_days = args.keep_days if args.keep_days is not None else keep_days
+        setup.set_snapshot_settings(provider_id, interval_hours, keep_last, keep_days)
+    print(f"Dienstleister {provider_id}: alle {interval_hours:g} Stunden, die letzten {keep_last} Sicherungen "
+          f"und eine je Tag der letzten {keep_days} Tage werden behalten")
+
+
+def dump(args):
+    from database.export import export_tables
+    db = open_db(args)
+    try:
+        counts = export_tables(db, args.out, args.format, progress=lambda table: print(f"{table} ...", end=" ", flush=True))
+    except ImportError:
+        print(f"\nFür {args.format} wird pyarrow benötigt: pip install pyarrow")
+        sys.exit(1)
+    print()
+    for table, count in counts.items():
+        print(f"{table:<16} {count:>10} Zeilen")
+
+
+def revenue(args):
+    db = open_db(args)
+    rows = db.revenue(args.by, args.begin, args.end)
+    for *group, bills, price, additional_price in rows:
+        if args.by == "month":
+            label = f"{group[1]:02d}.{group[0]}"
+        elif args.by == "customer":
+            label = group[2] or group[1] or str(group[0])
+        else:
+            label = "bezahlt" if group[0] else "offen"
+        print(f"{label:<30} {bills:>6} Rechnungen {price_text(price + additional_price):>14}")
+    print(f"{'Summe':<30} {sum(row[-3] for row in rows):>6} Rechnungen {price_text(sum(row[-2] + row[-1] for row in rows)):>14}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Rechnungsmanager ohne Benutzeroberfläche")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    # Options of every subcommand
+    provider_parser = argparse.ArgumentParser(add_help=False)
+    provider_parser.add_argument("--database", help="Datenbankdatei des Dienstleisters")
+    provider_parser.add_argument("--provider", type=int, help="ID des Dienstleisters, ohne Angabe der aktive Dienstleister")
+
+    bills_parser = subparsers.add_parser("bills", parents=[provider_parser], help="offene Rechnungen anzeigen")
+    bills_parser.add_argument("--all", action="store_true", help="auch bezahlte Rechnungen")
+    bills_parser.set_defaults(function=list_bills)
+
+    complexes_parser = subparsers.add_parser("complexes", parents=[provider_parser], help="offene Aufträge anzeigen")
+    complexes_parser.set_defaults(function=list_complexes)
+
+    create_parser = subparsers.add_parser("create", parents=[provider_parser], help="Rechnungen zu offenen Aufträgen erstellen")
+    create_parser.add_argument("complexes", type=int, nargs="+", metavar="AUFTRAG")
+    create_parser.add_argument("--keyword", required=True, help="Betreff")
+    create_parser.add_argument("--comment", default="", help="Kommentar")
+    create_parser.add_argument("--date", type=date, default=datetime.date.today().timetuple()[:3], metavar="TT.MM.JJJJ")
+    create_parser.add_argument("--small-business", action="store_true", help="Kleinunternehmer")
+    create_parser.set_defaults(function=create_bills)
+
+    render_parser = subparsers.add_parser("render", parents=[provider_parser], help="Rechnungen als PDF erstellen")
+    render_parser.add_argument("--bill", type=bill_key, nargs="+", metavar="JAHR-NR", help="einzelne Rechnungen")
+    render_parser.add_argument("--open", action="store_true", help="nur offene Rechnungen")
+    render_parser.add_argument("--begin", type=date, metavar="TT.MM.JJJJ")
+    render_parser.add_argument("--end", type=date, metavar="TT.MM.JJJJ")
+    render_parser.add_argument("--out", default="rechnungen", help="Ausgabeordner")
+    render_parser.add_argument("--processes", type=int, help="Anzahl paralleler Prozesse, ohne Angabe einer je CPU-Kern")
+    render_parser.set_defaults(function=render)
+
+    overview_parser = subparsers.add_parser("overview", parents=[provider_parser], help="Rechnungsübersicht als PDF erstellen")
+    overview_parser.add_argument("--begin", type=date, required=True, metavar="TT.MM.JJJJ")
+    overview_parser.add_argument("--end", type=date, required=True, metavar="TT.MM.JJJJ")
+    overview_parser.add_argument("--customer", type=int, help="ID des Auftraggebers, ohne Angabe alle")
+    overview_parser.add_argument("--out", default="Rechnungsübersicht.pdf", help="PDF-Datei")
+    overview_parser.set_defaults(function=render_overview)
+
+    for pdf_parser in (render_parser, overview_parser):
+        pdf_parser.add_argument("--font", type=font, action="append", default=[], metavar="NAME=DATEI",
+                                help="Schriftdatei, z.B. Arial=C:/Windows/Fonts/arial.ttf")
+
+    totals_parser = subparsers.add_parser("totals", parents=[provider_parser], help="gespeicherte Summen der Aufträge prüfen")
+    totals_parser.add_argument("--repair", action="store_true", help="abweichende Summen neu berechnen")
+    totals_parser.set_defaults(function=check_totals)
+
+    export_parser = subparsers.add_parser("export", parents=[provider_parser], help="Datenbank des Dienstleisters exportieren")
+    export_parser.add_argument("file", help="Zieldatei")
+    export_parser.add_argument("--compact", action="store_true", help="komprimierte Kopie mit VACUUM INTO")
+    export_parser.set_defaults(function=export_db)
+
+    import_parser = subparsers.add_parser("import", help="Datenbank als neuen Dienstleister importieren")
+    import_parser.add_argument("file", help="Datenbankdatei")
+    import_parser.set_defaults(function=import_db)
+
+    dump_parser = subparsers.add_parser("dump", parents=[provider_parser], help="Tabellen für Auswertungen exportieren")
+    dump_parser.add_argument("--format", choices=("csv", "parquet", "arrow"), default="csv")
+    dump_parser.add_argument("--out", default="auswertung", help="Ausgabeordner, eine Datei je Tabelle")
+    dump_parser.set_defaults(function=dump)
+
+    revenue_parser = subparsers.add_parser("revenue", parents=[provider_parser], help="Umsatz gültiger Rechnungen")
+    revenue_parser.add_argument("--by", choices=("month", "customer", "paid"), default="month")
+    revenue_parser.add_argument("--begin", type=date, default=(0, 1, 1), metavar="TT.MM.JJJJ")
+    revenue_parser.add_argument("--end", type=date, default=(9999, 12, 31), metavar="TT.MM.JJJJ")
+    revenue_parser.set_defaults(function=revenue)
+
+    # Snapshots are kept per provider, the provider is chosen by --provider or is the active one
+    snapshot_provider_parser = argparse.ArgumentParser(add_help=False)
+    snapshot_provider_parser.add_argument("--provider", type=int, help="ID des Dienstleisters, ohne Angabe der aktive Dienstleister")
+
+    snapshot_parser = subparsers.add_parser("snapshot", parents=[snapshot_provider_parser], help="Sicherung erstellen, sobald sie fällig ist")
+    snapshot_parser.add_argument("--all", action="store_true", help="alle Dienstleister")
+    snapshot_parser.add_argument("--force", action="store_true", help="auch vor Ablauf des Intervalls")
+    snapshot_parser.set_defaults(function=take_snapshots)
+
+    snapshots_parser = subparsers.add_parser("snapshots", parents=[snapshot_provider_parser], help="Sicherungen anzeigen")
+    snapshots_parser.add_argument("--all", action="store_true", help="alle Dienstleister")
+    snapshots_parser.set_defaults(function=list_snapshots)
+
+    restore_parser = subparsers.add_parser("restore", parents=[snapshot_provider_parser], help="Sicherung in eine Datei wiederherstellen")
+    restore_choice = restore_parser.add_mutually_exclusive_group()
+    restore_choice.add_argument("--snapshot", type=int, help="ID der Sicherung")
+    restore_choice.add_argument("--at", type=moment, metavar="\"TT.MM.JJJJ HH:MM\"", help="letzte Sicherung bis zu diesem Zeitpunkt, ohne Angabe die letzte")
+    restore_parser.add_argument("--out", required=True, help="Zieldatei")
+    restore_parser.set_defaults(function=restore_snapshot)
+
+    retention_parser = subparsers.add_parser("retention", parents=[snapshot_provider_parser], help="Sicherungseinstellungen anzeigen oder ändern")
+    retention_parser.add_argument("--interval", type=float, help="Stunden zwischen zwei Sicherungen")
+    retention_parser.add_argument("--keep-last", type=int, help="so viele Sicherungen werden immer behalten")
+    retention_parser.add_argument("--keep-days", type=int, help="eine Sicherung je Tag wird so viele Tage behalten")
+    retention_parser.set_defaults(function=retention)
+
+    args = parser.parse_args(argv)
+    args.function(args)
@@ -1,5 +1,252 @@
+import collections
+import contextlib
+import functools
+import hashlib
+import os
+import pathlib
 import sqlite3 as sql
-import tkinter.messagebox
+
+from database import queries
+
+# Pragmas set on every new connection, by profile name
+PROFILES = {
+    # sqlite defaults: rollback journal, synchronous=FULL
+    "rollback": {},
+    # Readers keep reading while a writer commits. A commit only syncs at checkpoints.
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,  # KiB
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+        "foreign_keys": "ON",
+    },
+}
+DEFAULT_PROFILE = "wal"
+
+# Tables every provider database has
+REQUIRED_TABLES = ("customer", "serviceComplex", "service", "bill", "provider", "VERSION_INFO")
+
+
+def connect(direction, profile=DEFAULT_PROFILE):
+    """Opens a connection with the pragmas of a profile name or of a dict of pragmas"""
+    conn = sql.connect(direction, cached_statements=queries.STATEMENT_CACHE_SIZE)
+    pragmas = PROFILES[profile] if isinstance(profile, str) else profile
+    for pragma, value in pragmas.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    return conn
+
+
+def close_connection(conn):
+    """Commits, lets sqlite update the statistics of the query planner and closes the connection"""
+    conn.commit()
+    conn.execute("PRAGMA optimize")
+    conn.close()
+
+
+def connect_read_only(direction):
+    """Opens a database file read-only. Nothing is written to the file, not even the schema.
+
+    immutable keeps sqlite from creating -wal and -shm files next to a file in WAL mode, so the file must
+    not change while it is open. A file that comes with a -wal file, e.g. copied from an installation that
+    was still running, has its latest commits in there. It is opened without immutable, so they are read.
+    """
+    uri = pathlib.Path(direction).absolute().as_uri() + "?mode=ro"
+    if not os.path.exists(direction + "-wal"):
+        uri += "&immutable=1"
+    return sql.connect(uri, uri=True)
+
+
+def file_hash(direction, check=None, chunk_size=2 ** 20):
+    """SHA-256 of a file, read in chunks. check() is called before every chunk, e.g. Job.check."""
+    digest = hashlib.sha256()
+    with open(direction, "rb") as file:
+        while chunk := file.read(chunk_size):
+            if check:
+                check()
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def schema_fingerprint(conn):
+    """Hash of name, type and primary key of every column of the REQUIRED_TABLES"""
+    columns = [(table, row[1], row[2], row[5]) for table in REQUIRED_TABLES
+               for row in conn.execute(f"PRAGMA table_info({table})")]
+    return hashlib.sha256(repr(columns).encode()).hexdigest()
+
+
+@functools.lru_cache(maxsize=1)
+def expected_schema_fingerprint():
+    """Fingerprint of the tables created by Db"""
+    db = Db(":memory:")
+    try:
+        return schema_fingerprint(db.conn)
+    finally:
+        db.close()
+
+
+def inspect_file(direction, report=None, cancelled=None):
+    """Checks a database file before it is imported, without writing to it
+
+    Returns a dict of
+    problems: messages of PRAGMA quick_check, empty for an intact file
+    missing: REQUIRED_TABLES the file lacks
+    schema_matches: whether the columns of the required tables match the ones of Db
+    version: the VERSION_INFO row, setup_info: name of the active provider (both None if missing)
+    size, hash: size in bytes and file_hash of the file
+    report(value, text) is called before every step. Once cancelled() is true, the running step stops with
+    sqlite3.OperationalError, just like an interrupted statement. Files that are no sqlite databases raise
+    sqlite3.DatabaseError.
+    """
+    report = report or (lambda value, text: None)
+    cancelled = cancelled or (lambda: False)
+
+    def check():
+        if cancelled():
+            raise sql.OperationalError("interrupted")
+
+    conn = connect_read_only(direction)
+    try:
+        conn.set_progress_handler(cancelled, 10000)
+        report(10, "Überprüfe Datenbankdatei")
+        problems = [row[0] for row in conn.execute("PRAGMA quick_check")]
+        if problems == ["ok"]:
+            problems = []
+        report(40, "Überprüfe Tabellen")
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        missing = [table for table in REQUIRED_TABLES if table not in tables]
+        result = {"problems": problems, "missing": missing, "version": None, "setup_info": None,
+                  "schema_matches": schema_fingerprint(conn) == expected_schema_fingerprint()}
+        if not missing:
+            report(60, "Überprüfe Version")
+            result["version"] = conn.execute("SELECT * FROM VERSION_INFO").fetchone()
+            provider = conn.execute("SELECT firstName, lastName FROM provider WHERE active = TRUE").fetchone()
+            result["setup_info"] = " ".join(provider) if provider else None
+    finally:
+        conn.close()
+    report(70, "Vergleiche mit vorhandenen Datensätzen")
+    result["size"] = os.path.getsize(direction)
+    result["hash"] = file_hash(direction, check)
+    return result
+
+
+# Pages copied per step of a backup, progress is reported after every step
+BACKUP_PAGES = 4096
+# Imports are copied to this file first. Only the complete copy becomes the database of a new provider,
+# see Setup.add_imported_provider.
+IMPORT_DIRECTION = "\\databases\\import.rmdb"
+
+
+def backup(conn, target, progress=None, pages=BACKUP_PAGES):
+    """Copies the database of conn into the file target with the sqlite backup API
+
+    All steps run in one read transaction of conn, so the copy shows the database of one moment while
+    other connections keep writing; in WAL mode they are not even blocked. progress(copied, total) gets
+    the pages after every step, an exception raised by it stops the backup. target only appears once
+    the copy is complete.
+    """
+    def step(status, remaining, total):
+        progress(total - remaining, total)
+
+    temporary = target + ".tmp"
+    destination = sql.connect(temporary)
+    try:
+        conn.commit()
+        conn.execute("BEGIN")
+        try:
+            # Takes the read snapshot
+            conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchall()
+            conn.backup(destination, pages=pages, progress=step if progress else None)
+        finally:
+            conn.rollback()
+        destination.close()
+        os.replace(temporary, target)
+    except BaseException:
+        destination.close()
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def compact_copy(conn, target):
+    """Writes a compacted copy of the database of conn to the file target with VACUUM INTO
+
+    Like backup(), the copy is consistent while other connections write. It runs as a single statement
+    without progress, the progress handler of conn can interrupt it.
+    """
+    temporary = target + ".tmp"
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    conn.commit()
+    try:
+        conn.execute("VACUUM INTO ?", (temporary,))
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    os.replace(temporary, target)
+
+
+class ReadModel:
+    """Results of reads of small, rarely changing tables, kept until one of the tables changes
+
+    Writes of the own connection invalidate the tables they touch, see read_model().
+    Commits of other connections or processes change PRAGMA data_version and clear everything.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.entries = {}
+        self.keys_by_table = collections.defaultdict(set)
+        self.data_version = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key, tables, read):
+        self.check_data_version()
+        if key in self.entries:
+            self.hits += 1
+            value = self.entries[key]
+        else:
+            self.misses += 1
+            value = self.entries[key] = read()
+            for table in tables:
+                self.keys_by_table[table].add(key)
+        # Callers may change the lists they get
+        return list(value) if isinstance(value, list) else value
+
+    def check_data_version(self):
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self.data_version:
+            if self.entries:
+                self.clear()
+            self.data_version = data_version
+
+    def invalidate(self, *tables):
+        for table in tables:
+            for key in self.keys_by_table.pop(table, ()):
+                if self.entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        self.invalidations += len(self.entries)
+        self.entries.clear()
+        self.keys_by_table.clear()
+
+    def stats(self):
+        reads = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / reads if reads else 0.0,
+                "invalidations": self.invalidations, "entries": len(self.entries)}
+
+
+def read_model(*tables):
+    """Serves a Db method from the read model of its Db until one of tables changes"""
+    def decorator(method):
+        @functools.wraps(method)
+        def cached(self, *args):
+            return self.read_model.get((method.__name__, args), tables, lambda: method(self, *args))
+        return cached
+    return decorator
 
 
 class Setup:
@@ -10,18 +257,68 @@ class Setup:
     active BOOLEAN
     )
     """
-    def __init__(self):
-        self.conn = sql.connect("setup/setup.db")
+    # Content hash of each provider database file, valid while the file keeps its size and modification time
+    __database_hash_table = """CREATE TABLE IF NOT EXISTS databaseHash (
+    providerId INTEGER PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    hash TEXT
+    )
+    """
+    # When snapshots of a provider database are taken and how many are kept, see database.snapshots
+    __snapshot_setting_table = """CREATE TABLE IF NOT EXISTS snapshotSetting (
+    providerId INTEGER PRIMARY KEY,
+    intervalHours REAL,
+    keepLast INTEGER,
+    keepDays INTEGER
+    )
+    """
+    # Daily snapshots, the last 7 and one per day of the last 30 days are kept
+    SNAPSHOT_DEFAULTS = (24, 7, 30)
+
+    def __init__(self, profile=DEFAULT_PROFILE):
+        self.conn = connect("setup/setup.db", profile)
         self.cursor = self.conn.cursor()
         self.cursor.execute(Setup.__provider_table)
+        self.cursor.execute(Setup.__database_hash_table)
+        self.cursor.execute(Setup.__snapshot_setting_table)
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS databaseHashIndex ON databaseHash(hash)")
 
     def __del__(self):
-        self.conn.close()
+        self.close()
+
+    def close(self):
+        if self.conn:
+            close_connection(self.conn)
+            self.conn = None
 
-    def new_provider(self, keyword, direction):
+    def new_provider(self, keyword):
+        """Registers a new active provider and returns the direction of its database file"""
         self.cursor.execute("""UPDATE provider SET active = FALSE""")
-        self.cursor.execute("""INSERT INTO provider(keyword,dir,active) VALUES (?,?,?)""", (keyword,direction,True))
+        self.cursor.execute("""INSERT INTO provider(keyword,active) VALUES (?,?)""", (keyword,True))
+        direction = "\\databases\\" + str(self.cursor.lastrowid) + ".rmdb"
+        self.cursor.execute("""UPDATE provider SET dir = ? WHERE id = ?""", (direction, self.cursor.lastrowid))
         self.conn.commit()
+        return direction
+
+    def add_imported_provider(self, keyword, copy, digest):
+        """Registers a new active provider for the complete copy of an imported database
+
+        The copy is moved into place before anything can open the database of the provider. digest is
+        the file_hash of the imported file. Returns the id of the provider.
+        """
+        previous_provider = self.active_provider_id() if self.active_provider() else None
+        direction = self.new_provider(keyword)
+        provider_id = self.active_provider_id()
+        try:
+            os.replace(copy, os.getcwd() + direction)
+        except OSError:
+            self.delete_provider(provider_id)
+            if previous_provider is not None:
+                self.activate_provider(previous_provider)
+            raise
+        self.store_hash(provider_id, digest)
+        return provider_id
 
     def all_providers(self):
         self.cursor.execute("SELECT keyword, dir, active, id FROM provider")
@@ -31,6 +328,10 @@ class Setup:
         self.cursor.execute("SELECT keyword, dir, active FROM provider WHERE active = TRUE")
         return self.cursor.fetchall()
 
+    def provider_direction(self, provider_id):
+        self.cursor.execute("SELECT dir FROM provider WHERE id = ?", (provider_id,))
+        return self.cursor.fetchall()[0][0]
+
     def active_provider_id(self):
         self.cursor.execute("SELECT id FROM provider WHERE active = TRUE")
         return self.cursor.fetchall()[0][0]
@@ -40,18 +341,53 @@ class Setup:
         self.cursor.execute("UPDATE provider SET active = TRUE WHERE id = ?", (provider_id,))
         self.conn.commit()
 
-    def provider_next_id(self):
-        self.cursor.execute("SELECT MAX(id) FROM provider")
-        current_id = self.cursor.fetchall()[0][0]
-        if type(current_id) is int:
-            return current_id + 1
-        else:
-            return 1
-
     def delete_provider(self, provider_id):
         self.cursor.execute("""DELETE FROM provider WHERE id = ?""", (provider_id,))
+        self.cursor.execute("DELETE FROM databaseHash WHERE providerId = ?", (provider_id,))
+        self.cursor.execute("DELETE FROM snapshotSetting WHERE providerId = ?", (provider_id,))
         self.conn.commit()
 
+    def snapshot_settings(self, provider_id):
+        """(interval in hours, snapshots kept at least, days with a kept snapshot) of a provider"""
+        self.cursor.execute("SELECT intervalHours, keepLast, keepDays FROM snapshotSetting WHERE providerId = ?", (provider_id,))
+        row = self.cursor.fetchone()
+        return row if row else Setup.SNAPSHOT_DEFAULTS
+
+    def set_snapshot_settings(self, provider_id, interval_hours, keep_last, keep_days):
+        self.cursor.execute("INSERT OR REPLACE INTO snapshotSetting VALUES (?,?,?,?)", (provider_id, interval_hours, keep_last, keep_days))
+        self.conn.commit()
+
+    def store_hash(self, provider_id, digest=None, check=None):
+        """Stores the content hash of the database file of a provider, hashes the file without digest"""
+        direction = os.getcwd() + self.provider_direction(provider_id)
+        stat = os.stat(direction)
+        if digest is None:
+            digest = file_hash(direction, check)
+        self.cursor.execute("INSERT OR REPLACE INTO databaseHash VALUES (?,?,?,?)", (provider_id, stat.st_size, stat.st_mtime, digest))
+        self.conn.commit()
+
+    def identical_provider(self, size, digest, check=None):
+        """Id of the provider whose database file has the given size and content hash, None if there is none
+
+        Only files of the same size can be identical. Of those, the files changed since their hash was
+        stored are hashed again, every other file is only looked at with os.stat.
+        """
+        self.cursor.execute("SELECT provider.id, provider.dir, databaseHash.size, databaseHash.mtime FROM provider LEFT JOIN databaseHash ON databaseHash.providerId = provider.id")
+        current = {}
+        for provider_id, direction, stored_size, stored_mtime in self.cursor.fetchall():
+            try:
+                stat = os.stat(os.getcwd() + direction)
+            except OSError:
+                continue
+            current[provider_id] = (stat.st_size, stat.st_mtime)
+            if stat.st_size == size and current[provider_id] != (stored_size, stored_mtime):
+                self.store_hash(provider_id, check=check)
+        self.cursor.execute("SELECT providerId, size, mtime FROM databaseHash WHERE hash = ?", (digest,))
+        for provider_id, stored_size, stored_mtime in self.cursor.fetchall():
+            if current.get(provider_id) == (stored_size, stored_mtime):
+                return provider_id
+        return None
+
 
 
 class Db:
@@ -134,26 +470,136 @@ class Db:
     );
     """
 
-    def __init__(self, direction):
-        self.conn = sql.connect(direction)
-        self.cursor = self.conn.cursor()
+    # Schema upgrades in order. PRAGMA user_version holds the number of upgrades already applied.
+    _SCHEMA_UPGRADES = (
+        (
+            "CREATE INDEX IF NOT EXISTS serviceServiceComplexIndex ON service(serviceComplexId, price, additionalPrice)",
+            "CREATE INDEX IF NOT EXISTS billServiceComplexIndex ON bill(serviceComplexId)",
+            "CREATE INDEX IF NOT EXISTS billPaidIndex ON bill(paid)",
+            "CREATE INDEX IF NOT EXISTS billDateIndex ON bill(year, month, day)",
+            "CREATE INDEX IF NOT EXISTS serviceComplexCustomerIndex ON serviceComplex(customerId)",
+        ),
+        (
+            # Last bill number given per year
+            """CREATE TABLE IF NOT EXISTS billNumber (
+            year INTEGER PRIMARY KEY,
+            last INTEGER
+            )""",
+            "INSERT OR IGNORE INTO billNumber SELECT year, MAX(id) FROM bill GROUP BY year",
+        ),
+        # Full-text search. The FTS5 tables only hold the index, the triggers keep it in sync with the rows.
+        (
+            *queries.search_index("customerSearch", "customer", "id", ("firstName", "lastName", "institution")),
+            *queries.search_index("serviceSearch", "service", "id", ("description",)),
+            *queries.search_index("billSearch", "bill", "rowid", ("keyword", "comment")),
+        ),
+        # Service count and sums per service complex, kept current by triggers
+        (
+            queries.SERVICE_COMPLEX_TOTAL_TABLE,
+            *queries.SERVICE_COMPLEX_TOTAL_TRIGGERS,
+            *queries.REBUILD_SERVICE_COMPLEX_TOTALS,
+        ),
+        # Bills in number order: numbers restart every year, see BILL_TABLE_PAGE and bill_keys
+        (
+            "CREATE INDEX IF NOT EXISTS billYearIdIndex ON bill(year, id)",
+        ),
+    )
 
-        self.cursor.execute(Db.__customer_table)
-        self.cursor.execute(Db.__service_complex_table)
-        self.cursor.execute(Db.__service_table)
-        self.cursor.execute(Db.__bill_table)
-        self.cursor.execute(Db.__provider_table)
-        self.cursor.execute(Db.__version_info_table)
-        self.update_version()
+    def __init__(self, direction, profile=DEFAULT_PROFILE, bootstrap=True):
+        """Connects a provider database. Without bootstrap the schema is expected to be up to date."""
+        self.direction = direction
+        self.conn = connect(direction, profile)
+        self.cursor = self.conn.cursor()
+        self.statements = queries.Statements(self.cursor)
+        self.read_model = ReadModel(self.conn)
+        self._transaction_depth = 0
+
+        if bootstrap:
+            self.cursor.execute(Db.__customer_table)
+            self.cursor.execute(Db.__service_complex_table)
+            self.cursor.execute(Db.__service_table)
+            self.cursor.execute(Db.__bill_table)
+            self.cursor.execute(Db.__provider_table)
+            self.cursor.execute(Db.__version_info_table)
+            self.update_version()
+            self.upgrade_schema()
 
     def __del__(self):
-        self.conn.commit()
+        self.close()
+
+    def close(self):
+        if self.conn:
+            close_connection(self.conn)
+            self.conn = None
+
+    def checkpoint(self):
+        """Writes the WAL back into the database file, e.g. before the file is copied"""
+        self.cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.cursor.fetchall()
+
+    def commit(self):
+        """Commits unless a transaction block is open. The block commits once when it is left."""
+        if not self._transaction_depth:
+            self.conn.commit()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Groups any number of calls into one commit, rolled back as a whole on an exception
+
+        with db.transaction():
+            db.new_service(...)
+            db.update_bill(...)
+        """
+        self._transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._transaction_depth -= 1
+            if not self._transaction_depth:
+                self.conn.rollback()
+                # Reads inside the block may have cached rows that were rolled back. Own writes do not
+                # change PRAGMA data_version, so nothing else would drop them.
+                self.read_model.clear()
+            raise
+        self._transaction_depth -= 1
+        self.commit()
 
     def update_version(self):
         self.cursor.execute("SELECT * FROM VERSION_INFO")
         if not self.cursor.fetchall():
             self.cursor.execute("INSERT INTO VERSION_INFO VALUES (?,?,?,?)", Db._DB_VERSION)
-        self.conn.commit()
+        self.commit()
+
+    def schema_version(self):
+        self.cursor.execute("PRAGMA user_version")
+        return self.cursor.fetchall()[0][0]
+
+    def upgrade_schema(self):
+        """Applies the schema upgrades the database file is missing"""
+        version = self.schema_version()
+        for number, statements in enumerate(Db._SCHEMA_UPGRADES[version:], version + 1):
+            for statement in statements:
+                self.cursor.execute(statement)
+            self.cursor.execute(f"PRAGMA user_version = {number}")
+        self.commit()
+
+    def check_totals(self, repair=True, tolerance=1e-6):
+        """Service complexes whose stored totals drifted from their services, see SERVICE_COMPLEX_TOTAL_DRIFT
+
+        With repair, the totals of all service complexes are rebuilt if any drifted.
+        """
+        self.cursor.execute(queries.SERVICE_COMPLEX_TOTAL_DRIFT, (tolerance,))
+        drift = self.cursor.fetchall()
+        if drift and repair:
+            with self.transaction():
+                for statement in queries.REBUILD_SERVICE_COMPLEX_TOTALS:
+                    self.cursor.execute(statement)
+        return drift
+
+    def query_plan(self, statement, parameters=()):
+        """Details of EXPLAIN QUERY PLAN for a statement"""
+        self.cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+        return [row[3] for row in self.cursor.fetchall()]
 
     def tables(self):
         self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
@@ -165,23 +611,16 @@ class Db:
 
     def sc_table_query(self):
         """Data for UI service complex table"""
-        self.cursor.execute("SELECT serviceComplex.id, customer.lastName, customer.institution from customer, serviceComplex WHERE (serviceComplex.id NOT IN (SELECT serviceComplexId FROM bill) AND customer.id = serviceComplex.CustomerId)")
-        res = self.cursor.fetchall()
-        res_add = []
-        for i in res:
-            self.cursor.execute(f"SELECT COUNT(*), SUM(price) + SUM(additionalPrice) FROM service WHERE serviceComplexId = {i[0]}")
-            res_add.append(self.cursor.fetchall()[0])
-        self.conn.commit()
-        ret = []
-        for i in range(len(res)):
-            ret.append([*res[i], *res_add[i]])
-        return ret
+        self.statements.execute("sc_table_query")
+        return list(map(list, self.cursor.fetchall()))
 
     def next_sc_id(self):
+        """Id the next service complex will most likely get"""
         self.cursor.execute("SELECT MAX(id) FROM serviceComplex")
         current_id = self.cursor.fetchall()[0][0]
-        return current_id + 1 if type(current_id) is int else 0
+        return current_id + 1 if type(current_id) is int else 1
 
+    @read_model("customer")
     def customer_short(self):
         """List of short names of customers"""
         self.cursor.execute("SELECT lastName, institution FROM customer")
@@ -199,132 +638,134 @@ class Db:
     def n_of_sc(self):
         self.cursor.execute("SELECT COUNT(id) FROM serviceComplex")
         res = self.cursor.fetchall()[0]
-        self.conn.commit()
+        self.commit()
         return res
 
+    @read_model("customer")
     def customers_long(self):
         self.cursor.execute("SELECT * FROM customer")
         res = self.cursor.fetchall()
         return res
 
     def new_sc(self, customer_id):
-        self.cursor.execute("SELECT MAX(id) FROM serviceComplex")
-        current_id = self.cursor.fetchall()[0][0]
-        if type(current_id) is int:
-            next_id = current_id + 1
-        else:
-            next_id = 0
-        self.cursor.execute("INSERT INTO serviceComplex VALUES (?,?)", (next_id, customer_id))
-        self.conn.commit()
+        self.read_model.invalidate("serviceComplex")
+        self.cursor.execute("INSERT INTO serviceComplex(customerId) VALUES (?)", (customer_id,))
+        self.commit()
 
     def new_customer(self, first_name, last_name, gender, institution, street, number, postal_code, place):
-        self.cursor.execute("SELECT MAX(id) FROM customer")
-        current_id = self.cursor.fetchall()[0][0]
-        if type(current_id) is int:
-            next_id = current_id + 1
-        else:
-            next_id = 0
-        self.cursor.execute(f"INSERT INTO customer VALUES (?,?,?,?,?,?,?,?,?)",
-                           (next_id, first_name, last_name, gender, institution, street, number, postal_code, place))
-        self.conn.commit()
+        self.read_model.invalidate("customer")
+        self.cursor.execute("INSERT INTO customer VALUES (NULL,?,?,?,?,?,?,?,?)",
+                           (first_name, last_name, gender, institution, street, number, postal_code, place))
+        self.commit()
 
     def change_sc(self, sc_id, customer_id):
-        self.cursor.execute(f"UPDATE serviceComplex SET customerId = {customer_id} WHERE id = {sc_id}")
-        self.conn.commit()
+        self.read_model.invalidate("serviceComplex")
+        self.statements.execute("change_sc", (customer_id, sc_id))
+        self.commit()
 
     def delete_sc(self, sc_id):
-        self.cursor.execute(f"DELETE FROM serviceComplex WHERE id = {sc_id}")
-        self.cursor.execute(f"DELETE FROM service WHERE serviceComplexId = {sc_id}")
-        self.conn.commit()
+        self.read_model.invalidate("serviceComplex")
+        self.statements.execute("delete_services_of_sc", (sc_id,))
+        self.statements.execute("delete_sc", (sc_id,))
+        self.commit()
 
     def services_of_sc(self, sc_id):
-        self.cursor.execute(f"SELECT id, description, price, additionalPrice, day, month, year FROM service WHERE serviceComplexId = {sc_id}")
+        self.statements.execute("services_of_sc", (sc_id,))
         res = self.cursor.fetchall()
-        self.conn.commit()
+        self.commit()
         return res
 
     def new_service(self, sc_id, description, price, additional_price, day, month, year):
-        self.cursor.execute("SELECT MAX(id) FROM service")
-        current_id = self.cursor.fetchall()[0][0]
-        if type(current_id) is int:
-            next_id = current_id + 1
-        else:
-            next_id = 0
-        self.cursor.execute(f"INSERT INTO service VALUES (?,?,?,?,?,?,?,?)", (next_id, sc_id, description, price, additional_price, day, month, year))
-        self.conn.commit()
+        self.cursor.execute("INSERT INTO service VALUES (NULL,?,?,?,?,?,?,?)", (sc_id, description, price, additional_price, day, month, year))
+        self.commit()
+
+    def new_services(self, services):
+        """Inserts (sc_id, description, price, additional_price, day, month, year) rows with one commit"""
+        with self.transaction():
+            self.cursor.executemany("INSERT INTO service VALUES (NULL,?,?,?,?,?,?,?)", services)
 
     def service_info(self, s_id):
-        self.cursor.execute(f"SELECT description, price, additionalPrice, day, month, year FROM service WHERE id = {s_id}")
+        self.statements.execute("service_info", (s_id,))
         res = self.cursor.fetchall()
-        self.conn.commit()
+        self.commit()
         return res
 
     def change_service(self, s_id, description, price, additional_price, day, month, year):
-        self.cursor.execute(f"UPDATE service SET description = '{description}', price={price}, additionalPrice={additional_price}, day={day}, month={month}, year={year} WHERE id = {s_id}")
-        self.conn.commit()
+        self.statements.execute("change_service", (description, price, additional_price, day, month, year, s_id))
+        self.commit()
+
+    def table_page(self, table, key, limit, backward=False):
+        """Rows of the UI table "sc_table", "bill_table" or "all_bills_table" next to key, in key order
+
+        key is (service complex id,) or (year, bill id), the leading columns of the rows. Forward pages hold the rows after key, backward
+        pages the rows before it. A page shorter than limit reached the end of the table.
+        """
+        name = f"{table}_page_backward" if backward else f"{table}_page"
+        self.statements.execute(name, (*key, limit))
+        rows = self.cursor.fetchall()
+        if backward:
+            rows.reverse()
+        return rows
 
     def bill_table_query(self):
-        self.cursor.execute("SELECT bill.id, bill.year, customer.lastName, customer.institution, bill.keyword from customer, bill, serviceComplex WHERE (bill.serviceComplexId = serviceComplex.id AND customer.id = serviceComplex.customerId AND bill.paid = FALSE)")
-        res = self.cursor.fetchall()
-        res_add = []
-        for i in res:
-            self.cursor.execute(f"SELECT SUM(price) + SUM(additionalPrice) FROM service WHERE serviceComplexId = (SELECT serviceComplexId FROM bill WHERE id = {i[0]})")
-            res_add.append(self.cursor.fetchall()[0])
-        self.conn.commit()
-        ret = []
-        for i in range(len(res)):
-            ret.append([*res[i], *res_add[i]])
-        return ret
+        """Data for UI open bill table"""
+        self.statements.execute("bill_table_query")
+        return list(map(list, self.cursor.fetchall()))
 
     def all_bills_table_query(self):
-        self.cursor.execute("SELECT bill.id, bill.year, customer.lastName, customer.institution, bill.keyword from customer, bill, serviceComplex WHERE (bill.serviceComplexId = serviceComplex.id AND customer.id = serviceComplex.customerId)")
-        res = self.cursor.fetchall()
-        res_add = []
-        for i in res:
-            self.cursor.execute(f"SELECT SUM(price) + SUM(additionalPrice) FROM service WHERE serviceComplexId = (SELECT serviceComplexId FROM bill WHERE id = {i[0]})")
-            res_add.append(self.cursor.fetchall()[0])
-        self.conn.commit()
-        ret = []
-        for i in range(len(res)):
-            ret.append([*res[i], *res_add[i]])
-        return ret
+        """Data for UI table of all bills"""
+        self.statements.execute("all_bills_table_query")
+        return list(map(list, self.cursor.fetchall()))
 
     def new_bill(self, sc_id, provider_id, day, month, year, keyword, comment, sbo, valid, paid):
-        self.cursor.execute(f"SELECT COUNT(*) FROM bill WHERE year={year}")
-        count = self.cursor.fetchall()[0][0]
-        if type(count) is int:
-            next_id = count + 1
-        else:
-            next_id = 0
-        self.cursor.execute(f"INSERT INTO bill VALUES (?,?,?,?,?,?,?,?,?,?,?)", (next_id, sc_id, provider_id, day, month, year, keyword, comment, sbo, valid, paid))
-        self.conn.commit()
-
+        """Creates a bill with the next number of its year and returns the number
+
+        Counting up billNumber takes the write lock, so the number cannot be given twice.
+        """
+        self.read_model.invalidate("bill")
+        self.cursor.execute("INSERT INTO billNumber VALUES (?, 1) ON CONFLICT(year) DO UPDATE SET last = last + 1", (year,))
+        self.cursor.execute("INSERT INTO bill SELECT last,?,?,?,?,?,?,?,?,?,? FROM billNumber WHERE year = ?",
+                            (sc_id, provider_id, day, month, year, keyword, comment, sbo, valid, paid, year))
+        self.cursor.execute("SELECT last FROM billNumber WHERE year = ?", (year,))
+        bill_id = self.cursor.fetchall()[0][0]
+        self.commit()
+        return bill_id
+
+    @read_model("provider")
     def provider_info(self):
-        self.cursor.execute("SELECT * FROM provider WHERE ACTIVE = TRUE")
+        self.statements.execute("active_provider")
         return self.cursor.fetchall()[0]
 
+    @read_model("provider", "customer", "serviceComplex")
     def create_bill_data(self, sc_id):
-        self.cursor.execute("SELECT * FROM provider WHERE ACTIVE = TRUE")
+        self.statements.execute("active_provider")
         provider_info = self.cursor.fetchall()[0]
-        self.cursor.execute(f"SELECT customer.firstName, customer.lastName, customer.institution, customer.street, customer.number, customer.postalCode, customer.place FROM customer, ServiceComplex WHERE customer.id = ServiceComplex.customerId AND ServiceComplex.id = {sc_id}")
+        self.statements.execute("sc_customer_address", (sc_id,))
         customer_info = self.cursor.fetchall()[0]
-        self.conn.commit()
+        self.commit()
         return provider_info, customer_info
 
     def bill_data(self, bill_id, year):
-        self.cursor.execute(f"SELECT * FROM bill WHERE id = {bill_id} AND year = {year}")
+        self.statements.execute("bill", (bill_id, year))
         bill_part = self.cursor.fetchall()[0]
-        self.cursor.execute(f"SELECT * FROM provider WHERE id = {bill_part[2]}")
+        self.statements.execute("provider", (bill_part[2],))
         provider_part = self.cursor.fetchall()[0]
-        self.cursor.execute(f"SELECT customer.firstName, customer.lastName, customer.institution, customer.street, customer.number, customer.postalCode, customer.place FROM customer, serviceComplex WHERE serviceComplex.id = {bill_part[1]} AND customer.id = serviceComplex.customerId")
+        self.statements.execute("sc_customer_address", (bill_part[1],))
         customer_part = self.cursor.fetchall()[0]
-        self.conn.commit()
+        self.commit()
         return bill_part, provider_part, customer_part
 
     def update_bill(self, bill_id, bill_year, valid, paid):
         self.cursor.execute("UPDATE bill SET valid = ?, paid = ? WHERE id = ? AND year = ?", (valid, paid, bill_id, bill_year))
-        self.conn.commit()
+        self.commit()
 
+    def update_bills(self, bills):
+        """Updates (bill_id, bill_year, valid, paid) rows with one commit"""
+        with self.transaction():
+            self.cursor.executemany("UPDATE bill SET valid = ?, paid = ? WHERE id = ? AND year = ?",
+                                    ((valid, paid, bill_id, bill_year) for bill_id, bill_year, valid, paid in bills))
+
+    @read_model("provider", "bill")
     def bill_provider_info(self, bill_id, bill_year):
         self.cursor.execute("SELECT * FROM provider WHERE id = (SELECT providerId FROM bill WHERE id = ? and year = ?)", (bill_id, bill_year))
         return self.cursor.fetchall()[0]
@@ -345,28 +786,165 @@ class Db:
         else:
             return ()
 
+    def bill_keys(self, paid=None, begin=None, end=None):
+        """(id, year) of the bills in bill number order (year, id), optionally only (un)paid ones or dated
+        within (year, month, day) begin and end"""
+        conditions, parameters = [], []
+        if paid is not None:
+            conditions.append("paid = ?")
+            parameters.append(paid)
+        if begin is not None:
+            conditions.append("(year, month, day) >= (?, ?, ?)")
+            parameters.extend(begin)
+        if end is not None:
+            conditions.append("(year, month, day) <= (?, ?, ?)")
+            parameters.extend(end)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        self.cursor.execute("SELECT id, year FROM bill" + where + " ORDER BY year, id", parameters)
+        return self.cursor.fetchall()
+
+    def bills_render_data(self, keys):
+        """Provider, bill, customer and services of many bills at once, by (id, year)
+
+        Returns the same rows as bill_provider_info, bill_info, bill_customer_info and bill_services_info,
+        in bill number order (year, id).
+        """
+        self.cursor.execute("CREATE TEMP TABLE IF NOT EXISTS renderKey (year INTEGER, id INTEGER, PRIMARY KEY (year, id))")
+        self.cursor.execute("DELETE FROM renderKey")
+        self.cursor.executemany("INSERT OR IGNORE INTO renderKey VALUES (?,?)", ((int(y), int(i)) for i, y in keys))
+        self.cursor.execute("SELECT bill.* FROM renderKey JOIN bill USING (id, year) ORDER BY renderKey.year, renderKey.id")
+        bills = {(row[0], row[5]): row for row in self.cursor.fetchall()}
+        self.cursor.execute("SELECT * FROM provider WHERE id IN (SELECT providerId FROM renderKey JOIN bill USING (id, year))")
+        providers = {row[0]: row for row in self.cursor.fetchall()}
+        self.cursor.execute("SELECT bill.id, bill.year, customer.* FROM renderKey JOIN bill USING (id, year) JOIN serviceComplex ON serviceComplex.id = bill.serviceComplexId JOIN customer ON customer.id = serviceComplex.customerId")
+        customers = {row[:2]: row[2:] for row in self.cursor.fetchall()}
+        # CROSS JOIN keeps sqlite from scanning all bills for the few keys
+        self.cursor.execute("SELECT bill.id, bill.year, service.* FROM renderKey CROSS JOIN bill USING (id, year) JOIN service ON service.serviceComplexId = bill.serviceComplexId ORDER BY service.year, service.month, service.day")
+        services = collections.defaultdict(list)
+        for row in self.cursor.fetchall():
+            services[row[:2]].append(row[2:])
+        self.cursor.execute("DELETE FROM renderKey")
+        self.commit()
+        return {key: (providers[bill[2]], bill, customers[key], tuple(services[key])) for key, bill in bills.items()}
+
     def delete_service(self, service_id):
-        self.cursor.execute(f"DELETE FROM service WHERE id = {service_id}")
-        self.conn.commit()
+        self.statements.execute("delete_service", (service_id,))
+        self.commit()
 
     def new_provider(self, tax_id, first_name, last_name, gender, street, number, postalcode, place, telephone, email, iban, bic, website):
+        self.read_model.invalidate("provider")
         self.cursor.execute("UPDATE provider SET active = FALSE")
         self.cursor.execute("INSERT INTO provider(taxId, firstName, lastName, gender, street, number, postalCode, place, telephone, email, iban, bic, website, active) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)", (tax_id, first_name, last_name, gender, street, number, postalcode, place, telephone, email, iban, bic, website, True))
+        self.commit()
 
+    @read_model("provider")
     def provider_for_setup_info(self):
         self.cursor.execute("SELECT firstName, lastName FROM provider WHERE active = TRUE")
         return self.cursor.fetchall()[0]
 
+    @read_model("customer", "serviceComplex", "bill")
     def customers_with_bills(self):
-        self.cursor.execute("SELECT id, firstName, lastName, institution FROM customer WHERE id = (SELECT customerId FROM serviceComplex WHERE id = (SELECT serviceComplexId FROM bill))")
+        self.cursor.execute("SELECT id, firstName, lastName, institution FROM customer WHERE id IN (SELECT customerId FROM serviceComplex WHERE id IN (SELECT serviceComplexId FROM bill))")
+        return self.cursor.fetchall()
+
+    @staticmethod
+    def search_expression(text):
+        """FTS5 query of user input: every word has to occur, as a word or the start of one"""
+        words = text.replace('"', " ").split()
+        return " ".join(f'"{word}"*' for word in words)
+
+    def search_customers(self, text, limit=50):
+        """Customer rows matching text, best match first, with the rank as last column"""
+        expression = self.search_expression(text)
+        if not expression:
+            return []
+        self.statements.execute("search_customers", (expression, limit))
+        return self.cursor.fetchall()
+
+    def search_bills(self, text, limit=50):
+        """Bills whose keyword or comment match text, as rows of all_bills_table_query plus the rank"""
+        expression = self.search_expression(text)
+        if not expression:
+            return []
+        self.statements.execute("search_bills", (expression, limit))
+        return self.cursor.fetchall()
+
+    def search_services(self, text, limit=50):
+        """Services whose description matches text: id, service complex, description, date, bill id and year
+        (None before the service complex is billed) and the rank"""
+        expression = self.search_expression(text)
+        if not expression:
+            return []
+        self.statements.execute("search_services", (expression, limit))
+        return self.cursor.fetchall()
+
+    def search(self, text, limit=20):
+        """Customers, bills and services matching text as (kind, rows), kind is "customer", "bill" or "service"
+
+        The rows of each kind are its best limit matches, best first. FTS5 ranks depend on the statistics
+        of their own index, so they only order the matches within one kind.
+        """
+        return [
+            ("customer", self.search_customers(text, limit)),
+            ("bill", self.search_bills(text, limit)),
+            ("service", self.search_services(text, limit)),
+        ]
+
+    def revenue(self, by, begin=(0, 1, 1), end=(9999, 12, 31)):
+        """Revenue of the valid bills dated within (year, month, day) begin and end, aggregated in sqlite
+
+        by is "month", "customer" or "paid". Rows are the group columns (year, month / customer id, last
+        name, institution / paid) followed by the number of bills, the net and the additional sum.
+        """
+        self.statements.execute("revenue_by_" + by, (*begin, *end))
         return self.cursor.fetchall()
 
     def bill_overview(self, customer, bday, bmonth, byear, eday, emonth, eyear):
+        """Bills dated within the given range with their service sums, for all customers ("*") or one
+
+        Returns a cursor of its own, so the rows can be streamed while other queries run.
+        """
+        date_range = tuple(map(int, (byear, bmonth, bday, eyear, emonth, eday)))
         if customer == "*":
-            self.cursor.execute("SELECT customer.firstName, customer.lastName, customer.institution, bill.id, bill.keyword, bill.day, bill.month, bill.year, service.price, service.additionalPrice, bill.valid, bill.paid FROM customer, bill, serviceComplex, service WHERE bill.serviceComplexId = serviceComplex.id AND serviceComplex.customerId = customer.id AND service.ServiceComplexId = serviceComplex.id ORDER BY customer.id, serviceComplex.id")
-            bills = self.cursor.fetchall()
-            ret = []
-            for ele in bills:
-                if int(bday) <= ele[5] <= int(eday) and int(bmonth) <= ele[6] <= int(emonth) and int(byear) <= ele[7] <= int(eyear):
-                    ret.append(ele)
-            return ret
+            return self.statements.execute("all_customers_bill_overview", date_range, self.conn.cursor())
+        return self.statements.execute("customer_bill_overview", (*date_range, customer[0]), self.conn.cursor())
+
+
+class ProviderConnections:
+    """Open provider databases by Setup provider id
+
+    Keeps up to max_open connections and closes the least recently used one beyond that, so a Db must
+    not be kept but looked up here again, see ui.ProviderWindow.
+    The schema of a database file is only bootstrapped the first time it is opened.
+    """
+    def __init__(self, setup, max_open=4, profile=DEFAULT_PROFILE):
+        self.setup = setup
+        self.max_open = max_open
+        self.profile = profile
+        self.open = collections.OrderedDict()
+        self.verified = set()
+
+    def get(self, provider_id):
+        if provider_id in self.open:
+            self.open.move_to_end(provider_id)
+            return self.open[provider_id]
+        direction = os.getcwd() + self.setup.provider_direction(provider_id)
+        db = Db(direction, self.profile, bootstrap=direction not in self.verified)
+        self.verified.add(direction)
+        self.open[provider_id] = db
+        while len(self.open) > self.max_open:
+            self.open.popitem(last=False)[1].close()
+        return db
+
+    def active(self):
+        return self.get(self.setup.active_provider_id())
+
+    def discard(self, provider_id):
+        """Closes the connection of a provider, e.g. before its database file is deleted"""
+        if provider_id in self.open:
+            self.open.pop(provider_id).close()
+        self.verified.discard(os.getcwd() + self.setup.provider_direction(provider_id))
+
+    def close(self):
+        while self.open:
+            self.open.popitem()[1].close()
@@ -0,0 +1,104 @@
+"""Bulk export of the provider database for analysis in other tools
+
+Tables are streamed through a cursor in batches of BATCH_SIZE rows, so memory does not grow with the
+table. CSV needs nothing beyond the standard library. Parquet and Arrow (Feather) files are written with
+pyarrow, which is only imported when such a file is written and is not needed otherwise.
+"""
+import csv
+import os
+
+# Tables exported by default
+EXPORT_TABLES = ("customer", "serviceComplex", "service", "bill")
+BATCH_SIZE = 10_000
+FORMATS = ("csv", "parquet", "arrow")
+
+
+def columns(conn, table):
+    """(name, declared type) of the columns of a table"""
+    return [(row[1], row[2].upper()) for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def batches(conn, table, batch_size=BATCH_SIZE):
+    """Rows of a table in batches of at most batch_size rows, in rowid order"""
+    cursor = conn.execute(f"SELECT * FROM {table} ORDER BY rowid")
+    while rows := cursor.fetchmany(batch_size):
+        yield rows
+
+
+def arrow_schema(table_columns):
+    import pyarrow
+    types = {"INTEGER": pyarrow.int64(), "REAL": pyarrow.float64(), "TEXT": pyarrow.string(),
+             "BOOL": pyarrow.bool_(), "BOOLEAN": pyarrow.bool_()}
+    return pyarrow.schema([(name, types.get(declared, pyarrow.string())) for name, declared in table_columns])
+
+
+def column_array(values, arrow_type):
+    import pyarrow
+    if arrow_type == pyarrow.string():
+        return pyarrow.array(values, type=arrow_type)
+    # sqlite does not enforce the declared types, so numeric columns can hold '' from empty entries.
+    # These become nulls.
+    values = [None if value == "" else value for value in values]
+    if arrow_type == pyarrow.bool_():
+        # sqlite stores booleans as 0 and 1
+        return pyarrow.array(values, type=pyarrow.int64()).cast(arrow_type)
+    return pyarrow.array(values, type=arrow_type)
+
+
+def write_csv(conn, table, direction, batch_size=BATCH_SIZE):
+    with open(direction, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow([name for name, _ in columns(conn, table)])
+        count = 0
+        for rows in batches(conn, table, batch_size):
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+def write_arrow(conn, table, direction, file_format, batch_size=BATCH_SIZE):
+    """Writes a table as Parquet or Arrow IPC file, one record batch per batch of rows"""
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+    schema = arrow_schema(columns(conn, table))
+    if file_format == "parquet":
+        writer = pyarrow.parquet.ParquetWriter(direction, schema)
+    else:
+        writer = pyarrow.ipc.new_file(direction, schema)
+    count = 0
+    try:
+        for rows in batches(conn, table, batch_size):
+            # Rows to columns, converted by pyarrow in one call per column
+            arrays = [column_array(values, field.type) for values, field in zip(zip(*rows), schema)]
+            writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=schema))
+            count += len(rows)
+    finally:
+        writer.close()
+    return count
+
+
+def export_tables(db, directory, file_format="csv", tables=EXPORT_TABLES, batch_size=BATCH_SIZE, progress=None):
+    """Writes each table into directory as <table>.csv, .parquet or .arrow and returns the rows per table
+
+    All tables are read in one read transaction, so they fit together while the database is written.
+    progress(table) is called before each table.
+    """
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown format {file_format}, expected one of {', '.join(FORMATS)}")
+    os.makedirs(directory, exist_ok=True)
+    counts = {}
+    db.commit()
+    db.conn.execute("BEGIN")
+    try:
+        for table in tables:
+            if progress:
+                progress(table)
+            direction = os.path.join(directory, f"{table}.{file_format}")
+            if file_format == "csv":
+                counts[table] = write_csv(db.conn, table, direction, batch_size)
+            else:
+                counts[table] = write_arrow(db.conn, table, direction, file_format, batch_size)
+    finally:
+        db.conn.rollback()
+    return counts
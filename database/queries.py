@@ -0,0 +1,263 @@
+"""SQL of the provider database
+
+Every table or report of the UI is built by one statement instead of one additional query per row.
+Statements are named and only take values as parameters, so each one always has the same SQL text
+and is prepared once per connection.
+
+The service count and sums of every service complex are kept in serviceComplexTotal by triggers on
+every write, so the tables read them instead of aggregating the services.
+"""
+
+# Running totals of the services of each service complex
+SERVICE_COMPLEX_TOTAL_TABLE = """CREATE TABLE IF NOT EXISTS serviceComplexTotal (
+    serviceComplexId INTEGER PRIMARY KEY,
+    services INTEGER NOT NULL DEFAULT 0,
+    price REAL NOT NULL DEFAULT 0,
+    additionalPrice REAL NOT NULL DEFAULT 0
+    )"""
+
+_ADD_SERVICE = """UPDATE serviceComplexTotal
+    SET services = services + 1, price = price + IFNULL(new.price, 0), additionalPrice = additionalPrice + IFNULL(new.additionalPrice, 0)
+    WHERE serviceComplexId = new.serviceComplexId;"""
+
+_REMOVE_SERVICE = """UPDATE serviceComplexTotal
+    SET services = services - 1, price = price - IFNULL(old.price, 0), additionalPrice = additionalPrice - IFNULL(old.additionalPrice, 0)
+    WHERE serviceComplexId = old.serviceComplexId;"""
+
+SERVICE_COMPLEX_TOTAL_TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS serviceComplexTotalInsert AFTER INSERT ON serviceComplex BEGIN
+    INSERT OR IGNORE INTO serviceComplexTotal(serviceComplexId) VALUES (new.id); END""",
+    """CREATE TRIGGER IF NOT EXISTS serviceComplexTotalDelete AFTER DELETE ON serviceComplex BEGIN
+    DELETE FROM serviceComplexTotal WHERE serviceComplexId = old.id; END""",
+    f"CREATE TRIGGER IF NOT EXISTS serviceTotalInsert AFTER INSERT ON service BEGIN {_ADD_SERVICE} END",
+    f"CREATE TRIGGER IF NOT EXISTS serviceTotalDelete AFTER DELETE ON service BEGIN {_REMOVE_SERVICE} END",
+    f"""CREATE TRIGGER IF NOT EXISTS serviceTotalUpdate AFTER UPDATE OF serviceComplexId, price, additionalPrice ON service
+    BEGIN {_REMOVE_SERVICE} {_ADD_SERVICE} END""",
+)
+
+# Totals computed from the services, what serviceComplexTotal has to hold
+_ACTUAL_TOTALS = """SELECT serviceComplex.id AS serviceComplexId, COUNT(service.id) AS services,
+    TOTAL(service.price) AS price, TOTAL(service.additionalPrice) AS additionalPrice
+    FROM serviceComplex
+    LEFT JOIN service ON service.serviceComplexId = serviceComplex.id
+    GROUP BY serviceComplex.id"""
+
+REBUILD_SERVICE_COMPLEX_TOTALS = (
+    "DELETE FROM serviceComplexTotal",
+    "INSERT INTO serviceComplexTotal " + _ACTUAL_TOTALS,
+)
+
+# Service complexes whose stored totals differ from their services: id, stored count, price and
+# additional price, actual count, price and additional price. Sums may differ by the tolerance ? from
+# rounding. Stored rows without a service complex have no actual values.
+SERVICE_COMPLEX_TOTAL_DRIFT = f"""WITH actual AS ({_ACTUAL_TOTALS})
+    SELECT actual.serviceComplexId, total.services, total.price, total.additionalPrice,
+    actual.services, actual.price, actual.additionalPrice
+    FROM actual
+    LEFT JOIN serviceComplexTotal AS total ON total.serviceComplexId = actual.serviceComplexId
+    WHERE total.serviceComplexId IS NULL OR total.services != actual.services
+    OR ABS(total.price - actual.price) > ?1 OR ABS(total.additionalPrice - actual.additionalPrice) > ?1
+    UNION ALL
+    SELECT serviceComplexId, services, price, additionalPrice, NULL, NULL, NULL
+    FROM serviceComplexTotal
+    WHERE serviceComplexId NOT IN (SELECT id FROM serviceComplex)
+    """
+
+SC_TABLE_QUERY = """SELECT serviceComplex.id, customer.lastName, customer.institution,
+    total.services, total.price + total.additionalPrice
+    FROM serviceComplex
+    JOIN customer ON customer.id = serviceComplex.customerId
+    LEFT JOIN serviceComplexTotal AS total ON total.serviceComplexId = serviceComplex.id
+    WHERE serviceComplex.id NOT IN (SELECT serviceComplexId FROM bill)
+    """
+
+ALL_BILLS_TABLE_QUERY = """SELECT bill.id, bill.year, customer.lastName, customer.institution, bill.keyword,
+    total.price + total.additionalPrice
+    FROM bill
+    JOIN serviceComplex ON serviceComplex.id = bill.serviceComplexId
+    JOIN customer ON customer.id = serviceComplex.customerId
+    LEFT JOIN serviceComplexTotal AS total ON total.serviceComplexId = bill.serviceComplexId
+    ORDER BY bill.year, bill.id
+    """
+
+BILL_TABLE_QUERY = """SELECT bill.id, bill.year, customer.lastName, customer.institution, bill.keyword,
+    total.price + total.additionalPrice
+    FROM bill
+    JOIN serviceComplex ON serviceComplex.id = bill.serviceComplexId
+    JOIN customer ON customer.id = serviceComplex.customerId
+    LEFT JOIN serviceComplexTotal AS total ON total.serviceComplexId = bill.serviceComplexId
+    WHERE bill.paid = FALSE
+    ORDER BY bill.year, bill.id
+    """
+
+# Keyset pages of the UI tables: the rows after (forward) or before (backward) a key, in key order.
+# Forward pages are ascending, backward pages descending, so both stop after LIMIT rows of the key index.
+# Bill numbers restart every year, so bill pages are keyed by (year, id) and lead with these columns.
+# The unary + keeps the open bill page on the key index instead of sorting all open bills from billPaidIndex.
+SC_TABLE_PAGE = """SELECT serviceComplex.id, customer.lastName, customer.institution,
+    total.services, total.price + total.additionalPrice
+    FROM serviceComplex
+    JOIN customer ON customer.id = serviceComplex.customerId
+    LEFT JOIN serviceComplexTotal AS total ON total.serviceComplexId = serviceComplex.id
+    WHERE serviceComplex.id NOT IN (SELECT serviceComplexId FROM bill)
+    AND serviceComplex.id {operator} ?
+    ORDER BY serviceComplex.id {order}
+    LIMIT ?
+    """
+
+BILL_TABLE_PAGE = """SELECT bill.year, bill.id, customer.lastName, customer.institution, bill.keyword,
+    total.price + total.additionalPrice
+    FROM bill
+    JOIN serviceComplex ON serviceComplex.id = bill.serviceComplexId
+    JOIN customer ON customer.id = serviceComplex.customerId
+    LEFT JOIN serviceComplexTotal AS total ON total.serviceComplexId = bill.serviceComplexId
+    WHERE (bill.year, bill.id) {operator} (?, ?)
+    {paid_filter}
+    ORDER BY bill.year {order}, bill.id {order}
+    LIMIT ?
+    """
+
+
+def table_pages(name, template, **filters):
+    """Forward and backward statement of a keyset paged table"""
+    return {
+        name: template.format(operator=">", order="ASC", **filters),
+        name + "_backward": template.format(operator="<", order="DESC", **filters),
+    }
+
+
+# One row per bill with the sums of its services.
+# The overview of all customers searches the bill date range through the bill(year, month, day) index and
+# sorts only the bills in range. INDEXED BY keeps sqlite from preferring bill(year, id), which only narrows
+# the years. The overview of one customer goes from the customer to its few bills and checks their dates.
+BILL_OVERVIEW = """SELECT customer.firstName, customer.lastName, customer.institution, bill.id, bill.keyword,
+    bill.day, bill.month, bill.year,
+    total.price, total.additionalPrice,
+    bill.valid, bill.paid
+    FROM bill {bill_index}
+    JOIN serviceComplex ON serviceComplex.id = bill.serviceComplexId
+    JOIN customer ON customer.id = serviceComplex.customerId
+    LEFT JOIN serviceComplexTotal AS total ON total.serviceComplexId = bill.serviceComplexId
+    WHERE (bill.year, bill.month, bill.day) BETWEEN (?, ?, ?) AND (?, ?, ?)
+    {customer_filter}
+    ORDER BY customer.id, serviceComplex.id
+    """
+
+ALL_CUSTOMERS_BILL_OVERVIEW = BILL_OVERVIEW.format(bill_index="INDEXED BY billDateIndex", customer_filter="")
+
+CUSTOMER_BILL_OVERVIEW = BILL_OVERVIEW.format(bill_index="", customer_filter="AND customer.id = ?")
+
+def search_index(name, table, rowid, columns):
+    """Statements creating an external content FTS5 index over columns of table, kept in sync by triggers"""
+    column_list = ", ".join(columns)
+    new_values = ", ".join("new." + column for column in columns)
+    old_values = ", ".join("old." + column for column in columns)
+    delete = f"INSERT INTO {name}({name}, rowid, {column_list}) VALUES ('delete', old.{rowid}, {old_values});"
+    insert = f"INSERT INTO {name}(rowid, {column_list}) VALUES (new.{rowid}, {new_values});"
+    return (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5({column_list}, content='{table}', content_rowid='{rowid}', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {name}Insert AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {name}Delete AFTER DELETE ON {table} BEGIN {delete} END",
+        f"CREATE TRIGGER IF NOT EXISTS {name}Update AFTER UPDATE OF {column_list} ON {table} BEGIN {delete} {insert} END",
+        f"INSERT INTO {name}({name}) VALUES ('rebuild')",
+    )
+
+
+# Search results, best match first. The FTS5 match is ranked and limited before the rows are joined.
+SEARCH_CUSTOMERS = """SELECT customer.*, hits.rank
+    FROM (SELECT rowid, rank FROM customerSearch WHERE customerSearch MATCH ? ORDER BY rank LIMIT ?) AS hits
+    JOIN customer ON customer.id = hits.rowid
+    ORDER BY hits.rank
+    """
+
+SEARCH_BILLS = """SELECT bill.id, bill.year, customer.lastName, customer.institution, bill.keyword,
+    total.price + total.additionalPrice,
+    hits.rank
+    FROM (SELECT rowid, rank FROM billSearch WHERE billSearch MATCH ? ORDER BY rank LIMIT ?) AS hits
+    JOIN bill ON bill.rowid = hits.rowid
+    JOIN serviceComplex ON serviceComplex.id = bill.serviceComplexId
+    JOIN customer ON customer.id = serviceComplex.customerId
+    LEFT JOIN serviceComplexTotal AS total ON total.serviceComplexId = bill.serviceComplexId
+    ORDER BY hits.rank
+    """
+
+SEARCH_SERVICES = """SELECT service.id, service.serviceComplexId, service.description, service.day, service.month, service.year,
+    bill.id, bill.year, hits.rank
+    FROM (SELECT rowid, rank FROM serviceSearch WHERE serviceSearch MATCH ? ORDER BY rank LIMIT ?) AS hits
+    JOIN service ON service.id = hits.rowid
+    LEFT JOIN bill ON bill.serviceComplexId = service.serviceComplexId
+    ORDER BY hits.rank
+    """
+
+# Revenue of the valid bills dated within (year, month, day) ? and ?, aggregated by sqlite from the
+# stored totals of the billed service complexes: one row per group with bill count, net and additional sum
+REVENUE = """SELECT {group_columns}, COUNT(*), TOTAL(total.price), TOTAL(total.additionalPrice)
+    FROM bill
+    JOIN serviceComplex ON serviceComplex.id = bill.serviceComplexId
+    LEFT JOIN serviceComplexTotal AS total ON total.serviceComplexId = bill.serviceComplexId
+    {customer_join}
+    WHERE (bill.year, bill.month, bill.day) BETWEEN (?, ?, ?) AND (?, ?, ?)
+    AND bill.valid = TRUE
+    GROUP BY {group_columns}
+    ORDER BY {group_columns}
+    """
+
+REVENUE_BY_MONTH = REVENUE.format(group_columns="bill.year, bill.month", customer_join="")
+
+REVENUE_BY_CUSTOMER = REVENUE.format(group_columns="customer.id, customer.lastName, customer.institution",
+                                     customer_join="JOIN customer ON customer.id = serviceComplex.customerId")
+
+REVENUE_BY_PAID = REVENUE.format(group_columns="bill.paid", customer_join="")
+
+# Named statements executed through Statements
+STATEMENTS = {
+    "sc_table_query": SC_TABLE_QUERY,
+    "bill_table_query": BILL_TABLE_QUERY,
+    "all_bills_table_query": ALL_BILLS_TABLE_QUERY,
+    "all_customers_bill_overview": ALL_CUSTOMERS_BILL_OVERVIEW,
+    "customer_bill_overview": CUSTOMER_BILL_OVERVIEW,
+    "change_sc": "UPDATE serviceComplex SET customerId = ? WHERE id = ?",
+    "delete_sc": "DELETE FROM serviceComplex WHERE id = ?",
+    "delete_services_of_sc": "DELETE FROM service WHERE serviceComplexId = ?",
+    "services_of_sc": "SELECT id, description, price, additionalPrice, day, month, year FROM service WHERE serviceComplexId = ?",
+    "service_info": "SELECT description, price, additionalPrice, day, month, year FROM service WHERE id = ?",
+    "change_service": "UPDATE service SET description = ?, price = ?, additionalPrice = ?, day = ?, month = ?, year = ? WHERE id = ?",
+    "delete_service": "DELETE FROM service WHERE id = ?",
+    "active_provider": "SELECT * FROM provider WHERE ACTIVE = TRUE",
+    "provider": "SELECT * FROM provider WHERE id = ?",
+    "bill": "SELECT * FROM bill WHERE id = ? AND year = ?",
+    **table_pages("sc_table_page", SC_TABLE_PAGE),
+    **table_pages("bill_table_page", BILL_TABLE_PAGE, paid_filter="AND +bill.paid = FALSE"),
+    **table_pages("all_bills_table_page", BILL_TABLE_PAGE, paid_filter=""),
+    "search_customers": SEARCH_CUSTOMERS,
+    "search_bills": SEARCH_BILLS,
+    "search_services": SEARCH_SERVICES,
+    "revenue_by_month": REVENUE_BY_MONTH,
+    "revenue_by_customer": REVENUE_BY_CUSTOMER,
+    "revenue_by_paid": REVENUE_BY_PAID,
+    "sc_customer_address": "SELECT customer.firstName, customer.lastName, customer.institution, customer.street, customer.number, customer.postalCode, customer.place FROM customer, serviceComplex WHERE serviceComplex.id = ? AND customer.id = serviceComplex.customerId",
+}
+
+# Distinct SQL texts of the named statements, plus the 128 statements sqlite3 caches by default for the
+# SQL Db executes as plain text, e.g. the schema and the filters of bill_keys
+NAMED_SQL = len(set(STATEMENTS.values()))
+STATEMENT_CACHE_SIZE = NAMED_SQL + 128
+
+
+class Statements:
+    """Executes named statements on a cursor
+
+    sqlite3 keeps the last STATEMENT_CACHE_SIZE prepared statements of a connection by their SQL text, so
+    a named statement is parsed once per connection.
+    """
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, name, parameters=(), cursor=None):
+        """Executes a named statement on the shared cursor or on the given one"""
+        return (cursor or self.cursor).execute(STATEMENTS[name], parameters)
+
+    @staticmethod
+    def stats():
+        return {"size": STATEMENT_CACHE_SIZE, "named": len(STATEMENTS), "named_sql": NAMED_SQL}
@@ -0,0 +1,234 @@
+"""Compressed, deduplicated snapshots of provider databases
+
+A snapshot copies the database with database.backup, so it shows one moment while the database is
+used, and cuts the copy into chunks of CHUNK_SIZE bytes. Each distinct chunk is stored once, compressed
+with zlib, under its BLAKE2b hash. A snapshot is the list of its chunk ids, so a snapshot of a database
+that changed by a few rows only adds the chunks holding the changed pages.
+The snapshots of all providers share one store file. Which snapshots are kept is set per provider in
+Setup, see Setup.snapshot_settings.
+"""
+import array
+import datetime
+import hashlib
+import os
+import sqlite3 as sql
+import time
+import zlib
+
+import database
+
+# Bytes per chunk, the default sqlite page size: a changed page changes a single chunk
+CHUNK_SIZE = 4096
+DEFAULT_DIRECTION = "snapshots/snapshots.db"
+
+
+def chunk_hash(chunk):
+    return hashlib.blake2b(chunk, digest_size=16).digest()
+
+
+def file_signature(direction):
+    """Size and modification time of a database file and its WAL. Every commit changes it."""
+    signature = []
+    for path in (direction, direction + "-wal"):
+        try:
+            stat = os.stat(path)
+            signature.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+        except OSError:
+            signature.append("")
+    return " ".join(signature)
+
+
+def retained(snapshots, keep_last, keep_days, now):
+    """Ids of the snapshots to keep: the keep_last newest ones and the newest one of each of the last
+    keep_days days. snapshots are (id, created, size) rows, newest first."""
+    keep = {snapshot[0] for snapshot in snapshots[:keep_last]}
+    days = set()
+    for snapshot_id, created, _ in snapshots:
+        day = datetime.date.fromtimestamp(created)
+        if now - created <= keep_days * 86400 and day not in days:
+            days.add(day)
+            keep.add(snapshot_id)
+    return keep
+
+
+class SnapshotStore:
+    """Snapshots of every provider database in one sqlite file
+
+    Like every connection, a store may only be used by the thread that opened it.
+    """
+    __chunk_table = """CREATE TABLE IF NOT EXISTS chunk (
+    id INTEGER PRIMARY KEY,
+    hash BLOB UNIQUE,
+    data BLOB
+    )
+    """
+
+    __snapshot_table = """CREATE TABLE IF NOT EXISTS snapshot (
+    id INTEGER PRIMARY KEY,
+    providerId INTEGER,
+    created REAL,
+    size INTEGER,
+    signature TEXT,
+    chunks BLOB
+    )
+    """
+
+    def __init__(self, direction=DEFAULT_DIRECTION):
+        os.makedirs(os.path.dirname(direction) or ".", exist_ok=True)
+        self.direction = direction
+        self.conn = database.connect(direction)
+        self.cursor = self.conn.cursor()
+        # Only takes effect while the store is empty. Space of deleted chunks is given back by prune().
+        self.cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.cursor.execute(SnapshotStore.__chunk_table)
+        self.cursor.execute(SnapshotStore.__snapshot_table)
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS snapshotProviderIndex ON snapshot(providerId, created)")
+        self.conn.commit()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self.conn:
+            database.close_connection(self.conn)
+            self.conn = None
+
+    def snapshots(self, provider_id):
+        """(id, created, size) of the snapshots of a provider, newest first"""
+        self.cursor.execute("SELECT id, created, size FROM snapshot WHERE providerId = ? ORDER BY created DESC", (provider_id,))
+        return self.cursor.fetchall()
+
+    def snapshot_at(self, provider_id, moment):
+        """Id of the last snapshot of a provider taken at or before the timestamp moment, None if there is none"""
+        self.cursor.execute("SELECT id FROM snapshot WHERE providerId = ? AND created <= ? ORDER BY created DESC LIMIT 1", (provider_id, moment))
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
+    def due(self, provider_id, interval_hours, now=None):
+        """Whether the last snapshot of a provider is older than interval_hours"""
+        snapshots = self.snapshots(provider_id)
+        return not snapshots or (now or time.time()) - snapshots[0][1] >= interval_hours * 3600
+
+    def take(self, provider_id, direction, force=False, progress=None):
+        """Snapshot of the database file of a provider, returns its id
+
+        Returns None without a new snapshot if the database did not change since the last one; unless
+        forced, this is decided by file_signature without reading the file. progress(value, text) gets
+        a percentage; an exception raised by it stops the snapshot.
+        """
+        report = progress or (lambda value, text: None)
+        signature = file_signature(direction)
+        self.cursor.execute("SELECT id, signature, chunks FROM snapshot WHERE providerId = ? ORDER BY created DESC LIMIT 1", (provider_id,))
+        last = self.cursor.fetchone()
+        if last and not force and last[1] == signature:
+            return None
+
+        temporary = os.path.join(os.path.dirname(self.direction) or ".", f"snapshot{provider_id}.rmdb")
+        source = database.connect(direction)
+        try:
+            database.backup(source, temporary, lambda copied, total: report(50 * copied / total, "Kopiere Datenbank"))
+        finally:
+            source.close()
+        try:
+            size = os.path.getsize(temporary)
+            chunk_ids = array.array("q")
+            with open(temporary, "rb") as file:
+                while chunk := file.read(CHUNK_SIZE):
+                    digest = chunk_hash(chunk)
+                    self.cursor.execute("SELECT id FROM chunk WHERE hash = ?", (digest,))
+                    row = self.cursor.fetchone()
+                    if row:
+                        chunk_ids.append(row[0])
+                    else:
+                        self.cursor.execute("INSERT INTO chunk(hash, data) VALUES (?,?)", (digest, zlib.compress(chunk)))
+                        chunk_ids.append(self.cursor.lastrowid)
+                    if len(chunk_ids) % 256 == 0:
+                        report(50 + 50 * len(chunk_ids) * CHUNK_SIZE / size, "Speichere geänderte Seiten")
+            chunks = zlib.compress(chunk_ids.tobytes())
+            if last and last[2] == chunks:
+                # Same content, e.g. after a checkpoint
+                self.cursor.execute("UPDATE snapshot SET signature = ? WHERE id = ?", (signature, last[0]))
+                snapshot_id = None
+            else:
+                self.cursor.execute("INSERT INTO snapshot(providerId, created, size, signature, chunks) VALUES (?,?,?,?,?)",
+                                    (provider_id, time.time(), size, signature, chunks))
+                snapshot_id = self.cursor.lastrowid
+            self.conn.commit()
+            return snapshot_id
+        except BaseException:
+            self.conn.rollback()
+            raise
+        finally:
+            os.remove(temporary)
+
+    def restore(self, snapshot_id, target, progress=None):
+        """Writes the database of a snapshot to the file target, which only appears once it is complete
+
+        Every chunk is checked against its hash, a damaged store raises sqlite3.DatabaseError.
+        """
+        report = progress or (lambda value, text: None)
+        self.cursor.execute("SELECT chunks FROM snapshot WHERE id = ?", (snapshot_id,))
+        chunk_ids = array.array("q")
+        chunk_ids.frombytes(zlib.decompress(self.cursor.fetchone()[0]))
+        temporary = target + ".tmp"
+        try:
+            with open(temporary, "wb") as file:
+                for number, chunk_id in enumerate(chunk_ids, 1):
+                    self.cursor.execute("SELECT hash, data FROM chunk WHERE id = ?", (chunk_id,))
+                    digest, data = self.cursor.fetchone()
+                    chunk = zlib.decompress(data)
+                    if chunk_hash(chunk) != digest:
+                        raise sql.DatabaseError(f"Chunk {chunk_id} of snapshot {snapshot_id} is damaged")
+                    file.write(chunk)
+                    if number % 256 == 0:
+                        report(100 * number / len(chunk_ids), "Stelle Datenbank wieder her")
+            os.replace(temporary, target)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+    def prune(self, provider_id, keep_last, keep_days, now=None):
+        """Deletes the snapshots of a provider beyond its retention, see retained(), and the chunks no
+        snapshot uses any more. Returns the number of deleted snapshots."""
+        snapshots = self.snapshots(provider_id)
+        keep = retained(snapshots, keep_last, keep_days, now or time.time())
+        deleted = [(snapshot[0],) for snapshot in snapshots if snapshot[0] not in keep]
+        if deleted:
+            self.cursor.executemany("DELETE FROM snapshot WHERE id = ?", deleted)
+            self.collect_garbage()
+        return len(deleted)
+
+    def collect_garbage(self):
+        """Deletes the chunks no snapshot refers to and gives their space back"""
+        self.cursor.execute("CREATE TEMP TABLE IF NOT EXISTS usedChunk (id INTEGER PRIMARY KEY)")
+        self.cursor.execute("DELETE FROM usedChunk")
+        self.cursor.execute("SELECT chunks FROM snapshot")
+        for (chunks,) in self.cursor.fetchall():
+            chunk_ids = array.array("q")
+            chunk_ids.frombytes(zlib.decompress(chunks))
+            self.cursor.executemany("INSERT OR IGNORE INTO usedChunk VALUES (?)", ((chunk_id,) for chunk_id in chunk_ids))
+        self.cursor.execute("DELETE FROM chunk WHERE id NOT IN (SELECT id FROM usedChunk)")
+        self.cursor.execute("DELETE FROM usedChunk")
+        self.conn.commit()
+        self.cursor.execute("PRAGMA incremental_vacuum")
+        self.cursor.fetchall()
+
+    def take_due(self, provider_id, direction, settings, progress=None):
+        """Takes a snapshot if the last one is older than the interval of settings and applies the retention
+
+        settings are Setup.snapshot_settings of the provider. Returns the id of the new snapshot or None.
+        """
+        interval_hours, keep_last, keep_days = settings
+        if not self.due(provider_id, interval_hours):
+            return None
+        snapshot_id = self.take(provider_id, direction, progress=progress)
+        self.prune(provider_id, keep_last, keep_days)
+        return snapshot_id
+
+    def stats(self):
+        self.cursor.execute("SELECT COUNT(*), TOTAL(LENGTH(data)) FROM chunk")
+        chunks, stored = self.cursor.fetchone()
+        self.cursor.execute("SELECT COUNT(*), TOTAL(size) FROM snapshot")
+        snapshots, size = self.cursor.fetchone()
+        return {"snapshots": snapshots, "chunks": chunks, "stored_bytes": int(stored), "snapshot_bytes": int(size)}
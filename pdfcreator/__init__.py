@@ -1,80 +1,158 @@
+import functools
+
 from reportlab.pdfgen import canvas
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.graphics.barcode import code128, qr
 
+from pdfcreator.layout import Cell, Frame
+
+# Raise whenever the look of the PDFs changes, so pdfcreator.cache stops serving PDFs of the former look
+TEMPLATE_VERSION = 1
+
+# Baseline of the first row on every page after the first
+PAGE_TOP = 700
+# Rows stay above the footer
+FOOTER_TOP = 100
+# Width of text running across the page from the left margin
+TEXT_WIDTH = 495
+
+# Font name -> TrueType file. Each font is read from disk once per process, when a PDF first needs it.
+FONTS = {
+    "Arial": "Arial.ttf",
+    "ArialBd": "ArialBd.ttf",
+    "Vera": "Calibri.ttf",
+}
+_registered_fonts = set()
+
+
+def configure_fonts(paths):
+    """Takes font files from configuration, e.g. {"Arial": "C:/Windows/Fonts/arial.ttf"}"""
+    for name, path in paths.items():
+        FONTS[name] = path
+        _registered_fonts.discard(name)
+
+
+@functools.lru_cache(maxsize=16)
+def qr_code(website):
+    """QR code of a website, computed once per value"""
+    qrcode = qr.QrCode(website)
+    qrcode.height = 60
+    qrcode.width = 60
+    return qrcode
+
+
+def draw_footer(pdf_canvas, provider):
+    """Stamps the provider footer (bank details, contact and website) onto the current page
+
+    The footer is drawn into a form once per document and provider, every page only references it.
+    """
+    name = f"footer{provider[0]}"
+    if not pdf_canvas.hasForm(name):
+        pdf_canvas.beginForm(name)
+        pdf_canvas.line(50, 80, 545.27, 80)
+        pdf_canvas.setFont("ArialBd", 12)
+        pdf_canvas.drawString(60, 60, "Bankverbindung")
+        pdf_canvas.drawString(270, 60, "Kontakt")
+        pdf_canvas.setFont("Arial", 8)
+        pdf_canvas.drawString(60, 45, "IBAN: " + provider[11])
+        pdf_canvas.drawString(60, 35, "BIC: " + provider[12])
+        pdf_canvas.drawString(60, 25, "St-IdNr: " + provider[1])
+
+        pdf_canvas.drawString(270, 45, "Tel.: " + provider[9])
+        pdf_canvas.drawString(270, 35, "Mail : " + provider[10])
+
+        if provider[13]:
+            pdf_canvas.drawString(270, 25, "Web: " + provider[13])
+            qr_code(provider[13]).drawOn(pdf_canvas, 475.27, 20)
+        pdf_canvas.endForm()
+    pdf_canvas.doForm(name)
+
+
+def register_fonts(*names):
+    """Registers the given fonts with reportlab unless this process already did"""
+    for name in names:
+        if name not in _registered_fonts:
+            pdfmetrics.registerFont(TTFont(name, FONTS[name]))
+            _registered_fonts.add(name)
+
 
 class Bill:
     """Bill PDF Creator Class"""
     def __init__(self, bill_id, bill_year, database, direction):
-        self.provider = database.bill_provider_info(bill_id, bill_year)
-        self.bill = database.bill_info(bill_id, bill_year)
-        self.customer = database.bill_customer_info(bill_id, bill_year)
-        self.services = database.bill_services_info(bill_id, bill_year)
+        self._open(
+            database.bill_provider_info(bill_id, bill_year),
+            database.bill_info(bill_id, bill_year),
+            database.bill_customer_info(bill_id, bill_year),
+            database.bill_services_info(bill_id, bill_year),
+            direction
+        )
+
+    @classmethod
+    def from_data(cls, provider, bill, customer, services, direction):
+        """Bill from rows fetched beforehand, e.g. by Db.bills_render_data. Needs no database connection."""
+        pdf = cls.__new__(cls)
+        pdf._open(provider, bill, customer, services, direction)
+        return pdf
+
+    def _open(self, provider, bill, customer, services, direction):
+        self.provider = provider
+        self.bill = bill
+        self.customer = customer
+        self.services = services
 
         self.canvas = canvas.Canvas(direction)
 
-        pdfmetrics.registerFont(TTFont("Arial", "Arial.ttf"))
-        pdfmetrics.registerFont(TTFont('ArialBd', 'ArialBd.ttf'))
-        pdfmetrics.registerFont(TTFont('Vera', 'Calibri.ttf'))
+        register_fonts("Arial", "ArialBd", "Vera")
 
-    def save(self):
-        """Saves PDF file. Has to be called separately after initialising the instance."""
-        # Barcode encoding the bill id
-        bar_code = code128.Code128("-".join([str(self.bill[5]), f"{self.bill[0]:03d}"]), barWidth=1.3, barHeight=15)
-        bar_code.drawOn(self.canvas, 35, 790)
-
-        y = 750 # cursor for further body elements
-
-        # Provider address
-        self.canvas.setFont("Arial", 8)
-        self.canvas.drawString(50, y, " \u00b7 ".join([" ".join(self.provider[2:4]), " ".join(self.provider[5:7]), " ".join(self.provider[7:9])]))
-        y -= 20
-
-        # Customer info according to which information is given
-        self.canvas.setFont("Arial", 12)
+    def address_lines(self):
+        """Address of the customer according to which information is given"""
+        lines = []
         if self.customer[1] is None:
             if self.customer[2] is None:
-                if self.customer[4] is None:
-                    pass
-                else:
-                    self.canvas.drawString(50, y, self.customer[4])
-                    y -= 20
+                if self.customer[4] is not None:
+                    lines.append(self.customer[4])
             else:
                 if self.customer[4]:
-                    self.canvas.drawString(50, y, self.customer[4])
-                    y -= 20
+                    lines.append(self.customer[4])
                 if self.customer[3] == 0:
-                    salutation = "Frau"
+                    salutation = "Frau "
                 elif self.customer[3] == 1:
-                    salutation = "Herr"
+                    salutation = "Herr "
                 else:
                     salutation = ""
-                self.canvas.drawString(50, y, salutation + self.customer[1])
-                y -= 20
+                lines.append(salutation + self.customer[2])
         else:
             if self.customer[4]:
-                self.canvas.drawString(50, y, self.customer[4])
-                y -= 20
-            self.canvas.drawString(50, y, " ".join(self.customer[1:3]))
-            y -= 20
-        self.canvas.drawString(50, y, " ".join(self.customer[5:7]))
-        y -= 20
-        self.canvas.drawString(50, y, " ".join(self.customer[7:9]))
-        y -= 80
+                lines.append(self.customer[4])
+            lines.append(" ".join(self.customer[1:3]))
+        lines.append(" ".join(self.customer[5:7]))
+        lines.append(" ".join(self.customer[7:9]))
+        return lines
+
+    def save(self):
+        """Saves PDF file. Has to be called separately after initialising the instance."""
+        # Barcode encoding the bill id
+        bar_code = code128.Code128("-".join([str(self.bill[5]), f"{self.bill[0]:03d}"]), barWidth=1.3, barHeight=15)
+        bar_code.drawOn(self.canvas, 35, 790)
+
+        frame = Frame(self.canvas, 750, PAGE_TOP, FOOTER_TOP, lambda: draw_footer(self.canvas, self.provider))
+
+        # Provider address
+        frame.text(50, " \u00b7 ".join([" ".join(self.provider[2:4]), " ".join(self.provider[5:7]), " ".join(self.provider[7:9])]), "Arial", 8, 20)
+
+        # Customer address
+        for line in self.address_lines():
+            frame.text(50, line, "Arial", 12, 20)
+        frame.space(60)
 
         # Bill heading (containing 'keyword')
-        self.canvas.setFont("ArialBd", 14)
-        self.canvas.drawString(50, y, self.bill[6])
-        y -= 20
+        frame.text(50, self.bill[6], "ArialBd", 14, 20, TEXT_WIDTH)
 
         # Bill id
-        self.canvas.setFont("Arial", 10)
-        self.canvas.drawString(50, y, f"Rechnungs-Nr.: {self.bill[5]}-{self.bill[0]:03d}")
-        y -= 40
+        frame.text(50, f"Rechnungs-Nr.: {self.bill[5]}-{self.bill[0]:03d}", "Arial", 10, 40)
 
         # Customer greeting (according to gender)
-        self.canvas.setFont("Arial", 12)
         greeting = "Sehr geehrte"
         if not self.customer[2]:
             greeting += " Damen und Herren"
@@ -85,90 +163,39 @@ class Bill:
         elif int(self.customer[3]) == 2:
             greeting += ":r "+" ".join(self.customer[1:3])
         greeting += ","
-        self.canvas.drawString(50, y, greeting)
-        y -= 20
-        self.canvas.drawString(50, y, "ich berechne folgende Leistungen:")
-        y -= 30
-
-        # Services
-        self.canvas.setFont("Arial", 11)
-
-        i = 0
-        while i < len(self.services):
-            if y > 250:
-                self.canvas.drawString(60, y, " ".join([self.services[i][2], ".".join(map(str, self.services[i][5:8]))]))
-                self.canvas.drawRightString(400, y, "{:.2f} €".format(self.services[i][3]).replace(".", ","))
-                y -= 18
-                if self.services[i][4]:
-                    self.canvas.drawRightString(400, y, "+ {:.2f} €".format(self.services[i][4]).replace(".", ","))
-                    y -= 18
-                i += 1
-            else:
-                y = 700
-                self.canvas.line(50, 80, 545.27, 80)
-                self.canvas.setFont("ArialBd", 12)
-                self.canvas.drawString(60, 60, "Bankverbindung")
-                self.canvas.drawString(270, 60, "Kontakt")
-                self.canvas.setFont("Arial", 8)
-                self.canvas.drawString(60, 45, "IBAN: " + self.provider[11])
-                self.canvas.drawString(60, 35, "BIC: " + self.provider[12])
-                self.canvas.drawString(60, 25, "St-IdNr: " + self.provider[1])
-
-                self.canvas.drawString(270, 45, "Tel.: " + self.provider[9])
-                self.canvas.drawString(270, 35, "Mail : " + self.provider[10])
-
-                if self.provider[13]:
-                    self.canvas.drawString(270, 25, "Web: " + self.provider[13])
-                    qrcode = qr.QrCode(self.provider[13])
-                    qrcode.height = 60
-                    qrcode.width = 60
-                    qrcode.drawOn(self.canvas, 475.27, 20)
-                self.canvas.showPage()
-            pass
-        self.canvas.setFont("ArialBd", 12)
-        self.canvas.drawString(60, y, "Summe:")
-        self.canvas.drawRightString(400, y, "{:.2f} €".format(sum([self.services[i][3] + self.services[i][4] for i in range(len(self.services))])).replace(".", ","))
-        y -= 40
-        self.canvas.setFont("Arial", 12)
-        self.canvas.drawString(50, y, self.bill[7])
-        y -= 40
-        self.canvas.setFont("Arial", 10)
+        frame.text(50, greeting, "Arial", 12, 20)
+        frame.text(50, "ich berechne folgende Leistungen:", "Arial", 12, 30)
+
+        # Services, the description wraps left of the price column
+        for service in self.services:
+            frame.row([
+                Cell(60, " ".join([service[2], ".".join(map(str, service[5:8]))]), 270),
+                Cell(400, "{:.2f} €".format(service[3]).replace(".", ","), align="right")
+            ], "Arial", 11, 18)
+            if service[4]:
+                frame.row([Cell(400, "+ {:.2f} €".format(service[4]).replace(".", ","), align="right")], "Arial", 11, 18)
+
+        frame.row([
+            Cell(60, "Summe:"),
+            Cell(400, "{:.2f} €".format(sum([service[3] + service[4] for service in self.services])).replace(".", ","), align="right")
+        ], "ArialBd", 12, 40)
+        frame.text(50, self.bill[7] or "", "Arial", 12, 40, TEXT_WIDTH)
         if self.bill[8]:
-            self.canvas.drawString(50, y, "Hinweis: Als Kleinunternehmer im Sinne von § 19 Abs. 1 UStG wird Umsatzsteuer nicht berechnet.")
-            y -= 40
+            frame.text(50, "Hinweis: Als Kleinunternehmer im Sinne von § 19 Abs. 1 UStG wird Umsatzsteuer nicht berechnet.", "Arial", 10, 40, TEXT_WIDTH)
         if not self.bill[9]:
-            self.canvas.setFont("ArialBd", 14)
-            self.canvas.drawString(50, y, "Diese Rechnung ist ungültig.")
-            y -= 20
+            frame.text(50, "Diese Rechnung ist ungültig.", "ArialBd", 14, 20)
         if self.bill[10]:
-            self.canvas.setFont("ArialBd", 14)
-            self.canvas.drawString(50, y, "Diese Rechnung ist bereits bezahlt.")
-
-        self.canvas.line(50, 80, 545.27, 80)
-        self.canvas.setFont("ArialBd", 12)
-        self.canvas.drawString(60, 60, "Bankverbindung")
-        self.canvas.drawString(270, 60, "Kontakt")
-        self.canvas.setFont("Arial", 8)
-        self.canvas.drawString(60, 45, "IBAN: "+ self.provider[11])
-        self.canvas.drawString(60, 35, "BIC: "+ self.provider[12])
-        self.canvas.drawString(60, 25, "St-IdNr: "+ self.provider[1])
-
-        self.canvas.drawString(270, 45, "Tel.: " + self.provider[9])
-        self.canvas.drawString(270, 35, "Mail : " + self.provider[10])
-
-        if self.provider[13]:
-            self.canvas.drawString(270, 25, "Web: " + self.provider[13])
-            qrcode = qr.QrCode(self.provider[13])
-            qrcode.height = 60
-            qrcode.width = 60
-            qrcode.drawOn(self.canvas, 475.27, 20)
-
-
-        self.canvas.showPage()
+            frame.text(50, "Diese Rechnung ist bereits bezahlt.", "ArialBd", 14, 20)
+
+        frame.finish()
         self.canvas.save()
 
+
 class BillOverview:
-    """Bill overview PDF Creator Class"""
+    """Bill overview PDF Creator Class
+
+    bills can be any iterable of Db.bill_overview rows, e.g. its cursor. Rows are read once, while drawing.
+    """
     def __init__(self, bills, begin_date, end_date, provider, direction):
         self.bills = bills
         self.begin_date = begin_date
@@ -177,77 +204,26 @@ class BillOverview:
 
         self.canvas = canvas.Canvas(direction)
 
-        pdfmetrics.registerFont(TTFont("Arial", "Arial.ttf"))
-        pdfmetrics.registerFont(TTFont('ArialBd', 'ArialBd.ttf'))
+        register_fonts("Arial", "ArialBd")
 
     def save(self):
         """Saves PDF file. Has to be called separately after initialising the instance."""
-
-        y = 750 # cursor for further body elements
+        frame = Frame(self.canvas, 750, PAGE_TOP, FOOTER_TOP, lambda: draw_footer(self.canvas, self.provider))
 
         # Heading
-        self.canvas.setFont("ArialBd", 14)
-        self.canvas.drawString(50, y, "Rechnungsübersicht")
-        y -= 50
-        self.canvas.setFont("Arial", 12)
-        self.canvas.drawString(50, y, "Zeitraum: "+".".join(self.begin_date)+" - "+".".join(self.end_date))
-        y -= 50
-        self.canvas.setFont("Arial", 8)
-        i = 0
-        while i < len(self.bills):
-            if y > 250:
-                self.canvas.drawString(50, y, f"R.-Nr.: {self.bills[i][7]}-{self.bills[i][3]:03d}")
-                self.canvas.drawString(120, y, self.bills[i][4])
-                self.canvas.drawString(300, y, " ".join([self.bills[i][2], self.bills[i][0], self.bills[i][1]]))
-                self.canvas.drawRightString(550, y, "{:.2f} €".format(self.bills[i][8]+self.bills[i][9]).replace(".", ","))
-                y -= 18
-                i += 1
-            else:
-                y = 700
-                self.canvas.line(50, 80, 545.27, 80)
-                self.canvas.setFont("ArialBd", 12)
-                self.canvas.drawString(60, 60, "Bankverbindung")
-                self.canvas.drawString(270, 60, "Kontakt")
-                self.canvas.setFont("Arial", 8)
-                self.canvas.drawString(60, 45, "IBAN: " + self.provider[11])
-                self.canvas.drawString(60, 35, "BIC: " + self.provider[12])
-                self.canvas.drawString(60, 25, "St-IdNr: " + self.provider[1])
-
-                self.canvas.drawString(270, 45, "Tel.: " + self.provider[9])
-                self.canvas.drawString(270, 35, "Mail : " + self.provider[10])
-
-                if self.provider[13]:
-                    self.canvas.drawString(270, 25, "Web: " + self.provider[13])
-                    qrcode = qr.QrCode(self.provider[13])
-                    qrcode.height = 60
-                    qrcode.width = 60
-                    qrcode.drawOn(self.canvas, 475.27, 20)
-                self.canvas.showPage()
-            pass
-        self.canvas.setFont("ArialBd", 12)
-        self.canvas.drawString(60, y, "Summe:")
-        self.canvas.drawRightString(550, y, "{:.2f} €".format(sum([self.bills[i][8] + self.bills[i][9] for i in range(len(self.bills))])).replace(".", ","))
-        y -= 40
-
-        self.canvas.line(50, 80, 545.27, 80)
-        self.canvas.setFont("ArialBd", 12)
-        self.canvas.drawString(60, 60, "Bankverbindung")
-        self.canvas.drawString(270, 60, "Kontakt")
-        self.canvas.setFont("Arial", 8)
-        self.canvas.drawString(60, 45, "IBAN: "+ self.provider[11])
-        self.canvas.drawString(60, 35, "BIC: "+ self.provider[12])
-        self.canvas.drawString(60, 25, "St-IdNr: "+ self.provider[1])
-
-        self.canvas.drawString(270, 45, "Tel.: " + self.provider[9])
-        self.canvas.drawString(270, 35, "Mail : " + self.provider[10])
-
-        if self.provider[13]:
-            self.canvas.drawString(270, 25, "Web: " + self.provider[13])
-            qrcode = qr.QrCode(self.provider[13])
-            qrcode.height = 60
-            qrcode.width = 60
-            qrcode.drawOn(self.canvas, 475.27, 20)
-
-
-        self.canvas.showPage()
-        self.canvas.save()
\ No newline at end of file
+        frame.text(50, "Rechnungsübersicht", "ArialBd", 14, 50)
+        frame.text(50, "Zeitraum: "+".".join(self.begin_date)+" - "+".".join(self.end_date), "Arial", 12, 50)
+
+        total = 0
+        for bill in self.bills:
+            frame.row([
+                Cell(50, f"R.-Nr.: {bill[7]}-{bill[3]:03d}"),
+                Cell(120, bill[4], 170),
+                Cell(300, " ".join([bill[2], bill[0], bill[1]]), 190),
+                Cell(550, "{:.2f} €".format(bill[8] + bill[9]).replace(".", ","), align="right")
+            ], "Arial", 8, 18)
+            total += bill[8] + bill[9]
+        frame.row([Cell(60, "Summe:"), Cell(550, "{:.2f} €".format(total).replace(".", ","), align="right")], "ArialBd", 12, 40)
+
+        frame.finish()
+        self.canvas.save()
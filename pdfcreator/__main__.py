@@ -0,0 +1,13 @@
+"""Batch rendering of bill PDFs without the UI, the same as python -m cli render
+
+python -m pdfcreator --open --out rechnungen
+python -m pdfcreator --begin 01.01.2022 --end 31.01.2022 --processes 4
+python -m pdfcreator --bill 2022-3 2022-4 --database databases/1.rmdb
+python -m pdfcreator --open --font Arial=C:/Windows/Fonts/arial.ttf --font ArialBd=C:/Windows/Fonts/arialbd.ttf
+"""
+import sys
+
+import cli
+
+if __name__ == "__main__":
+    cli.main(["render", *sys.argv[1:]])
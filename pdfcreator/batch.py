@@ -0,0 +1,51 @@
+"""Renders many bill PDFs in parallel
+
+All data is fetched from the database before rendering, the worker processes only get rows.
+"""
+import concurrent.futures
+import os
+import time
+
+import pdfcreator
+from pdfcreator import Bill
+
+
+def bill_file_name(bill_id, bill_year):
+    return f"{bill_year}{int(bill_id):03d}.pdf"
+
+
+def _render(job):
+    """Renders one bill in a worker process. Errors are returned instead of raised."""
+    key, data, direction = job
+    start = time.perf_counter()
+    try:
+        Bill.from_data(*data, direction).save()
+        return key, time.perf_counter() - start, None
+    except Exception as error:
+        return key, time.perf_counter() - start, repr(error)
+
+
+def _configure_worker(fonts):
+    pdfcreator.configure_fonts(fonts)
+
+
+def render_bills(database, keys, directory, processes=None):
+    """Renders the bills with the given (id, year) keys into directory
+
+    Yields (key, seconds, error) per bill as soon as it is done. error is None on success.
+    A failing bill does not stop the others.
+    """
+    keys = [(int(bill_id), int(bill_year)) for bill_id, bill_year in keys]
+    data = database.bills_render_data(keys)
+    os.makedirs(directory, exist_ok=True)
+    for key in keys:
+        if key not in data:
+            yield key, 0.0, "Rechnung nicht gefunden"
+    jobs = [(key, data[key], os.path.join(directory, bill_file_name(*key))) for key in keys if key in data]
+    with concurrent.futures.ProcessPoolExecutor(processes, initializer=_configure_worker, initargs=(dict(pdfcreator.FONTS),)) as pool:
+        futures = {pool.submit(_render, job): job[0] for job in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as error:
+                yield futures[future], 0.0, repr(error)
@@ -0,0 +1,74 @@
+"""Cache of rendered bill PDFs
+
+A PDF is stored under the hash of everything it is rendered from: the provider, bill, customer and
+service rows, the fonts and TEMPLATE_VERSION. Changing any of them changes the key, so stale files are
+never served; they are only evicted, least recently used first, once the cache exceeds its size.
+"""
+import hashlib
+import os
+import shutil
+
+import pdfcreator
+from pdfcreator import Bill
+
+# Default upper limit of the cache directory in bytes
+MAX_BYTES = 100 * 2 ** 20
+
+
+def bill_key(provider, bill, customer, services):
+    """Content hash of a bill PDF. The active flag of the provider does not change the PDF."""
+    content = (pdfcreator.TEMPLATE_VERSION, sorted(pdfcreator.FONTS.items()), provider[:14], bill, customer, services)
+    return hashlib.sha256(repr(content).encode()).hexdigest()
+
+
+class PdfCache:
+    """Directory of rendered bill PDFs named by their content hash
+
+    The modification time of a file is its last use, it is updated on every hit.
+    """
+    def __init__(self, directory, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".pdf")
+
+    def save_bill(self, provider, bill, customer, services, direction):
+        """Writes the bill PDF to direction, rendered only if no PDF of the same content is cached"""
+        path = self.path(bill_key(provider, bill, customer, services))
+        if os.path.exists(path):
+            self.hits += 1
+            os.utime(path)
+            shutil.copyfile(path, direction)
+            return
+        self.misses += 1
+        temporary = path + ".tmp"
+        Bill.from_data(provider, bill, customer, services, temporary).save()
+        os.replace(temporary, path)
+        shutil.copyfile(path, direction)
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used PDFs until the cache fits into max_bytes"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pdf"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum(entry[1] for entry in entries)
+        for _, file_size, path in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            os.remove(path)
+            size -= file_size
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pdf"):
+                os.remove(entry.path)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,66 @@
+"""Measured layout of PDF pages
+
+Text is measured with the metrics of its font and wrapped to the width of its column.
+A Frame draws rows from top to bottom and starts a new page as soon as the next row would reach into
+the reserved space at the bottom of the page, so pagination is computed while drawing, in one pass.
+"""
+import collections
+
+from reportlab.lib.utils import simpleSplit
+
+# x is the left edge, or the right edge for align "right". Text wider than width is wrapped, None never wraps.
+Cell = collections.namedtuple("Cell", ["x", "text", "width", "align"], defaults=[None, "left"])
+
+
+class Frame:
+    """Flows rows of text cells over as many pages as needed
+
+    end_page is called before every page break and after the last row, e.g. to draw the footer.
+    """
+    def __init__(self, pdf_canvas, y, top, bottom, end_page):
+        self.canvas = pdf_canvas
+        self.y = y
+        self.top = top
+        self.bottom = bottom
+        self.end_page = end_page
+        self.pages = 1
+
+    @staticmethod
+    def wrap(cell, font, size):
+        if cell.width is None:
+            return cell.text.split("\n")
+        return simpleSplit(cell.text, font, size, cell.width) or [""]
+
+    def row(self, cells, font, size, leading):
+        """Draws cells side by side and moves down by leading plus the lines the cells were wrapped to"""
+        wrapped = [self.wrap(cell, font, size) for cell in cells]
+        line_height = size * 1.2
+        extra_height = (max(map(len, wrapped)) - 1) * line_height
+        self.ensure(extra_height)
+        self.canvas.setFont(font, size)
+        for cell, lines in zip(cells, wrapped):
+            draw = self.canvas.drawRightString if cell.align == "right" else self.canvas.drawString
+            for i, line in enumerate(lines):
+                draw(cell.x, self.y - i * line_height, line)
+        self.y -= leading + extra_height
+
+    def text(self, x, text, font, size, leading, width=None):
+        self.row([Cell(x, text, width)], font, size, leading)
+
+    def space(self, points):
+        self.y -= points
+
+    def ensure(self, height):
+        """Starts a new page unless a row reaching height below the cursor still fits"""
+        if self.y - height <= self.bottom:
+            self.new_page()
+
+    def new_page(self):
+        self.end_page()
+        self.canvas.showPage()
+        self.y = self.top
+        self.pages += 1
+
+    def finish(self):
+        self.end_page()
+        self.canvas.showPage()
@@ -1,4 +1,3 @@
-from pdfcreator import Bill as PdfBill
 import ui
 # from database.queries import sc_table_query
 import database
@@ -8,8 +7,7 @@ setup = database.Setup()
 if not setup.active_provider():
     ui.NewProviderWindow(setup)
 
-db = setup.active_provider()[0][1]
-base = database.Db(os.getcwd() + db)
+providers = database.ProviderConnections(setup)
 
 
-app = ui.MainWindow(base, setup)
+app = ui.MainWindow(providers, setup)
@@ -0,0 +1,12 @@
+"""pytest plugin, see pytest.ini. The repository root is a package that starts the application when
+imported, so it is collected as plain directory and never imported."""
+import pathlib
+
+import pytest
+
+ROOT = pathlib.Path(__file__).parent.parent
+
+
+def pytest_collect_directory(path, parent):
+    if path == ROOT:
+        return pytest.Dir.from_parent(parent, path=path)
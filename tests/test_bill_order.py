@@ -0,0 +1,35 @@
+import pytest
+
+import database
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = database.Db(str(tmp_path / "test.rmdb"))
+    db.new_provider("12/345/67890", "Max", "Mustermann", 1, "Hauptstraße", "1", "12345", "Ort", "", "", "", "", "")
+    db.new_customer("Erika", "Musterfrau", 0, "", "Weg", "1", "12345", "Ort")
+    # Bill numbers restart every year: 2023-1, 2023-2, 2023-3, 2024-1, 2024-2
+    for number, year in enumerate((2024, 2023, 2023, 2024, 2023)):
+        sc_id = db.next_sc_id()
+        db.new_sc(1)
+        db.new_bill(sc_id, 1, 1, 1, year, f"Rechnung {number}", "", True, True, False)
+    yield db
+    db.close()
+
+
+EXPECTED = [(2023, 1), (2023, 2), (2023, 3), (2024, 1), (2024, 2)]
+
+
+def test_pages_are_in_number_order(db):
+    for table in ("bill_table", "all_bills_table"):
+        assert [tuple(row[:2]) for row in db.table_page(table, (-1, -1), 100)] == EXPECTED
+        assert [tuple(row[:2]) for row in db.table_page(table, (2023, 3), 100)] == EXPECTED[3:]
+        assert [tuple(row[:2]) for row in db.table_page(table, (2024, 1), 2, backward=True)] == EXPECTED[1:3]
+
+
+def test_queries_are_in_number_order(db):
+    expected = [(bill_id, year) for year, bill_id in EXPECTED]
+    assert [tuple(row[:2]) for row in db.all_bills_table_query()] == expected
+    assert [tuple(row[:2]) for row in db.bill_table_query()] == expected
+    assert db.bill_keys() == expected
+    assert list(db.bills_render_data(reversed(expected))) == expected
@@ -0,0 +1,42 @@
+import pytest
+
+import database
+from database import queries
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = database.Db(str(tmp_path / "test.rmdb"))
+    db.new_provider("12/345/67890", "Max", "Mustermann", 1, "Hauptstraße", "1", "12345", "Ort", "", "", "", "", "")
+    for number in range(3):
+        db.new_customer(f"Vorname{number}", f"Nachname{number}", 0, "", "Weg", "1", "12345", "Ort")
+    # Bills of the customers 3, 2, 1, 3, 2, 1 dated in 2021, 2022, 2023, 2024, 2021, 2022
+    for number in range(6):
+        sc_id = db.next_sc_id()
+        db.new_sc(3 - number % 3)
+        db.new_bill(sc_id, 1, 1, 1, 2021 + number % 4, f"Rechnung {number}", "", True, True, False)
+    yield db
+    db.close()
+
+
+def test_rows_are_grouped_by_customer_within_the_range(db):
+    rows = list(db.bill_overview("*", 1, 1, 2021, 31, 12, 2022))
+    assert [(row[1], row[7]) for row in rows] == [("Nachname0", 2022), ("Nachname1", 2022), ("Nachname1", 2021), ("Nachname2", 2021)]
+    rows = list(db.bill_overview((2,), 1, 1, 2021, 31, 12, 2023))
+    assert [(row[1], row[7]) for row in rows] == [("Nachname1", 2022), ("Nachname1", 2021)]
+
+
+def plan(db, statement, parameters):
+    return [row[3] for row in db.conn.execute("EXPLAIN QUERY PLAN " + statement, parameters)]
+
+
+def test_all_customers_search_the_date_range(db):
+    steps = plan(db, queries.ALL_CUSTOMERS_BILL_OVERVIEW, (2021, 1, 1, 2022, 12, 31))
+    assert steps[0] == "SEARCH bill USING INDEX billDateIndex ((year,month,day)>(?,?,?) AND (year,month,day)<(?,?,?))"
+    assert not [step for step in steps if step.startswith("SCAN")]
+
+
+def test_one_customer_reads_only_its_bills(db):
+    steps = plan(db, queries.CUSTOMER_BILL_OVERVIEW, (2021, 1, 1, 2022, 12, 31, 2))
+    assert steps[0] == "SEARCH customer USING INTEGER PRIMARY KEY (rowid=?)"
+    assert not [step for step in steps if step.startswith("SCAN") or "TEMP B-TREE" in step]
@@ -0,0 +1,20 @@
+import pytest
+
+import database
+from database import export
+
+
+def test_empty_numbers_become_nulls(tmp_path):
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+    db = database.Db(str(tmp_path / "test.rmdb"))
+    db.new_customer("Erika", "Musterfrau", "", "", "Weg", "1", "12345", "Ort")
+    db.new_sc(1)
+    db.new_service(1, "Leistung", "", 5.5, 1, 1, 2024)
+    counts = export.export_tables(db, str(tmp_path / "export"), "parquet", ("customer", "service"))
+    db.close()
+    assert counts == {"customer": 1, "service": 1}
+    assert pyarrow.parquet.read_table(tmp_path / "export" / "customer.parquet")["gender"].to_pylist() == [None]
+    service = pyarrow.parquet.read_table(tmp_path / "export" / "service.parquet")
+    assert service["price"].to_pylist() == [None]
+    assert service["additionalPrice"].to_pylist() == [5.5]
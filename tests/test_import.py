@@ -0,0 +1,63 @@
+import os
+import shutil
+
+import pytest
+
+import database
+
+
+def test_inspection_leaves_no_files_behind(tmp_path):
+    direction = str(tmp_path / "import.rmdb")
+    db = database.Db(direction)
+    db.new_customer("Erika", "Musterfrau", 0, "", "Weg", "1", "12345", "Ort")
+    db.close()
+    assert os.listdir(tmp_path) == ["import.rmdb"]
+
+    result = database.inspect_file(direction)
+    assert result["problems"] == [] and result["missing"] == [] and result["schema_matches"]
+    conn = database.connect_read_only(direction)
+    assert conn.execute("SELECT COUNT(*) FROM customer").fetchone()[0] == 1
+    conn.close()
+    assert os.listdir(tmp_path) == ["import.rmdb"]
+
+
+def test_imported_provider_is_registered_with_the_complete_copy(tmp_path, monkeypatch):
+    work = tmp_path / "work"
+    (work / "setup").mkdir(parents=True)
+    monkeypatch.chdir(work)
+    setup = database.Setup()
+    setup.new_provider("Vorhanden")
+    copy = os.getcwd() + database.IMPORT_DIRECTION
+    db = database.Db(copy)
+    db.close()
+    digest = database.file_hash(copy)
+
+    provider_id = setup.add_imported_provider("Importiert", copy, digest)
+    assert setup.active_provider_id() == provider_id
+    assert not os.path.exists(copy)
+    assert database.file_hash(os.getcwd() + setup.provider_direction(provider_id)) == digest
+    assert setup.identical_provider(os.path.getsize(os.getcwd() + setup.provider_direction(provider_id)), digest) == provider_id
+
+    # A failed move leaves the previous provider active
+    with pytest.raises(OSError):
+        setup.add_imported_provider("Fehlt", copy, digest)
+    assert setup.active_provider_id() == provider_id
+    assert len(setup.all_providers()) == 2
+    setup.close()
+
+
+def test_commits_in_a_copied_wal_are_read(tmp_path):
+    direction = str(tmp_path / "running.rmdb")
+    db = database.Db(direction)
+    db.conn.execute("PRAGMA wal_autocheckpoint = 0")
+    db.new_customer("Erika", "Musterfrau", 0, "", "Weg", "1", "12345", "Ort")
+    db.new_customer("Erik", "Mustermann", 1, "", "Weg", "2", "12345", "Ort")
+    (tmp_path / "copy").mkdir()
+    copy = str(tmp_path / "copy" / "import.rmdb")
+    shutil.copy(direction, copy)
+    shutil.copy(direction + "-wal", copy + "-wal")
+    db.close()
+
+    conn = database.connect_read_only(copy)
+    assert conn.execute("SELECT COUNT(*) FROM customer").fetchone()[0] == 2
+    conn.close()
@@ -0,0 +1,35 @@
+import types
+
+import pytest
+
+import database
+
+
+@pytest.fixture
+def providers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "setup").mkdir()
+    setup = database.Setup()
+    for number in range(6):
+        setup.new_provider(f"Dienstleister {number}")
+    providers = database.ProviderConnections(setup, max_open=2)
+    yield providers
+    providers.close()
+    setup.close()
+
+
+def test_windows_keep_working_after_eviction(providers):
+    ui = pytest.importorskip("ui")
+
+    class Window(ui.ProviderWindow):
+        pass
+
+    window = Window()
+    window.use_provider_of(types.SimpleNamespace(providers=providers, provider_id=1))
+    first = window.database
+    assert window.database.next_sc_id() == 1
+    for provider_id in range(2, 7):
+        providers.get(provider_id)
+    assert first.conn is None
+    assert window.database is not first
+    assert window.database.next_sc_id() == 1
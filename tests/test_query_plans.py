@@ -0,0 +1,81 @@
+"""Query plan regression check of the public queries of Db"""
+import re
+
+import pytest
+
+import database
+from benchmark import populate
+
+# Public queries of Db with sample arguments and the tables they may scan completely.
+# Every other table has to be searched through an index.
+PLAN_CHECKS = (
+    ("sc_table_query", (), {"serviceComplex"}),
+    ("next_sc_id", (), set()),
+    ("customer_short", (), {"customer"}),
+    ("n_of_sc", (), {"serviceComplex"}),
+    ("customers_long", (), {"customer"}),
+    ("services_of_sc", (3,), set()),
+    ("service_info", (3,), set()),
+    ("bill_table_query", (), set()),
+    ("table_page", ("sc_table", (10,), 100), set()),
+    ("table_page", ("sc_table", (10,), 100, True), set()),
+    ("table_page", ("bill_table", (2018, 10), 100), set()),
+    ("table_page", ("all_bills_table", (2018, 10), 100), set()),
+    ("table_page", ("all_bills_table", (2018, 10), 100, True), set()),
+    ("all_bills_table_query", (), {"bill"}),
+    ("bill_keys", (), {"bill"}),
+    ("bill_keys", (False, (2016, 1, 1), (2018, 12, 31)), set()),
+    ("bills_render_data", ([(3, 2018), (11, 2018)],), {"renderKey"}),
+    ("provider_info", (), {"provider"}),
+    ("create_bill_data", (3,), {"provider"}),
+    ("bill_data", (3, 2018), set()),
+    ("bill_provider_info", (3, 2018), set()),
+    ("bill_info", (3, 2018), set()),
+    ("bill_customer_info", (3, 2018), set()),
+    ("bill_services_info", (3, 2018), set()),
+    ("provider_for_setup_info", (), {"provider"}),
+    ("customers_with_bills", (), {"bill"}),
+    ("search_customers", ("Nachname1",), {"customerSearch", "hits"}),
+    ("search_bills", ("Rechnung 1",), {"billSearch", "hits"}),
+    ("search_services", ("Leistung 1",), {"serviceSearch", "hits"}),
+    ("search", ("Rechnung 1",), {"customerSearch", "billSearch", "serviceSearch", "hits"}),
+    ("revenue", ("month",), set()),
+    ("revenue", ("customer",), set()),
+    ("revenue", ("paid", (2016, 1, 1), (2018, 12, 31)), set()),
+    ("bill_overview", ("*", 1, 1, 2016, 31, 12, 2018), set()),
+    ("bill_overview", ((3, "Vorname3", "Nachname3", "Institution3"), 1, 1, 2016, 31, 12, 2018), set()),
+)
+
+
+@pytest.fixture(scope="module")
+def db(tmp_path_factory):
+    db = database.Db(str(tmp_path_factory.mktemp("plans") / "plans.rmdb"))
+    populate(db, 10_000)
+    yield db
+    db.close()
+
+
+@pytest.mark.parametrize("name, arguments, allowed_scans", PLAN_CHECKS, ids=[check[0] for check in PLAN_CHECKS])
+def test_no_unexpected_table_scans(db, name, arguments, allowed_scans):
+    # Cached reads would run no statement
+    db.read_model.clear()
+    statements = []
+    db.conn.set_trace_callback(statements.append)
+    try:
+        result = getattr(db, name)(*arguments)
+        # bill_overview returns a cursor, its rows are read while streaming
+        if hasattr(result, "fetchall"):
+            result.fetchall()
+    finally:
+        db.conn.set_trace_callback(None)
+    assert statements
+    scans = []
+    # Statements run inside virtual tables are traced as "-- <sql>"
+    for statement in statements:
+        if statement.startswith("--"):
+            continue
+        for detail in db.query_plan(statement):
+            match = re.match(r"SCAN (\w+)", detail)
+            if match and match.group(1) not in allowed_scans:
+                scans.append(f"{statement}: {detail}")
+    assert not scans
@@ -0,0 +1,35 @@
+import pytest
+
+import database
+
+
+class Rollback(Exception):
+    pass
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = database.Db(str(tmp_path / "test.rmdb"))
+    db.new_customer("Erika", "Musterfrau", 0, "", "Weg", "1", "12345", "Ort")
+    yield db
+    db.close()
+
+
+def test_rollback_drops_reads_of_the_block(db):
+    with pytest.raises(Rollback):
+        with db.transaction():
+            db.new_customer("Erik", "Mustermann", 1, "", "Weg", "2", "12345", "Ort")
+            assert len(db.customers_long()) == 2
+            raise Rollback()
+    db.cursor.execute("SELECT COUNT(*) FROM customer")
+    assert db.cursor.fetchall()[0][0] == 1
+    assert len(db.customers_long()) == 1
+    assert len(db.customer_short()) == 1
+
+
+def test_writes_of_other_connections_invalidate(db):
+    assert len(db.customers_long()) == 1
+    other = database.Db(db.direction, bootstrap=False)
+    other.new_customer("Erik", "Mustermann", 1, "", "Weg", "2", "12345", "Ort")
+    other.close()
+    assert len(db.customers_long()) == 2
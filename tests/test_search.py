@@ -0,0 +1,28 @@
+import pytest
+
+import database
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = database.Db(str(tmp_path / "test.rmdb"))
+    db.new_provider("12/345/67890", "Max", "Mustermann", 1, "Hauptstraße", "1", "12345", "Ort", "", "", "", "", "")
+    db.new_customer("Erika", "Garten", 0, "", "Weg", "1", "12345", "Ort")
+    for number in range(30):
+        sc_id = db.next_sc_id()
+        db.new_sc(1)
+        db.new_service(sc_id, f"Garten Pflege {number}", 10.0, 0.0, 1, 1, 2024)
+        db.new_bill(sc_id, 1, 1, 1, 2024, f"Garten {number}", "", True, True, False)
+    yield db
+    db.close()
+
+
+def test_every_kind_keeps_its_matches(db):
+    results = dict(db.search("Garten", limit=10))
+    assert list(results) == ["customer", "bill", "service"]
+    assert len(results["customer"]) == 1
+    assert len(results["bill"]) == 10
+    assert len(results["service"]) == 10
+    for rows in results.values():
+        ranks = [row[-1] for row in rows]
+        assert ranks == sorted(ranks)
@@ -1,88 +1,205 @@
 import datetime
 import os
-import shutil
-import filecmp
+import functools
 import sqlite3
 import tkinter
 from tkinter import ttk
 from tkinter import filedialog
 from tkinter.messagebox import askyesno, showinfo, showwarning, showerror
 
-from tkcalendar import DateEntry
-
 import database
-from pdfcreator import Bill as PdfBill, BillOverview as PdfBillOverview
 from database import Db
+from ui.table import VirtualTable
+from ui.worker import Cancelled, Worker
 from version import _VERSION
 
+# How often the main window checks whether a snapshot of the active provider database is due
+SNAPSHOT_CHECK_MS = 60 * 60 * 1000
+# Names of the groups of search results by kind, see Db.search
+SEARCH_GROUPS = {"customer": "Auftraggeber", "bill": "Rechnungen", "service": "Leistungen"}
+
+
+def date_entry(master):
+    """German date entry. tkcalendar (and babel) are only loaded once the first date entry is shown."""
+    from tkcalendar import DateEntry
+    return DateEntry(master, locale='de_DE', date_pattern='dd.mm.yyyy')
+
+
+def price_text(price):
+    if price is None:
+        return "0,00 €"
+    return "{:.2f} €".format(float(price)).replace(".", ",")
+
+
+def sc_table_values(row):
+    """Values of a service complex table row: id, customer, number of services, price"""
+    return [row[0], row[2] or row[1], row[3], price_text(row[4])]
+
+
+def bill_table_values(row):
+    """Values of a bill table row: year-id, customer, keyword, price"""
+    return [str(row[0]) + "-" + str(row[1]), row[3] or row[2], row[4], price_text(row[5])]
+
+
+def backup_progress(job):
+    """Progress callback of database.backup reporting to a worker job, a cancelled job stops the backup"""
+    def progress(copied, total):
+        job.check()
+        job.report(100 * copied / total, f"{copied} von {total} Seiten kopiert")
+    return progress
+
+
+def snapshot_job(provider_id, direction, settings, force=False):
+    """Worker job taking a snapshot of a provider database, by default only once it is due"""
+    def run(db, job):
+        from database.snapshots import SnapshotStore
+
+        def progress(value, text):
+            job.check()
+            job.report(value, text)
+        store = SnapshotStore()
+        try:
+            if not force:
+                return store.take_due(provider_id, direction, settings, progress)
+            snapshot_id = store.take(provider_id, direction, True, progress)
+            store.prune(provider_id, *settings[1:])
+            return snapshot_id
+        finally:
+            store.close()
+    return run
+
+
+class ProviderWindow:
+    """Base of the windows working on the database of the provider that was active when they opened
+
+    The Db is looked up through ProviderConnections on every use. The registry closes the least recently
+    used connections, so a Db kept by a window could be closed while the window is still open.
+    """
+    @property
+    def database(self):
+        return self.providers.get(self.provider_id)
+
+    def use_provider_of(self, master):
+        self.providers = master.providers
+        self.provider_id = master.provider_id
+
+
+class ProgressWindow:
+    """Shows the progress of a worker job and lets the user cancel it"""
+    def __init__(self, master, title, text):
+        self.root = tkinter.Toplevel(master.root)
+        self.root.title(title)
+        self.progress_label = tkinter.Label(self.root, text=text)
+        self.progress_label.pack(padx=10, pady=5)
+        self.progress_bar = ttk.Progressbar(self.root, length=200, orient="horizontal", mode="indeterminate")
+        self.progress_bar.pack(padx=10)
+        self.progress_bar.start(10)
+        tkinter.Button(self.root, text="Abbrechen", command=self.cancel).pack(pady=5)
+        self.root.protocol("WM_DELETE_WINDOW", self.cancel)
+        self.job = None
+        self.on_failed = None
+
+    def run(self, worker, direction, function, done=None, failed=None):
+        """Runs function(db, job) on the worker and calls done(result) once it finished, failed(error) once it failed"""
+        self.on_failed = failed
+        self.job = worker.submit(direction, function, lambda result: self.finish(done, result), self.failed, self.progress)
+
+    def progress(self, value, text):
+        if value is not None:
+            self.progress_bar.stop()
+            self.progress_bar["mode"] = "determinate"
+            self.progress_bar["value"] = value
+        if text is not None:
+            self.progress_label["text"] = text
+
+    def finish(self, done, result):
+        self.root.destroy()
+        if done:
+            done(result)
+
+    def failed(self, error):
+        self.root.destroy()
+        if not isinstance(error, Cancelled):
+            showerror("Fehler", str(error))
+        if self.on_failed:
+            self.on_failed(error)
+
+    def cancel(self):
+        if self.job:
+            self.job.cancel()
+        self.progress_label["text"] = "Wird abgebrochen..."
+
 
 class ValidateDbWindow:
-    def __init__(self, master, db):
+    """Checks a database file before it is imported
+
+    The file is only opened read-only. The checks run on the worker. Once they passed,
+    imported(setup_info, file_hash) is called.
+    """
+    def __init__(self, master, db, imported):
         self.master = master
-        self.db = db
         self.direction = db
-        self.is_valid_var = True
+        self.imported = imported
         self.root = tkinter.Toplevel(self.master.root)
         self.progress_label = tkinter.Label(self.root)
         self.progress_bar = ttk.Progressbar(self.root, length=200, orient="horizontal", mode="determinate")
         self.progress_label.pack()
         self.progress_bar.pack()
+        tkinter.Button(self.root, text="Abbrechen", command=self.cancel).pack()
+        self.root.protocol("WM_DELETE_WINDOW", self.cancel)
         self.progress_label["text"] = "Überprüfe sqlite-Kompatibilität"
-        if self.check_sqlite_compatibility():
-            self.progress_bar["value"] += 10
-        self.progress_label["text"] = "Überprüfe Tabellen"
-        if self.check_tables():
-            self.progress_bar["value"] += 40
-        self.progress_label["text"] = "Überprüfe Version"
-        if self.check_version():
-            self.progress_bar["value"] += 20
-        if self.check_for_identical_db():
-            self.progress_bar["value"] += 30
-
-
-    def check_sqlite_compatibility(self):
+        self.job = self.master.worker.submit(None, self.inspect, self.evaluate, self.failed, self.progress)
+
+    def inspect(self, db, job):
+        """Reads everything the checks need, runs on the worker"""
         try:
-            self.db = database.Db(self.db)
-            return True
-        except sqlite3.Error:
+            result = database.inspect_file(self.direction, job.report, job.cancelled.is_set)
+        except sqlite3.DatabaseError:
+            job.check()
+            return {"compatible": False}
+        result["compatible"] = True
+        if not result["missing"]:
+            # The setup connection of the main window belongs to the Tk thread
+            setup = database.Setup()
+            try:
+                result["identical"] = setup.identical_provider(result["size"], result["hash"], job.check) is not None
+            finally:
+                setup.close()
+        return result
+
+    def progress(self, value, text):
+        self.progress_bar["value"] = value
+        self.progress_label["text"] = text
+
+    def evaluate(self, result):
+        self.root.destroy()
+        if not result["compatible"]:
             showerror("Importfehler", "Bei der Datei handelt es sich nicht um eine kompatible Datenbank.")
-            self.is_valid_var = False
-
-    def check_tables(self):
-        given_tables = self.db.tables()
-        needed_tables = [('customer',), ('serviceComplex',), ('service',), ('bill',), ('provider',), ('VERSION_INFO',)]
-        if all(i in given_tables for i in needed_tables):
-            return True
-        else:
+            return
+        if result["problems"]:
+            showerror("Beschädigte Datei", "Die Datenbank ist beschädigt:\n" + "\n".join(result["problems"][:10]))
+            return
+        if result["missing"]:
             showerror("Fehlende Datensätze", "Der Datei fehlen Datensätze")
-            self.is_valid_var = False
-            return False
-
-    def check_version(self):
-        version = self.db.version()
-        if version[0] == 0:
-            if version[1] != Db._DB_VERSION[1]:
-                showwarning("Unterschiedliche Versionen", "Die Version der Datenbank entspricht nicht der Version des Programmes. Es kann zu Fehlern kommen.", parent=self.root)
-        else:
-            if version[0] != Db._DB_VERSION[0]:
-                showwarning("Unterschiedliche Versionen", "Die Version der Datenbank entspricht nicht der Version des Programmes. Es kann zu Fehlern kommen.", parent=self.root)
-        return True
-
-    def check_for_identical_db(self):
-        databases = os.listdir(os.getcwd()+"\\databases\\")
-        if not all([filecmp.cmp(self.direction, os.getcwd()+"\\databases\\"+ele) for ele in databases]):
-            return True
-        else:
+            return
+        if not result["schema_matches"] or not result["version"] or not result["setup_info"]:
+            showerror("Importfehler", "Bei der Datei handelt es sich nicht um eine kompatible Datenbank.")
+            return
+        version = result["version"]
+        if (version[0] == 0 and version[1] != Db._DB_VERSION[1]) or (version[0] != 0 and version[0] != Db._DB_VERSION[0]):
+            showwarning("Unterschiedliche Versionen", "Die Version der Datenbank entspricht nicht der Version des Programmes. Es kann zu Fehlern kommen.", parent=self.master.root)
+        if result["identical"]:
             showinfo("Datensatz vorhanden", "Dieser Datensatz ist bereits vorhanden.")
-            self.is_valid_var = False
-            return False
+            return
+        self.imported(result["setup_info"], result["hash"])
 
-    def is_valid(self):
+    def failed(self, error):
         self.root.destroy()
-        return self.is_valid
+        if not isinstance(error, Cancelled):
+            showerror("Importfehler", str(error))
 
-    def setup_info(self):
-        return " ".join(self.db.provider_for_setup_info())
+    def cancel(self):
+        self.job.cancel()
 
 
 class DeleteProviderWindow:
@@ -103,11 +220,16 @@ class DeleteProviderWindow:
             return
         proceed = askyesno("Dienstleister löschen", "Möchten Sie den Dienstleister wirklich löschen?", parent=self.root)
         if proceed:
+            direction = os.getcwd()+"\\databases\\"+str(index)+".rmdb"
+            self.master.providers.discard(index)
             self.setup.delete_provider(index)
-            os.remove(os.getcwd()+"\\databases\\"+str(index)+".rmdb")
-            self.master.refresh_provider_menu()
+            self.master.worker.discard(direction, lambda result: self.deleted(direction))
             self.root.destroy()
 
+    def deleted(self, direction):
+        os.remove(direction)
+        self.master.refresh_provider_menu()
+
 
 class NewProviderWindow:
     def __init__(self, setup, master=None):
@@ -176,9 +298,11 @@ class NewProviderWindow:
         iban = self.iban_entry.get()
         bic = self.bic_entry.get()
         website = self.website_entry.get()
-        direction = "\\databases\\" + str(self.setup.provider_next_id()) + ".rmdb"
-        self.setup.new_provider(" ".join([first_name, last_name]), direction)
-        db = Db(os.getcwd() + direction)
+        direction = self.setup.new_provider(" ".join([first_name, last_name]))
+        if self.master:
+            db = self.master.providers.active()
+        else:
+            db = Db(os.getcwd() + direction)
         db.new_provider(tax_id, first_name, last_name, gender, street, number, postalcode, place, telephone, email, iban, bic, website)
         self.root.destroy()
         if self.master:
@@ -210,11 +334,11 @@ class PrintBillOverviewWindow:
         self.customer_box.grid(row=0, column=1)
         self.customer_box.set("Alle")
         tkinter.Label(self.root, text="Datum Beginn:").grid(row=1, column=0)
-        self.begin_entry = DateEntry(self.root, locale='de_DE', date_pattern='dd.mm.yyyy')
+        self.begin_entry = date_entry(self.root)
         self.begin_entry.grid(row=1, column=1)
         self.begin_entry.set_date("01.01."+str(datetime.datetime.today().year))
         tkinter.Label(self.root, text="Datum Ende:").grid(row=2, column=0)
-        self.end_entry = DateEntry(self.root, locale='de_DE', date_pattern='dd.mm.yyyy')
+        self.end_entry = date_entry(self.root)
         self.end_entry.grid(row=2, column=1)
         tkinter.Button(self.root, text="Drucken", command=self.save).grid(row=3, column=1)
 
@@ -226,23 +350,189 @@ class PrintBillOverviewWindow:
             customer = self.customers[self.customer_short.index(customer)-1]
         begin_date = self.begin_entry.get().split(".")
         end_date = self.end_entry.get().split(".")
-        bills = self.master.database.bill_overview(customer, *begin_date, *end_date)
         name = "Rechnungsübersicht.pdf"
         direction = filedialog.asksaveasfilename(initialfile=name, filetypes=[("PDF-Datei", ".pdf")], parent=self.root)
-        overview = PdfBillOverview(bills, begin_date, end_date, self.master.database.provider_info(), direction)
-        overview.save()
+        if not direction:
+            return
+
+        def render(db, job):
+            def bills():
+                for count, bill in enumerate(db.bill_overview(customer, *begin_date, *end_date), 1):
+                    if count % 100 == 0:
+                        job.check()
+                        job.report(None, f"{count} Rechnungen")
+                    yield bill
+            from pdfcreator import BillOverview as PdfBillOverview
+            try:
+                PdfBillOverview(bills(), begin_date, end_date, db.provider_info(), direction).save()
+            except Cancelled:
+                if os.path.exists(direction):
+                    os.remove(direction)
+                raise
+
+        ProgressWindow(self.master, "Rechnungsübersicht", "Erstelle Rechnungsübersicht").run(self.master.worker, self.master.database.direction, render)
         self.root.destroy()
 
 
 
 
-class ShowBillsWindow:
+class SnapshotWindow:
+    """Snapshots of the active provider database, restoring one into a file and the retention settings"""
     def __init__(self, master):
+        from database.snapshots import SnapshotStore
+        self.master = master
+        self.provider_id = master.setup.active_provider_id()
         self.root = tkinter.Toplevel(master.root)
+        self.root.title("Sicherungen")
+
+        self.snapshot_table = ttk.Treeview(self.root)
+        self.snapshot_table["columns"] = ("Zeitpunkt", "Größe")
+        self.snapshot_table.column("#0", width=0, stretch=tkinter.NO)
+        self.snapshot_table.column("Zeitpunkt", anchor="w", width=150)
+        self.snapshot_table.column("Größe", anchor="e", width=100)
+        self.snapshot_table.heading("#0", text="", anchor="w")
+        self.snapshot_table.heading("Zeitpunkt", text="Zeitpunkt", anchor="w")
+        self.snapshot_table.heading("Größe", text="Größe", anchor="e")
+        self.snapshot_table.grid(row=0, column=0, columnspan=2, sticky=tkinter.EW, padx=10, pady=10)
+        store = SnapshotStore()
+        for i, (snapshot_id, created, size) in enumerate(store.snapshots(self.provider_id)):
+            values = [datetime.datetime.fromtimestamp(created).strftime("%d.%m.%Y %H:%M"), f"{size / 2 ** 20:.1f} MB".replace(".", ",")]
+            self.snapshot_table.insert(parent='', index=i, iid=str(snapshot_id), values=values, tags=('evenrow' if i % 2 == 0 else 'oddrow',))
+        store.close()
+        tkinter.Button(self.root, text="Wiederherstellen", command=self.restore).grid(row=1, column=0, columnspan=2)
+
+        interval_hours, keep_last, keep_days = master.setup.snapshot_settings(self.provider_id)
+        self.entries = []
+        for row, (label, value) in enumerate((("Sicherung alle (Stunden):", interval_hours), ("Letzte Sicherungen behalten:", keep_last),
+                                              ("Eine Sicherung je Tag behalten (Tage):", keep_days)), 2):
+            tkinter.Label(self.root, text=label).grid(row=row, column=0, sticky="w", padx=10)
+            entry = tkinter.Entry(self.root, width=8)
+            entry.insert(0, f"{value:g}")
+            entry.grid(row=row, column=1, padx=10)
+            self.entries.append(entry)
+        tkinter.Button(self.root, text="Einstellungen speichern", command=self.save_settings).grid(row=5, column=0, columnspan=2, pady=10)
+
+    def restore(self):
+        """Restores the selected snapshot into a file chosen by the user, e.g. to import it afterwards"""
+        if not self.snapshot_table.focus():
+            return
+        snapshot_id = int(self.snapshot_table.focus())
+        direction = filedialog.asksaveasfilename(initialfile="Sicherung.rmdb", filetypes=[("Rechnungsmanager-Datei", ".rmdb")], defaultextension=".rmdb", parent=self.root)
+        if not direction:
+            return
+
+        def restore(db, job):
+            from database.snapshots import SnapshotStore
+
+            def progress(value, text):
+                job.check()
+                job.report(value, text)
+            store = SnapshotStore()
+            try:
+                store.restore(snapshot_id, direction, progress)
+            finally:
+                store.close()
+        ProgressWindow(self.master, "Wiederherstellen", "Stelle Sicherung wieder her").run(self.master.worker, None, restore)
+
+    def save_settings(self):
+        try:
+            interval_hours = float(self.entries[0].get().replace(",", "."))
+            keep_last, keep_days = int(self.entries[1].get()), int(self.entries[2].get())
+        except ValueError:
+            showerror("Fehler", "Bitte Zahlen eingeben", parent=self.root)
+            return
+        self.master.setup.set_snapshot_settings(self.provider_id, interval_hours, keep_last, keep_days)
+        self.root.destroy()
+
+
+class SearchWindow(ProviderWindow):
+    """Full-text search over customers, bills and services. Double click opens a bill."""
+    def __init__(self, master):
         self.master = master
-        self.database = self.master.database
+        self.use_provider_of(master)
+        self.worker = master.worker
+        self.root = tkinter.Toplevel(master.root)
+        self.root.title("Suche")
+        self.job = None
+        self.pending = None
+
+        self.search_var = tkinter.StringVar()
+        self.search_var.trace_add("write", lambda *args: self.schedule_search())
+        search_entry = tkinter.Entry(self.root, textvariable=self.search_var, width=60)
+        search_entry.grid(row=0, column=0, sticky=tkinter.EW, padx=10, pady=10)
+        search_entry.focus_set()
 
         self.bill_table = ttk.Treeview(self.root)
+        self.bill_table["columns"] = ("Rechnungsnummer", "Art", "Treffer", "Auftraggeber")
+        self.bill_table.column("#0", width=0, stretch=tkinter.NO)
+        self.bill_table.column("Rechnungsnummer", anchor="w", width=100)
+        self.bill_table.column("Art", anchor="w", width=80)
+        self.bill_table.column("Treffer", anchor="w", width=250)
+        self.bill_table.column("Auftraggeber", anchor="w", width=200)
+
+        self.bill_table.heading("#0", text="", anchor="w")
+        self.bill_table.heading("Rechnungsnummer", text="Rechnungsnummer", anchor="w")
+        self.bill_table.heading("Art", text="Art", anchor="w")
+        self.bill_table.heading("Treffer", text="Treffer", anchor="w")
+        self.bill_table.heading("Auftraggeber", text="Auftraggeber / Auftrag", anchor="w")
+        self.bill_table.grid(row=1, column=0, sticky=tkinter.EW, padx=10)
+        self.bill_table.bind("<Double-1>", lambda event: self.edit_bill())
+
+    @property
+    def pdf_cache(self):
+        return self.master.pdf_cache
+
+    def schedule_search(self):
+        """Searches once typing paused for a moment, a running search is cancelled"""
+        if self.pending:
+            self.root.after_cancel(self.pending)
+        self.pending = self.root.after(150, self.search)
+
+    def search(self):
+        self.pending = None
+        if self.job:
+            self.job.cancel()
+        text = self.search_var.get()
+        self.job = self.worker.submit(self.database.direction, lambda db, job: db.search(text), self.show_results, lambda error: None)
+
+    def show_results(self, results):
+        """Shows the matches grouped by kind, each group under a row with its name and number of matches"""
+        self.bill_table.delete(*self.bill_table.get_children())
+        i = 0
+        for kind, rows in results:
+            if not rows:
+                continue
+            group = self.bill_table.insert(parent='', index="end", values=["", SEARCH_GROUPS[kind], f"{len(rows)} Treffer", ""], open=True, tags=('evenrow' if i % 2 == 0 else 'oddrow',))
+            i += 1
+            for row in rows:
+                if kind == "customer":
+                    values = ["", "Auftraggeber", " ".join(filter(None, row[1:3])), row[4]]
+                elif kind == "bill":
+                    values = [str(row[1]) + "-" + str(row[0]), "Rechnung", row[4], row[3] or row[2]]
+                else:
+                    bill_number = str(row[7]) + "-" + str(row[6]) if row[6] is not None else ""
+                    values = [bill_number, "Leistung", row[2] + " " + ".".join(map(str, row[3:6])), "Auftrag " + str(row[1])]
+                self.bill_table.insert(parent=group, index="end", values=values, tags=('evenrow' if i % 2 == 0 else 'oddrow',))
+                i += 1
+
+    def edit_bill(self):
+        values = self.bill_table.item(self.bill_table.focus())["values"]
+        if values and "-" in str(values[0]):
+            EditBillWindow(self)
+
+    def refresh_bill_table(self):
+        self.master.refresh_bill_table()
+        self.search()
+
+
+class ShowBillsWindow(ProviderWindow):
+    def __init__(self, master):
+        self.root = tkinter.Toplevel(master.root)
+        self.master = master
+        self.use_provider_of(self.master)
+        self.worker = self.master.worker
+
+        self.bill_table = VirtualTable(self.root, lambda key, limit, backward: self.database.table_page("all_bills_table", key, limit, backward), 2, (-1, -1), bill_table_values)
         self.bill_table["columns"] = ("Rechnungsnummer", "Auftraggeber", "Stichwort", "Preis")
         self.bill_table.column("#0", width=0, stretch=tkinter.NO)
         self.bill_table.column("Rechnungsnummer", anchor="w", width=100)
@@ -261,40 +551,26 @@ class ShowBillsWindow:
 
         self.bill_table_fill()
 
+    @property
+    def pdf_cache(self):
+        return self.master.pdf_cache
+
     def bill_table_fill(self):
-        bill_table_data = []
-        for ele in self.master.database.all_bills_table_query():
-            bill_table_data.append([])
-            bill_table_data[-1].append(str(ele[1]) + "-" + str(ele[0]))
-            if ele[3]:
-                bill_table_data[-1].append(ele[3])
-            else:
-                bill_table_data[-1].append(ele[2])
-            bill_table_data[-1].append(ele[4])
-            if ele[5] is None:
-                bill_table_data[-1].append("0,00 €")
-            else:
-                bill_table_data[-1].append("{:.2f} €".format(float(ele[5])).replace(".", ","))
-        for i in range(len(bill_table_data)):
-            if i % 2 == 0:
-                self.bill_table.insert(parent='', index=i, values=bill_table_data[i], tags=('evenrow',))
-            else:
-                self.bill_table.insert(parent='', index=i, values=bill_table_data[i], tags=('oddrow',))
+        self.worker.submit(self.database.direction, lambda db, job: db.table_page("all_bills_table", (-1, -1), self.bill_table.page_size), self.bill_table.show)
 
     def edit_bill(self):
         if self.bill_table.item(self.bill_table.focus())["values"]:
             EditBillWindow(self)
 
     def refresh_bill_table(self):
-        self.bill_table.delete(*self.bill_table.get_children())
-        self.bill_table_fill()
+        self.bill_table.refresh()
 
 
-class CreateBillWindow:
+class CreateBillWindow(ProviderWindow):
     def __init__(self, sc_id, master):
         self.sc_id = sc_id
         self.master = master
-        self.database = self.master.database
+        self.use_provider_of(self.master)
         self.root = tkinter.Toplevel(self.master.root)
         self.create_bill_data = list(map(list, self.database.create_bill_data(self.sc_id)))
         for i in range(3):
@@ -302,7 +578,7 @@ class CreateBillWindow:
                 self.create_bill_data[1][i] = ""
         tkinter.Label(self.root, text=self.create_bill_data[1][2]).grid(row=0, column=0, sticky=tkinter.W, padx=10)
         tkinter.Label(self.root, text=" ".join(self.create_bill_data[1][:2])).grid(row=1, column=0, sticky=tkinter.W, padx=10)
-        self.date_entry = DateEntry(self.root, locale='de_DE', date_pattern='dd.mm.yyyy')
+        self.date_entry = date_entry(self.root)
         self.date_entry.grid(row=1, column=1)
         tkinter.Label(self.root, text=" ".join(self.create_bill_data[0][2:4])).grid(row=0, column=2, sticky=tkinter.E, padx=10)
         tkinter.Label(self.root, text=" ".join(self.create_bill_data[1][3:5])).grid(row=1, column=0, sticky=tkinter.W, padx=10)
@@ -388,7 +664,7 @@ class EditBillWindow:
         tkinter.Label(self.root, text=self.bill_data[2][2]).grid(row=0, column=0, sticky=tkinter.W, padx=10)
         tkinter.Label(self.root, text=" ".join(self.bill_data[2][:2])).grid(row=1, column=0, sticky=tkinter.W,
                                                                                    padx=10)
-        self.date_entry = DateEntry(self.root, locale='de_DE', date_pattern='dd.mm.yyyy')
+        self.date_entry = date_entry(self.root)
         self.date_entry.set_date(".".join(map(str, self.bill_data[0][3:6])))
         self.date_entry["state"] = "disabled"
         self.date_entry.grid(row=1, column=1)
@@ -462,8 +738,15 @@ class EditBillWindow:
     def print(self):
         name = str(self.bill_year) + f"{int(self.bill_id):03d}" + ".pdf" # Why is ID a string?
         direction = filedialog.asksaveasfilename(initialfile=name, filetypes=[("PDF-Datei", ".pdf")], parent=self.root)
-        pdf = PdfBill(self.bill_id, self.bill_year, self.master.database, direction)
-        pdf.save()
+        if not direction:
+            return
+        key = (int(self.bill_id), int(self.bill_year))
+        master = self.master
+
+        def render(db, job):
+            master.pdf_cache.save_bill(*db.bills_render_data([key])[key], direction)
+
+        ProgressWindow(self.master, "Rechnung drucken", "Erstelle Rechnung").run(self.master.worker, self.master.database.direction, render)
         self.root.destroy()
 
     def table_fill(self):
@@ -483,10 +766,10 @@ class EditBillWindow:
 
 
 
-class EditSCWindow:
+class EditSCWindow(ProviderWindow):
     def __init__(self, master):
         self.master = master
-        self.database = master.database
+        self.use_provider_of(master)
         self.customer = master.sc_table.item(master.sc_table.focus())["values"][1]
 
         self.root = tkinter.Toplevel(master.root)
@@ -523,7 +806,7 @@ class EditSCWindow:
         CreateBillWindow(sc_id, self)
 
     def table_fill(self):
-        self.table_data = self.master.database.services_of_sc(self.master.sc_table.item(self.master.sc_table.focus())["values"][0])
+        self.table_data = self.database.services_of_sc(self.master.sc_table.item(self.master.sc_table.focus())["values"][0])
         self.table_data = list(map(list, self.table_data))
         for i in range(len(self.table_data)):
             for j in range(2, 4):
@@ -543,7 +826,7 @@ class EditSCWindow:
 
     def save(self):
         if type(self.customer) != str:
-            self.master.database.change_sc(self.master.sc_table.item(self.master.sc_table.focus())["values"][0], self.customer[0])
+            self.database.change_sc(self.master.sc_table.item(self.master.sc_table.focus())["values"][0], self.customer[0])
         self.master.refresh_sc_table()
         self.root.destroy()
 
@@ -551,12 +834,12 @@ class EditSCWindow:
         confirm = tkinter.messagebox.askyesno(title="Auftrag löschen", message="Möchten Sie den Auftrag löschen?",
                                               parent=self.root)
         if confirm:
-            self.master.database.delete_sc(self.master.sc_table.item(self.master.sc_table.focus())["values"][0])
+            self.database.delete_sc(self.master.sc_table.item(self.master.sc_table.focus())["values"][0])
             self.master.refresh_sc_table()
             self.root.destroy()
 
     def new_service(self, description, price, additional_price, day, month, year):
-        self.master.database.new_service(
+        self.database.new_service(
             self.master.sc_table.item(self.master.sc_table.focus())["values"][0],
             description,
             price,
@@ -568,7 +851,7 @@ class EditSCWindow:
         self.refresh_table()
 
     def change_service(self, s_id, description, price, additional_price, day, month, year):
-        self.master.database.change_service(
+        self.database.change_service(
             s_id,
             description,
             price,
@@ -580,7 +863,7 @@ class EditSCWindow:
         self.refresh_table()
 
     def delete_service(self, s_id):
-        self.master.database.delete_service(s_id)
+        self.database.delete_service(s_id)
         self.refresh_table()
 
     def refresh_table(self):
@@ -588,10 +871,10 @@ class EditSCWindow:
         self.table_fill()
 
 
-class NewSCWindow:
+class NewSCWindow(ProviderWindow):
     def __init__(self, master):
         self.master = master
-        self.database = master.database
+        self.use_provider_of(master)
         self.customer = None
         self.root = tkinter.Toplevel(master.root)
         tkinter.Label(self.root, text="Auftraggeber:").grid(row=0, column=0, padx=10, pady=10, sticky=tkinter.W)
@@ -612,10 +895,10 @@ class NewSCWindow:
         self.root.destroy()
 
 
-class ChooseCustomer:
+class ChooseCustomer(ProviderWindow):
     def __init__(self, master):
         self.master = master
-        self.database = master.database
+        self.use_provider_of(master)
         self.root = tkinter.Toplevel(self.master.root)
         self.table = ttk.Treeview(self.root)
         self.c_table_data = []
@@ -642,15 +925,25 @@ class ChooseCustomer:
         self.table.heading("PLZ", text="PLZ", anchor=tkinter.W)
         self.table.heading("Ort", text="Ort", anchor=tkinter.W)
 
+        self.search_var = tkinter.StringVar()
+        self.search_var.trace_add("write", lambda *args: self.refresh_table())
+        search_entry = tkinter.Entry(self.root, textvariable=self.search_var)
+        search_entry.grid(row=0, column=0, sticky=tkinter.EW)
+        search_entry.focus_set()
+
         self.c_table_fill()
 
-        self.table.grid(row=0, column=0, sticky=tkinter.EW)
+        self.table.grid(row=1, column=0, sticky=tkinter.EW)
         self.table.bind("<Double-1>", self.return_customer)
 
-        tkinter.Button(self.root, text="Neuer Auftraggeber", command=lambda: NewCustomer(self)).grid(row=1, column=0)
+        tkinter.Button(self.root, text="Neuer Auftraggeber", command=lambda: NewCustomer(self)).grid(row=2, column=0)
 
     def c_table_fill(self):
-        self.c_table_data = self.master.database.customers_long()
+        """All customers, or the best matches of the search box"""
+        if self.search_var.get().strip():
+            self.c_table_data = [row[:-1] for row in self.database.search_customers(self.search_var.get())]
+        else:
+            self.c_table_data = self.database.customers_long()
         for i in range(len(self.c_table_data)):
             if i % 2 == 0:
                 self.table.insert(parent='', index=i, values=self.c_table_data[i], tags=('evenrow',))
@@ -663,14 +956,17 @@ class ChooseCustomer:
 
     def create_customer(self, customer):
         self.database.new_customer(*customer)
+        self.refresh_table()
+
+    def refresh_table(self):
         self.table.delete(*self.table.get_children())
         self.c_table_fill()
 
 
-class NewCustomer:
+class NewCustomer(ProviderWindow):
     def __init__(self, master):
         self.master = master
-        self.database = master.database
+        self.use_provider_of(master)
         self.root = tkinter.Toplevel(master.root)
 
         tkinter.Label(self.root, text="Vorname:").grid(row=0, column=0, sticky=tkinter.W, padx=10, pady=10)
@@ -739,7 +1035,7 @@ class EditServiceWindow:
         self.additional_price_entry = tkinter.Entry(self.root)
         self.additional_price_entry.insert(0, "{:.2f}".format(self.service_info[0][2]).replace(".", ","))
         self.additional_price_entry.grid(row=2, column=1, padx=10, pady=10)
-        self.date_entry = DateEntry(self.root, locale='de_DE', date_pattern='dd.mm.yyyy')
+        self.date_entry = date_entry(self.root)
         self.date_entry.set_date(".".join([str(ele) for ele in self.service_info[0][3:6]]))
         self.date_entry.grid(row=3, column=1, padx=10, pady=10)
         tkinter.Button(self.root, text="Löschen", command=self.delete).grid(row=4, column=2, padx=10, pady=10)
@@ -777,7 +1073,7 @@ class NewServiceWindow:
         self.price_entry.grid(row=1, column=1, padx=10, pady=10)
         self.additional_price_entry = tkinter.Entry(self.root)
         self.additional_price_entry.grid(row=2, column=1, padx=10, pady=10)
-        self.date_entry = DateEntry(self.root, locale='de_DE', date_pattern='dd.mm.yyyy')
+        self.date_entry = date_entry(self.root)
         self.date_entry.grid(row=3, column=1, padx=10, pady=10)
 
         tkinter.Button(self.root, text="Speichern", command=self.save).grid(row=4, column=2, padx=10, pady=10)
@@ -794,19 +1090,23 @@ class NewServiceWindow:
 
 
 class MainWindow:
-    def __init__(self, database, setup):
-        self.database = database
+    def __init__(self, providers, setup):
+        self.providers = providers
         self.setup = setup
 
         self.root = tkinter.Tk()
         self.root.geometry("1080x1920")
         self.root.state("zoomed")
         self.root.title("Rechnungsmanager")
+        self.worker = Worker(self.root)
 
         self.menubar = tkinter.Menu(self.root)
         self.database_menu = tkinter.Menu(self.menubar, tearoff=0)
         self.database_menu.add_command(label="Importieren", command=self.import_db)
         self.database_menu.add_command(label="Exportieren", command=self.export_db)
+        self.database_menu.add_command(label="Komprimiert exportieren", command=lambda: self.export_db(compact=True))
+        self.database_menu.add_command(label="Sicherung erstellen", command=self.take_snapshot)
+        self.database_menu.add_command(label="Sicherungen", command=lambda: SnapshotWindow(self))
         self.database_menu.add_separator()
         self.database_menu.add_command(label="Neu")
         self.database_menu.add_command(label="Löschen")
@@ -817,6 +1117,9 @@ class MainWindow:
         self.refresh_provider_menu()
         self.menubar.add_cascade(label="Dienstleister", menu=self.provider_menu)
 
+        self.menubar.add_command(label="Suche", command=lambda: SearchWindow(self))
+        self.root.bind("<Control-f>", lambda event: SearchWindow(self))
+
         self.help_menu = tkinter.Menu(self.menubar, tearoff=0)
         self.help_menu.add_command(label="Anleitung online ansehen")
         self.help_menu.add_command(label="Versionsanzeige", command=self.show_version)
@@ -832,7 +1135,7 @@ class MainWindow:
         self.sc_table_label = tkinter.Label(self.root, text="Offene Aufträge:")
         self.sc_table_label.grid(row=1, column=0)
 
-        self.sc_table = ttk.Treeview(self.root)
+        self.sc_table = VirtualTable(self.root, lambda key, limit, backward: self.database.table_page("sc_table", key, limit, backward), 1, (-1,), sc_table_values)
         self.sc_table["columns"] = ("Auftrags-ID", "Auftraggeber", "Dienstleistungen", "Preis")
         self.sc_table.column("#0", width=0, stretch=tkinter.NO)
         self.sc_table.column("Auftrags-ID", anchor="w", width=100)
@@ -856,7 +1159,7 @@ class MainWindow:
         self.bill_table_label = tkinter.Label(self.root, text="Offene Rechnungen:")
         self.bill_table_label.grid(row=5, column=0)
 
-        self.bill_table = ttk.Treeview(self.root)
+        self.bill_table = VirtualTable(self.root, lambda key, limit, backward: self.database.table_page("bill_table", key, limit, backward), 2, (-1, -1), bill_table_values)
         self.bill_table["columns"] = ("Rechnungsnummer", "Auftraggeber", "Stichwort", "Preis")
         self.bill_table.column("#0", width=0, stretch=tkinter.NO)
         self.bill_table.column("Rechnungsnummer", anchor=tkinter.W, width=100)
@@ -875,55 +1178,40 @@ class MainWindow:
         self.bill_table_fill()
         tkinter.Button(self.root, text="Alle Rechnungen anzeigen", command=lambda: ShowBillsWindow(self)).grid(row=7, column=0, sticky=tkinter.EW, padx=300)
 
+        # First check a minute after the start, when the tables are loaded
+        self.root.after(60 * 1000, self.take_due_snapshot)
+
         # === Root mainloop
 
         self.root.mainloop()
+        self.worker.close()
+
+    @functools.cached_property
+    def pdf_cache(self):
+        """Loads pdfcreator and reportlab when the first bill is printed"""
+        from pdfcreator.cache import PdfCache
+        return PdfCache(os.path.join(os.getcwd(), "pdfcache"))
 
     def sc_table_fill(self):
-        sc_table_data = []
-        for ele in self.database.sc_table_query():
-            sc_table_data.append([])
-            sc_table_data[-1].append(ele[0])
-            if ele[2]:
-                sc_table_data[-1].append(ele[2])
-            else:
-                sc_table_data[-1].append(ele[1])
-            sc_table_data[-1].append(ele[3])
-            if ele[4] is None:
-                sc_table_data[-1].append("0,00 €")
-            else:
-                sc_table_data[-1].append("{:.2f} €".format(float(ele[4])).replace(".", ","))
-        for i in range(len(sc_table_data)):
-            if i % 2 == 0:
-                self.sc_table.insert(parent='', index=i, values=sc_table_data[i], tags=('evenrow',))
-            else:
-                self.sc_table.insert(parent='', index=i, values=sc_table_data[i], tags=('oddrow',))
+        self.worker.submit(self.database.direction, lambda db, job: db.table_page("sc_table", (-1,), self.sc_table.page_size), self.sc_table.show)
 
     def bill_table_fill(self):
-        bill_table_data = []
-        for ele in self.database.bill_table_query():
-            bill_table_data.append([])
-            bill_table_data[-1].append(str(ele[1]) + "-" + str(ele[0]))
-            if ele[3]:
-                bill_table_data[-1].append(ele[3])
-            else:
-                bill_table_data[-1].append(ele[2])
-            bill_table_data[-1].append(ele[4])
-            if ele[5] is None:
-                bill_table_data[-1].append("0,00 €")
-            else:
-                bill_table_data[-1].append("{:.2f} €".format(float(ele[5])).replace(".", ","))
-        for i in range(len(bill_table_data)):
-            if i % 2 == 0:
-                self.bill_table.insert(parent='', index=i, values=bill_table_data[i], tags=('evenrow',))
-            else:
-                self.bill_table.insert(parent='', index=i, values=bill_table_data[i], tags=('oddrow',))
+        self.worker.submit(self.database.direction, lambda db, job: db.table_page("bill_table", (-1, -1), self.bill_table.page_size), self.bill_table.show)
 
     def new_sc(self, customer):
         """New service complex"""
         self.database.new_sc(customer[0])
         self.refresh_sc_table()
 
+    @property
+    def provider_id(self):
+        return self.setup.active_provider_id()
+
+    @property
+    def database(self):
+        """Db of the active provider, looked up on every use, see ProviderWindow"""
+        return self.providers.active()
+
     def refresh_provider_menu(self):
         self.provider_menu.delete(0, tkinter.END)
         for ele in self.setup.all_providers():
@@ -934,9 +1222,8 @@ class MainWindow:
 
     def activate_provider(self):
         self.setup.activate_provider(self.provider_var.get())
-        self.database = Db(os.getcwd() + self.setup.active_provider()[0][1])
-        self.refresh_sc_table()
-        self.refresh_bill_table()
+        self.sc_table_fill()
+        self.bill_table_fill()
 
     def add_provider(self):
         NewProviderWindow(self.setup, self)
@@ -946,12 +1233,10 @@ class MainWindow:
 
 
     def refresh_sc_table(self):
-        self.sc_table.delete(*self.sc_table.get_children())
-        self.sc_table_fill()
+        self.sc_table.refresh()
 
     def refresh_bill_table(self):
-        self.bill_table.delete(*self.bill_table.get_children())
-        self.bill_table_fill()
+        self.bill_table.refresh()
 
     def edit_bill(self):
         if self.bill_table.item(self.bill_table.focus())["values"]:
@@ -959,17 +1244,49 @@ class MainWindow:
 
     def import_db(self):
         old_dir = filedialog.askopenfilename(parent=self.root)
-        validation = ValidateDbWindow(self, old_dir)
-        if validation.is_valid():
-            shutil.copyfile(old_dir, os.getcwd() + "\\databases\\" + str(self.setup.provider_next_id()) + ".rmdb")
-            self.setup.new_provider(validation.setup_info(), "\\databases\\" + str(self.setup.provider_next_id()) + ".rmdb")
-            self.refresh_provider_menu()
-            self.provider_var.set(self.setup.active_provider_id())
-
-    def export_db(self):
-        old_dir = os.getcwd() + self.setup.active_provider()[0][1]
+        if old_dir:
+            ValidateDbWindow(self, old_dir, lambda setup_info, file_hash: self.copy_db(old_dir, setup_info, file_hash))
+
+    def copy_db(self, old_dir, setup_info, file_hash):
+        # The provider is only registered once the copy is complete, so nothing opens its database before
+        copy_direction = os.getcwd() + database.IMPORT_DIRECTION
+
+        def copy(db, job):
+            conn = database.connect_read_only(old_dir)
+            try:
+                database.backup(conn, copy_direction, backup_progress(job))
+            finally:
+                conn.close()
+
+        ProgressWindow(self, "Importieren", "Kopiere Datenbank").run(self.worker, None, copy, lambda result: self.imported(setup_info, copy_direction, file_hash))
+
+    def imported(self, setup_info, copy_direction, file_hash):
+        # The copy has the content of the checked file, it is not hashed again
+        provider_id = self.setup.add_imported_provider(setup_info, copy_direction, file_hash)
+        self.refresh_provider_menu()
+        self.provider_var.set(provider_id)
+        self.refresh_database()
+
+    def export_db(self, compact=False):
+        """Copies the active provider database on the worker, consistent while the database is used"""
         new_dir = filedialog.asksaveasfilename(initialfile=self.setup.active_provider()[0][0].replace(" ", ""), filetypes=[("Rechnungsmanager-Datei", ".rmdb"), ("Sqlite-Datenbank", ".db")], defaultextension=[("Rechnungsmanager-Datei", ".rmdb"), ("Sqlite-Datenbank", ".db")], parent=self.root)
-        shutil.copyfile(old_dir, new_dir)
+        if not new_dir:
+            return
+        if compact:
+            ProgressWindow(self, "Exportieren", "Erstelle komprimierte Kopie").run(self.worker, self.database.direction, lambda db, job: database.compact_copy(db.conn, new_dir))
+        else:
+            ProgressWindow(self, "Exportieren", "Kopiere Datenbank").run(self.worker, self.database.direction, lambda db, job: database.backup(db.conn, new_dir, backup_progress(job)))
+
+    def take_snapshot(self):
+        provider_id = self.setup.active_provider_id()
+        job = snapshot_job(provider_id, self.database.direction, self.setup.snapshot_settings(provider_id), force=True)
+        ProgressWindow(self, "Sicherung", "Erstelle Sicherung").run(self.worker, None, job)
+
+    def take_due_snapshot(self):
+        """Takes a snapshot of the active provider database on the worker once one is due"""
+        provider_id = self.setup.active_provider_id()
+        self.worker.submit(None, snapshot_job(provider_id, self.database.direction, self.setup.snapshot_settings(provider_id)))
+        self.root.after(SNAPSHOT_CHECK_MS, self.take_due_snapshot)
 
     def show_version(self):
         showinfo("Versionsanzeige", "Version " + ".".join(map(str,_VERSION[:3])) + _VERSION[3])
@@ -980,7 +1297,5 @@ class MainWindow:
             showinfo("Lizenz", text)
 
     def refresh_database(self):
-        path = os.getcwd() + self.setup.active_provider()[0][1]
-        self.database = database.Db(path)
-        self.refresh_sc_table()
-        self.refresh_bill_table()
+        self.sc_table_fill()
+        self.bill_table_fill()
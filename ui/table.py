@@ -0,0 +1,156 @@
+"""Treeview tables that only hold the rows around the visible ones
+
+Rows are loaded page by page through keyset queries (Db.table_page) while the user scrolls, rows far
+from the view are dropped again. A refresh reloads the held rows and applies the differences instead of
+rebuilding the table.
+"""
+from tkinter import ttk
+
+
+class VirtualTable(ttk.Treeview):
+    """Treeview over a keyset paged table of the database
+
+    fetch(key, limit, backward) returns the rows after (or before) key in key order.
+    key_length is the number of leading row columns forming the key, start_key lies before every key.
+    values(row) are the values shown for a row.
+    """
+    def __init__(self, master, fetch, key_length, start_key, values, page_size=100, window=500, **kwargs):
+        super().__init__(master, **kwargs)
+        self.fetch = fetch
+        self.key_length = key_length
+        self.start_key = start_key
+        self.values = values
+        self.page_size = page_size
+        self.window = window
+
+        self.rows = {}  # iid -> values
+        self.lower = start_key  # key right before the first held row
+        self.at_end = False
+        self.loading = False
+        self["yscrollcommand"] = self.on_scroll
+
+    def key(self, row):
+        return tuple(row[:self.key_length])
+
+    @staticmethod
+    def iid(key):
+        return "-".join(map(str, key))
+
+    def fill(self):
+        """Loads the first page"""
+        self.show(self.fetch(self.start_key, self.page_size, False))
+
+    def show(self, rows):
+        """Shows rows as the first page, e.g. a page fetched by a background job"""
+        self.delete(*self.get_children())
+        self.rows.clear()
+        self.lower = self.start_key
+        self.at_end = len(rows) < self.page_size
+        for row in rows:
+            self.append_row(row, "end")
+        self.tag_rows()
+
+    def refresh(self):
+        """Reloads the held rows and only changes, inserts or deletes rows that differ"""
+        limit = max(len(self.rows), self.page_size)
+        rows = self.fetch(self.lower, limit, False)
+        self.at_end = len(rows) < limit
+        self.apply(rows)
+
+    def apply(self, rows):
+        keep = set()
+        for index, row in enumerate(rows):
+            iid = self.iid(self.key(row))
+            values = list(self.values(row))
+            keep.add(iid)
+            if iid not in self.rows:
+                self.insert(parent="", index=index, iid=iid, values=values)
+            else:
+                if self.rows[iid] != values:
+                    self.item(iid, values=values)
+                if self.index(iid) != index:
+                    self.move(iid, "", index)
+            self.rows[iid] = values
+        removed = [iid for iid in self.rows if iid not in keep]
+        if removed:
+            self.delete(*removed)
+            for iid in removed:
+                del self.rows[iid]
+        self.tag_rows()
+
+    def tag_rows(self):
+        for index, iid in enumerate(self.get_children()):
+            tag = "evenrow" if index % 2 == 0 else "oddrow"
+            if self.item(iid, "tags") != (tag,):
+                self.item(iid, tags=(tag,))
+
+    def load_forward(self):
+        children = self.get_children()
+        rows = self.fetch(self.parse_key(children[-1]) if children else self.lower, self.page_size, False)
+        self.at_end = len(rows) < self.page_size
+        for row in rows:
+            self.append_row(row, "end")
+        self.trim(top=True)
+        self.tag_rows()
+
+    def load_backward(self):
+        # One row more than shown, its key becomes the new lower bound
+        rows = self.fetch(self.parse_key(self.get_children()[0]), self.page_size + 1, True)
+        if len(rows) > self.page_size:
+            self.lower = self.key(rows[0])
+            rows = rows[1:]
+        else:
+            self.lower = self.start_key
+        top = self.yview()[0] * len(self.get_children())
+        for row in reversed(rows):
+            self.append_row(row, 0)
+        self.trim(top=False)
+        self.yview_moveto((top + len(rows)) / max(len(self.get_children()), 1))
+        self.tag_rows()
+
+    def append_row(self, row, index):
+        iid = self.iid(self.key(row))
+        values = list(self.values(row))
+        self.insert(parent="", index=index, iid=iid, values=values)
+        self.rows[iid] = values
+
+    def parse_key(self, iid):
+        return tuple(int(part) for part in iid.split("-"))
+
+    def trim(self, top):
+        """Drops the rows beyond window at the top or the bottom"""
+        children = self.get_children()
+        surplus = len(children) - self.window
+        if surplus <= 0:
+            return
+        if top:
+            position = self.yview()[0] * len(children)
+            removed = children[:surplus]
+            self.lower = self.parse_key(removed[-1])
+        else:
+            removed = children[-surplus:]
+            self.at_end = False
+        self.delete(*removed)
+        for iid in removed:
+            del self.rows[iid]
+        if top:
+            self.yview_moveto(max(position - surplus, 0) / len(self.get_children()))
+
+    def on_scroll(self, first, last):
+        """Loads the next or previous page once the view comes close to the end of the held rows"""
+        if self.loading:
+            return
+        if float(last) > 0.9 and not self.at_end:
+            self.schedule(self.load_forward)
+        elif float(first) < 0.1 and self.lower != self.start_key:
+            self.schedule(self.load_backward)
+
+    def schedule(self, load):
+        self.loading = True
+
+        def run():
+            try:
+                load()
+            finally:
+                self.loading = False
+        self.after_idle(run)
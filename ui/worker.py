@@ -0,0 +1,125 @@
+"""Runs database jobs off the Tk main loop
+
+A single worker thread runs the submitted jobs one after another with its own connections. Results,
+errors and progress are queued and handed to the callbacks on the Tk thread by polling with after(),
+so Tk is only ever touched by its own thread.
+"""
+import queue
+import sqlite3
+import threading
+
+import database
+
+
+class Cancelled(Exception):
+    """A job was cancelled by the user"""
+
+
+class Job:
+    """A submitted job. function(db, job) runs on the worker, it can call job.check() and job.report()."""
+    def __init__(self, worker, direction, function, done, failed, progress):
+        self.worker = worker
+        self.direction = direction
+        self.function = function
+        self.done = done
+        self.failed = failed
+        self.progress = progress
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def check(self):
+        """Raises Cancelled once the job was cancelled"""
+        if self.cancelled.is_set():
+            raise Cancelled()
+
+    def report(self, value=None, text=None):
+        """Passes progress, e.g. a percentage and a message, to the progress callback"""
+        if self.progress:
+            self.worker.results.put((self.progress, (value, text)))
+
+
+class Worker:
+    """Worker thread with one connection per database file
+
+    Running SQL of a cancelled job is interrupted through the progress handler of the connection.
+    """
+    def __init__(self, root, interval=50):
+        self.root = root
+        self.interval = interval
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.current = None
+        self.connections = {}  # direction -> Db, only used by the worker thread
+        self.thread = threading.Thread(target=self.run, name="database-worker", daemon=True)
+        self.thread.start()
+        self.root.after(self.interval, self.poll)
+
+    def submit(self, direction, function, done=None, failed=None, progress=None):
+        """Runs function(db, job) on the worker, db is None without direction
+
+        done(result), failed(error) and progress(value, text) are called on the Tk thread.
+        A cancelled job fails with Cancelled. Without failed, errors are raised on the Tk thread.
+        """
+        job = Job(self, direction, function, done, failed or self.raise_error, progress)
+        self.jobs.put(job)
+        return job
+
+    def connection(self, direction):
+        if direction not in self.connections:
+            db = database.Db(direction, bootstrap=False)
+            db.conn.set_progress_handler(self.interrupt, 10000)
+            self.connections[direction] = db
+        return self.connections[direction]
+
+    def interrupt(self):
+        return 1 if self.current and self.current.cancelled.is_set() else 0
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            self.current = job
+            try:
+                job.check()
+                db = self.connection(job.direction) if job.direction else None
+                self.results.put((job.done, (job.function(db, job),)))
+            except sqlite3.OperationalError as error:
+                self.results.put((job.failed, (Cancelled() if job.cancelled.is_set() else error,)))
+            except Exception as error:
+                self.results.put((job.failed, (error,)))
+            finally:
+                self.current = None
+        for db in self.connections.values():
+            db.close()
+
+    def poll(self):
+        try:
+            while True:
+                callback, arguments = self.results.get_nowait()
+                if callback:
+                    callback(*arguments)
+        except queue.Empty:
+            pass
+        finally:
+            self.root.after(self.interval, self.poll)
+
+    @staticmethod
+    def raise_error(error):
+        if not isinstance(error, Cancelled):
+            raise error
+
+    def discard(self, direction, done=None):
+        """Closes the worker connection to a database file, e.g. before it is deleted. done is called after."""
+        def close(db, job):
+            if direction in self.connections:
+                self.connections.pop(direction).close()
+        return self.submit(None, close, done)
+
+    def close(self):
+        """Cancels the running job and stops the thread after the queued jobs"""
+        if self.current:
+            self.current.cancel()
+        self.jobs.put(None)